@@ -8,6 +8,7 @@ from foursight_core.checks.helpers import wrangler_utils
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers.utils import search_with_fields
 
 
 STATUS_LEVEL = {
@@ -33,6 +34,10 @@ STATUS_LEVEL = {
     'obsolete': 0,
 }
 
+# fields requested from searches, so checks do not pull full embedded frames
+PAIRED_END_FIELDS = ['@id']
+PAGE_CHILDREN_FIELDS = ['name', 'children.name']
+
 
 @check_function()
 def paired_end_info_consistent(connection, **kwargs):
@@ -44,8 +49,8 @@ def paired_end_info_consistent(connection, **kwargs):
     search1 = 'search/?type=FileFastq&file_format.file_format=fastq&related_files.relationship_type=paired+with&paired_end=No+value'
     search2 = 'search/?type=FileFastq&file_format.file_format=fastq&related_files.relationship_type!=paired+with&paired_end%21=No+value'
 
-    results1 = ff_utils.search_metadata(search1 + '&frame=object', key=connection.ff_keys)
-    results2 = ff_utils.search_metadata(search2 + '&frame=object', key=connection.ff_keys)
+    results1 = search_with_fields(search1, PAIRED_END_FIELDS, connection.ff_keys)
+    results2 = search_with_fields(search2, PAIRED_END_FIELDS, connection.ff_keys)
 
     results = {'paired with file missing paired_end number':
                [result1['@id'] for result1 in results1],
@@ -152,7 +157,7 @@ def page_children_routes(connection, **kwargs):
     check = CheckResult(connection, 'page_children_routes')
 
     page_search = 'search/?type=Page&format=json&children.name%21=No+value'
-    results = ff_utils.search_metadata(page_search, key=connection.ff_keys)
+    results = search_with_fields(page_search, PAGE_CHILDREN_FIELDS, connection.ff_keys)
     problem_routes = {}
     for result in results:
         if result['name'] != 'resources/data-collections':
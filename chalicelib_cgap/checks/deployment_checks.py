@@ -4,7 +4,7 @@ import shutil
 import datetime
 import tempfile
 from git import Repo
-from dcicutils.beanstalk_utils import compute_cgap_prd_env, compute_ff_prd_env, beanstalk_info
+from dcicutils.beanstalk_utils import compute_cgap_prd_env, compute_ff_prd_env
 from dcicutils.deployment_utils import EBDeployer
 from dcicutils.env_utils import is_fourfront_env, is_cgap_env, indexer_env_for_env
 from dcicutils.ff_utils import get_metadata
@@ -15,18 +15,14 @@ from ..vars import FOURSIGHT_PREFIX, DEV_ENV
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers.eb_utils import clear_describe_cache, describe_environment
 
 
 def try_to_describe_indexer_env(env):
-    """ Small helper that wraps beanstalk_info so we can recover from exceptions
-        XXX: Fix beanstalk_info so it will not throw IndexError if you give it bad env
+    """ Small helper that describes the given EB env, returning None if it does not exist.
+        Uses the describe cache shared with other checks in this scheduling window.
     """
-    try:
-        return beanstalk_info(env)
-    except IndexError:
-        return None  # env does not exist
-    except Exception:
-        raise  # something else happened we should (probably) raise
+    return describe_environment(env)
 
 
 def clone_repo_to_temporary_dir(repo='https://github.com/4dn-dcic/fourfront.git', name='fourfront', branch='master'):
@@ -110,6 +106,7 @@ def terminate_indexer_server(connection, **kwargs):
     if env_to_terminate:
         client = boto3.client('elasticbeanstalk')
         success = EBDeployer.terminate_indexer_env(client, env_to_terminate)
+        clear_describe_cache(env_to_terminate)
         if success:
             action.status = 'DONE'
             action.output = 'Successfully triggered termination of indexer env %s' % env_to_terminate
@@ -148,7 +145,9 @@ def provision_indexer_environment(connection, **kwargs):
             check.summary = 'Tried to spin up indexer env for %s when one already exists for this portal' % e
             return False
         else:
-            return EBDeployer.deploy_indexer(e, version)
+            success = EBDeployer.deploy_indexer(e, version)
+            clear_describe_cache(indexer_env_for_env(e))
+            return success
 
     if is_cgap_env(env) or is_fourfront_env(env):
         success = _deploy_indexer(env, application_version)
@@ -234,14 +233,22 @@ def deploy_env(connection, env_to_deploy, application_name, check, **kwargs):
         deploys the environment, or returns an error.
     """
     this_check = CheckResult(connection, check)
+    # skip cloning and packaging the repo if there is nothing to deploy to
+    description = describe_environment(env_to_deploy)
+    if description is None:
+        this_check.status = 'ERROR'
+        this_check.summary = 'Env %s does not exist, nothing to deploy to' % env_to_deploy
+        return this_check
     helper_check = _deploy_application_to_beanstalk(connection,
                                                     env=env_to_deploy,
                                                     branch='master',
                                                     **kwargs)
+    clear_describe_cache(env_to_deploy)
     if helper_check.status == 'PASS':
         this_check.status = 'PASS'
         this_check.summary = ('Successfully deployed {what} master to {where}'
                               .format(what=application_name, where=env_to_deploy))
+        this_check.full_output = {'previous_version': description.get('VersionLabel')}
     else:
         this_check.status = 'ERROR'
         this_check.summary = 'Error occurred during deployment, see full_output'
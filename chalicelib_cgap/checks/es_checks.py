@@ -1,4 +1,3 @@
-import time
 import datetime
 
 # Use confchecks to import decorators object and its methods for each check module
@@ -6,90 +5,163 @@ import datetime
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers.check_store_utils import (
+    DEFAULT_MIGRATION_WORKERS,
+    DEFAULT_RECONCILE_WORKERS,
+    DEFAULT_SWEEP_WORKERS,
+    MAX_REPORTED_MISSING,
+    CheckStoreMigrator,
+    load_reconciliation_index,
+    load_resume_markers,
+    reconcile_s3_es,
+    save_reconciliation_index,
+    save_resume_marker,
+    sweep_checks,
+)
 
 
-@check_function(action="migrate_checks_to_es")
+@check_function(action="migrate_checks_to_es", timeout=240, workers=DEFAULT_RECONCILE_WORKERS)
 def elasticsearch_s3_count_diff(connection, **kwargs):
-    """ Reports the difference between the number of files on s3 and es """
+    """
+    Reports the check results on s3 that are not on es, by check name.
+    Works incrementally from a stored reconciliation index: only results
+    stored since the last run, and those missing from es last run, are
+    looked up in es, a page of s3 keys at a time. Checks not reached or not
+    finished within the timeout are picked up where they stopped next run.
+    """
     check = CheckResult(connection, 'elasticsearch_s3_count_diff')
     check.action = 'migrate_checks_to_es'
     s3 = connection.connections['s3']
     es = connection.connections['es']
-    n_s3_keys = s3.get_size()
-    n_es_keys = es.get_size()
-    difference = n_s3_keys - n_es_keys
+    time_limit = 240 if kwargs.get('timeout') is None else kwargs.get('timeout')
+    index, names, reconciled, n_new_keys = reconcile_s3_es(
+        s3, es, index=load_reconciliation_index(s3),
+        workers=int(kwargs.get('workers') or DEFAULT_RECONCILE_WORKERS), time_limit=time_limit
+    )
+    save_reconciliation_index(s3, index)
+    n_missing = {name: len(entry['missing']) for name, entry in index.items() if entry['missing']}
+    difference = sum(n_missing.values())
     full_output = {}
-    full_output['n_s3_keys'] = n_s3_keys
-    full_output['n_es_keys'] = n_es_keys
     full_output['difference'] = difference
+    full_output['n_missing'] = n_missing
+    # at most MAX_REPORTED_MISSING keys per check; the action copies these
+    full_output['missing'] = {
+        name: index[name]['missing'][:MAX_REPORTED_MISSING] for name in n_missing
+    }
+    full_output['es_max_timestamp'] = {name: index[name].get('es_max_timestamp') for name in n_missing}
+    full_output['n_new_keys'] = n_new_keys
+    full_output['checks_reconciled'] = len(reconciled)
+    # including checks new to the index, which have no entry until reached
+    not_reached = sorted(set(names) - set(reconciled))
+    full_output['checks_not_reached'] = not_reached
+    # checks with so many results missing that listing waits for them to be migrated
+    full_output['checks_capped'] = sorted(name for name, entry in index.items() if entry.get('capped'))
+    check.allow_action = difference > 0
     if difference > 1000:
         check.status = 'FAIL'
-        check.allow_action = True
         check.summary = check.description = 'There are >1000 checks not on ES'
     elif difference > 100:
         check.status = 'WARN'
-        check.allow_action = True
         check.summary = check.description = 'There are >100 but <1000 checks not on ES'
     else:
-        check.status = 'PASS'
-        check.allow_action = False
+        # checks not looked at may be missing any number of results
+        check.status = 'WARN' if not_reached else 'PASS'
         check.summary = check.description = 'There are <100 checks not on ES'
+    if not_reached:
+        check.summary += '; %s checks not reached, continued next run' % len(not_reached)
+        check.description = check.summary
     check.full_output = full_output
     return check
 
 
-@action_function(timeout=270)
+@action_function(timeout=270, workers=DEFAULT_MIGRATION_WORKERS, resume=True)
 def migrate_checks_to_es(connection, **kwargs):
     """
-    Migrates checks from s3 to es. If a check name is given only those
-    checks will be migrated
+    Migrates checks from s3 to es. When run from elasticsearch_s3_count_diff,
+    copies exactly the keys it reported missing. Otherwise, if a check name
+    is given only those checks will be migrated; keys are listed page by
+    page, fetched from s3 concurrently and indexed with the ES bulk API.
+    The last migrated key is stored so, with resume=True, the next run
+    picks up after it.
     """
-    t0 = time.time()
     time_limit = 270 if kwargs.get('timeout') is None else kwargs.get('timeout')
     action = ActionResult(connection, 'migrate_checks_to_es')
-    action_logs = {'time out': False}
     s3 = connection.connections['s3']
     es = connection.connections['es']
+    migrator = CheckStoreMigrator(s3, es, workers=int(kwargs.get('workers') or DEFAULT_MIGRATION_WORKERS))
+    if kwargs.get('called_by'):
+        check_result = action.get_associated_check_result(kwargs) or {}
+        missing = (check_result.get('full_output') or {}).get('missing', {})
+        keys = sorted(key for check_keys in missing.values() for key in check_keys)
+        action.description = 'Migrating %s missing checks from s3 to ES' % len(keys)
+        migrator.run_keys(keys, time_limit=time_limit)
+        action.status = 'FAIL' if migrator.exit_reason.startswith('error') else 'DONE'
+        action.output = migrator.stats()
+        return action
     check = kwargs.get('check')
     if check is not None:
         action.description = 'Migrating check %s from s3 to ES' % check
-        s3_keys = s3.list_all_keys_w_prefix(check)
+        prefix = check.rstrip('/') + '/'
     else:
         action.description = 'Migrating all checks from s3 to ES'
-        s3_keys = s3.list_all_keys()
-    n_migrated = 0
-    for key in s3_keys:
-        if kwargs.get('timeout') and round(time.time() - t0, 2) > time_limit:
-            action_logs['time out'] = True
-            break
-        if 'action_records' in key: # ignore action_records for now
-            continue
-        if es.put_object(key, s3.get_object(key)): # put object by default
-            n_migrated += 1
-    action.status = 'DONE'
-    action_logs['n_migrated'] = n_migrated
+        prefix = ''
+    start_after = load_resume_markers(s3).get(prefix) if kwargs.get('resume', True) else None
+    migrator.run(prefix=prefix, start_after=start_after, time_limit=time_limit)
+    save_resume_marker(s3, prefix, None if migrator.complete else migrator.last_key)
+    action_logs = migrator.stats()
+    action_logs['time out'] = migrator.exit_reason == 'out of time'
+    action_logs['resumed_after'] = start_after
+    action.status = 'FAIL' if migrator.exit_reason.startswith('error') else 'DONE'
     action.output = action_logs
     return action
 
 
-@check_function(timeout=270, days=30, to_clean=None)
+@check_function(timeout=270, days=30, to_clean=None, sweep_all=False, workers=DEFAULT_SWEEP_WORKERS)
 def clean_s3_es_checks(connection, **kwargs):
     """
     Cleans old checks from both s3 and es older than one month. Must be called
-    from a specific check as it will take too long otherwise.
+    from a specific check as it will take too long otherwise, unless
+    sweep_all is set: then all checks are swept concurrently, deleting every
+    timestamped result before the cutoff (latest and primary results, and
+    results run as primary, are kept) with batched s3 deletes and an es delete by date range. Checks not
+    finished in time are swept first on the next run.
     """
     check_to_clean = kwargs.get('to_clean')
     time_limit = kwargs.get('timeout')
     days_back = int(kwargs.get('days'))
     check = CheckResult(connection, 'clean_s3_es_checks')
     full_output = {}
+    past_date = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
+    if kwargs.get('sweep_all'):
+        results, progress = sweep_checks(
+            connection.connections['s3'], connection.connections.get('es'), past_date.isoformat(),
+            workers=int(kwargs.get('workers') or DEFAULT_SWEEP_WORKERS),
+            time_limit=270 if time_limit is None else time_limit
+        )
+        incomplete = sorted(name for name in progress if name not in results or not results[name]['complete'])
+        full_output['cutoff'] = past_date.isoformat()
+        full_output['checks_swept'] = sorted(name for name, result in results.items() if result['complete'])
+        full_output['checks_not_finished'] = incomplete
+        full_output['n_deleted_s3'] = sum(result['s3_objects'] for result in results.values())
+        full_output['bytes_deleted_s3'] = sum(result['s3_bytes'] for result in results.values())
+        full_output['n_deleted_es'] = sum(result['es_documents'] for result in results.values())
+        full_output['n_kept_primary_s3'] = sum(result['s3_kept_primary'] for result in results.values())
+        full_output['by_check'] = {name: result for name, result in results.items() if result['s3_objects']}
+        check.status = 'PASS' if not incomplete else 'WARN'
+        check.summary = check.description = 'Deleted %s s3 results (%s MB) and %s es results' % (
+            full_output['n_deleted_s3'], round(full_output['bytes_deleted_s3'] / (1024 * 1024), 1),
+            full_output['n_deleted_es']
+        )
+        if incomplete:
+            check.summary += '; %s checks left for next run' % len(incomplete)
+        check.full_output = full_output
+        return check
     if check_to_clean is None:
         check.status = 'WARN'
         check.summary = check.description = 'A check must be given to be cleaned'
         check.full_output = full_output
         return check
     clean_check = CheckResult(connection, check_to_clean)
-    past_date = datetime.datetime.utcnow() - datetime.timedelta(days=days_back)
     n_deleted_s3, n_deleted_es = clean_check.delete_results(prior_date=past_date, timeout=time_limit)
     full_output['check_cleared'] = check_to_clean
     full_output['n_deleted_s3'] = n_deleted_s3
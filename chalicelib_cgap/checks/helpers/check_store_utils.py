@@ -0,0 +1,522 @@
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+DEFAULT_MIGRATION_WORKERS = 16
+FETCH_CHUNK_SIZE = 100  # keys fetched concurrently between time checks
+MAX_BULK_DOCS = 500
+MAX_BULK_BYTES = 5 * 1024 * 1024  # well under the default ES http.max_content_length
+MAX_REPORTED_FAILURES = 100
+
+# Migrator state, stored in S3 next to the action's results; not a result
+# key, so it is never migrated itself
+MIGRATION_MARKER_KEY = 'migrate_checks_to_es/resume_marker.json'
+ACTION_RECORDS_PREFIX = 'action_records/'
+RESULT_KEY_REGEX = re.compile(
+    r'^[^/]+/(latest|primary|\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?)\.json$'
+)
+
+
+def is_result_key(key):
+    """True if the S3 key holds a check or action result, i.e. looks like
+    '<name>/<uuid timestamp>.json', '<name>/latest.json' or
+    '<name>/primary.json'.
+    """
+    return not key.startswith(ACTION_RECORDS_PREFIX) and RESULT_KEY_REGEX.match(key) is not None
+
+
+def iter_s3_key_pages(s3, prefix='', start_after=None):
+    """Pages of S3 object summaries (dicts with 'Key' and 'Size') in key
+    order, listed one page of up to 1000 keys at a time.
+    """
+    params = {'Bucket': s3.bucket, 'Prefix': prefix}
+    if start_after:
+        params['StartAfter'] = start_after
+    paginator = s3.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(**params):
+        yield page.get('Contents', [])
+
+
+def load_resume_markers(s3):
+    """Last migrated key by listing prefix, from the previous run."""
+    markers = s3.get_object(MIGRATION_MARKER_KEY)
+    return markers if isinstance(markers, dict) else {}
+
+
+def save_resume_marker(s3, prefix, last_key):
+    """Store last migrated key for prefix; clear it if last_key is None."""
+    markers = load_resume_markers(s3)
+    if last_key is None:
+        markers.pop(prefix, None)
+    else:
+        markers[prefix] = last_key
+    s3.put_object(MIGRATION_MARKER_KEY, json.dumps(markers))
+
+
+class CheckStoreMigrator:
+    """Copy check results from S3 to ES.
+
+    Keys are fetched from S3 concurrently, in chunks so the time limit is
+    checked regularly, and indexed into ES with the bulk API in batches
+    bounded by document count and request size. Results keep the S3 key
+    as their ES id, as with ESConnection.put_object.
+
+    last_key is the last key of the last batch sent to ES, so listing can
+    resume after it. Keys that failed to copy are counted and sampled
+    rather than retried; a later diff reports them as missing.
+    """
+
+    def __init__(self, s3, es, workers=DEFAULT_MIGRATION_WORKERS,
+                 max_bulk_docs=MAX_BULK_DOCS, max_bulk_bytes=MAX_BULK_BYTES):
+        self.s3 = s3
+        self.es = es
+        self.workers = workers
+        self.max_bulk_docs = max_bulk_docs
+        self.max_bulk_bytes = max_bulk_bytes
+        self.migrated = 0
+        self.failed = 0
+        self.failures = []
+        self.skipped = 0
+        self.bytes = 0
+        self.bulk_requests = 0
+        self.last_key = None
+        self.complete = False
+        self.exit_reason = 'out of time'
+        self.elapsed = 0
+        self._batch = []  # (key, ndjson action and source lines)
+        self._batch_bytes = 0
+
+    def _fail(self, key, reason):
+        self.failed += 1
+        if len(self.failures) < MAX_REPORTED_FAILURES:
+            self.failures.append({'key': key, 'error': reason})
+
+    def _fetch(self, key):
+        try:
+            return self.s3.get_object(key)
+        except Exception:
+            return None
+
+    def _add(self, key, doc):
+        if not isinstance(doc, dict):
+            self._fail(key, 'not a JSON object in S3')
+            return
+        lines = '%s\n%s\n' % (json.dumps({'index': {'_id': key}}), json.dumps(doc))
+        self._batch.append((key, lines))
+        self._batch_bytes += len(lines)
+        if len(self._batch) >= self.max_bulk_docs or self._batch_bytes >= self.max_bulk_bytes:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, body = self._batch, ''.join(lines for _, lines in self._batch)
+        self._batch, self._batch_bytes = [], 0
+        res = self.es.es.bulk(body=body, index=self.es.index)
+        self.bulk_requests += 1
+        self.bytes += len(body)
+        for (key, _), item in zip(batch, res['items']):
+            result = item['index']
+            if result.get('error') or result.get('status', 500) >= 300:
+                self._fail(key, str(result.get('error', result.get('status'))))
+            else:
+                self.migrated += 1
+        self.last_key = batch[-1][0]
+
+    def migrate_keys(self, keys, deadline):
+        """Copy the given keys, in order, until the deadline.
+
+        Returns True if all keys were sent to ES in time.
+        """
+        keys = list(keys)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for start in range(0, len(keys), FETCH_CHUNK_SIZE):
+                if time.time() >= deadline:
+                    self._flush()
+                    return False
+                chunk = keys[start: start + FETCH_CHUNK_SIZE]
+                for key, doc in zip(chunk, executor.map(self._fetch, chunk)):
+                    self._add(key, doc)
+        self._flush()
+        return True
+
+    def run_keys(self, keys, time_limit=270):
+        """Copy exactly the given keys until done or time_limit seconds pass."""
+        t0 = time.time()
+        try:
+            self.complete = self.migrate_keys(keys, t0 + time_limit)
+            if self.complete:
+                self.exit_reason = 'all keys migrated'
+        except Exception as e:
+            self.exit_reason = 'error: %s' % str(e)
+        self.elapsed = round(time.time() - t0, 2)
+        return self
+
+    def run(self, prefix='', start_after=None, time_limit=270):
+        """Copy every result key under prefix listed after start_after,
+        until done or time_limit seconds pass.
+        """
+        t0 = time.time()
+        deadline = t0 + time_limit
+        self.last_key = start_after
+        try:
+            for page in iter_s3_key_pages(self.s3, prefix=prefix, start_after=start_after):
+                keys = []
+                for obj in page:
+                    if is_result_key(obj['Key']):
+                        keys.append(obj['Key'])
+                    else:
+                        self.skipped += 1
+                if not self.migrate_keys(keys, deadline):
+                    break
+                if page:
+                    # also move past any trailing keys that were skipped
+                    self.last_key = page[-1]['Key']
+            else:
+                self.complete = True
+                self.exit_reason = 'all keys migrated'
+        except Exception as e:
+            # keep last_key at the last batch ES accepted so a rerun resumes
+            self.exit_reason = 'error: %s' % str(e)
+        self.elapsed = round(time.time() - t0, 2)
+        return self
+
+    @property
+    def keys_per_second(self):
+        return round((self.migrated + self.failed) / self.elapsed, 1) if self.elapsed else 0
+
+    @property
+    def mb_per_second(self):
+        return round(self.bytes / self.elapsed / (1024 * 1024), 2) if self.elapsed else 0
+
+    def stats(self):
+        """Summary for action output."""
+        return {
+            'n_migrated': self.migrated,
+            'n_failed': self.failed,
+            'failures': self.failures,
+            'n_skipped': self.skipped,
+            'bulk_requests': self.bulk_requests,
+            'bytes_indexed': self.bytes,
+            'workers': self.workers,
+            'time': self.elapsed,
+            'keys_per_second': self.keys_per_second,
+            'mb_per_second': self.mb_per_second,
+            'last_key': self.last_key,
+            'complete': self.complete,
+            'exit_reason': self.exit_reason,
+        }
+
+
+# Reconciliation index, stored with the elasticsearch_s3_count_diff results
+RECONCILIATION_KEY = 'elasticsearch_s3_count_diff/reconciliation.json'
+RECONCILIATION_VERSION = 1
+MGET_CHUNK_SIZE = 1000
+MAX_REPORTED_MISSING = 1000  # missing keys per check in check output
+# missing keys per check kept in the index; listing waits for the action past this
+MAX_TRACKED_MISSING = 10000
+DEFAULT_RECONCILE_WORKERS = 8
+
+
+def list_check_names(s3):
+    """Names of all checks and actions with results in S3, from the
+    top level 'directories' of the bucket.
+    """
+    names = []
+    paginator = s3.client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=s3.bucket, Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            name = common_prefix['Prefix'].rstrip('/')
+            if name + '/' != ACTION_RECORDS_PREFIX:
+                names.append(name)
+    return names
+
+
+def key_timestamp(key):
+    """uuid timestamp part of a result key, e.g. '2024-01-01T00:00:00.000000'."""
+    return key.rsplit('/', 1)[-1][:-len('.json')]
+
+
+def keys_missing_from_es(es, keys):
+    """Those of the given keys that are not ids in the ES index, in order."""
+    missing = []
+    for start in range(0, len(keys), MGET_CHUNK_SIZE):
+        chunk = keys[start: start + MGET_CHUNK_SIZE]
+        res = es.es.mget(body={'ids': chunk}, index=es.index, _source=False)
+        missing.extend(doc['_id'] for doc in res['docs'] if not doc.get('found'))
+    return missing
+
+
+def load_reconciliation_index(s3):
+    """Per check name reconciliation state from the previous runs."""
+    stored = s3.get_object(RECONCILIATION_KEY)
+    if not isinstance(stored, dict) or stored.get('version') != RECONCILIATION_VERSION:
+        return {}
+    return stored['checks']
+
+
+def save_reconciliation_index(s3, index):
+    s3.put_object(RECONCILIATION_KEY, json.dumps({'version': RECONCILIATION_VERSION, 'checks': index}))
+
+
+def reconcile_check(s3, es, name, entry, deadline=None):
+    """Bring the reconciliation entry for one check up to date, one S3
+    page at a time until the deadline.
+
+    Only timestamped result keys listed after the entry's last_s3_key are
+    new; they are looked up in ES page by page, after the keys previously
+    found missing, since those may have been migrated since. latest and
+    primary keys are rewritten every run and are not tracked.
+
+    last_s3_key advances with each page looked up, so a check stopped by
+    the deadline resumes there. Listing also stops once MAX_TRACKED_MISSING
+    keys are missing, until the action has copied some of them, so the
+    stored entry stays bounded.
+
+    Entry has last_s3_key, es_max_timestamp (newest result confirmed in
+    ES), missing, the sorted keys not in ES, and capped, True if listing
+    stopped at the missing key limit.
+
+    Returns tuple of (entry, new keys looked up, True if up to date).
+    """
+    entry = dict(entry or {})
+    missing = keys_missing_from_es(es, entry.get('missing', []))
+    entry['missing'] = missing
+    entry['capped'] = False
+    n_new = 0
+    for page in iter_s3_key_pages(s3, prefix=name + '/2', start_after=entry.get('last_s3_key')):
+        if len(missing) >= MAX_TRACKED_MISSING:
+            entry['capped'] = True
+            return entry, n_new, False
+        if deadline is not None and time.time() >= deadline:
+            return entry, n_new, False
+        new_keys = [obj['Key'] for obj in page]
+        if not new_keys:
+            continue
+        page_missing = keys_missing_from_es(es, new_keys)
+        page_missing_set = set(page_missing)
+        present = [key for key in new_keys if key not in page_missing_set]
+        if present:
+            newest = key_timestamp(present[-1])
+            if newest > (entry.get('es_max_timestamp') or ''):
+                entry['es_max_timestamp'] = newest
+        missing.extend(page_missing)
+        entry['last_s3_key'] = new_keys[-1]
+        n_new += len(new_keys)
+    return entry, n_new, True
+
+
+def reconcile_s3_es(s3, es, names=None, index=None, workers=DEFAULT_RECONCILE_WORKERS, time_limit=270):
+    """Reconcile the given (default all) checks concurrently until done or
+    time_limit seconds pass; checks not reached keep their old entry, and
+    checks stopped partway keep the progress made.
+
+    Returns tuple of (updated index, names of the checks to reconcile,
+    names reconciled fully, new keys listed).
+    """
+    deadline = time.time() + time_limit
+    index = dict(index or {})
+    names = list_check_names(s3) if names is None else names
+    reconciled = []
+    n_new_keys = 0
+
+    def reconcile(name):
+        if time.time() >= deadline:
+            return name, None, 0, False
+        return (name,) + reconcile_check(s3, es, name, index.get(name), deadline)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, entry, n_new, complete in executor.map(reconcile, names):
+            if entry is not None:
+                index[name] = entry
+                n_new_keys += n_new
+            if complete:
+                reconciled.append(name)
+    return index, names, reconciled, n_new_keys
+
+
+# Sweep state, stored with the clean_s3_es_checks results
+SWEEP_PROGRESS_KEY = 'clean_s3_es_checks/sweep_progress.json'
+S3_DELETE_BATCH_SIZE = 1000  # max keys per delete_objects call
+DEFAULT_SWEEP_WORKERS = 8
+PRIMARY_READ_WORKERS = 8  # concurrent reads per check when looking for primary results
+TAIL_BYTES = 4096  # end of a result, where its kwargs are stored
+PRIMARY_KWARG = re.compile(r'"primary":\s*true')
+
+
+def load_sweep_progress(s3):
+    """Per check name sweep progress from previous runs."""
+    stored = s3.get_object(SWEEP_PROGRESS_KEY)
+    return stored if isinstance(stored, dict) else {}
+
+
+def is_primary_result(client, bucket, key):
+    """Whether the result at key was stored with kwargs.primary, i.e. from
+    a scheduled run. Results are stored with kwargs at the end, so only the
+    tail of the object is read, falling back to the whole object if
+    kwargs is not in the tail. Results that cannot be read count as
+    primary, so they are kept.
+    """
+    try:
+        tail = client.get_object(Bucket=bucket, Key=key,
+                                 Range='bytes=-%s' % TAIL_BYTES)['Body'].read().decode('utf-8', 'replace')
+        if '"kwargs": {' in tail:
+            return PRIMARY_KWARG.search(tail.rsplit('"kwargs": {', 1)[1]) is not None
+        obj = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+        return bool((obj.get('kwargs') or {}).get('primary'))
+    except Exception:
+        return True
+
+
+def delete_s3_batch(s3, objects):
+    """Delete the given object summaries with one delete_objects call.
+
+    Returns tuple of (objects deleted, bytes deleted).
+    """
+    res = s3.client.delete_objects(Bucket=s3.bucket, Delete={
+        'Objects': [{'Key': obj['Key']} for obj in objects], 'Quiet': True
+    })
+    failed = {error['Key'] for error in res.get('Errors', [])}
+    deleted = [obj for obj in objects if obj['Key'] not in failed]
+    return len(deleted), sum(obj.get('Size', 0) for obj in deleted)
+
+
+def delete_es_results_before(es, name, cutoff):
+    """Delete the ES results of a check with uuid before cutoff, leaving
+    its latest and primary results and results run as primary. Returns
+    number deleted.
+    """
+    query = {'query': {'bool': {
+        'filter': [
+            {'term': {'name.keyword': name}},
+            {'range': {'uuid': {'lt': cutoff}}},
+        ],
+        'must_not': [
+            {'ids': {'values': ['%s/latest.json' % name, '%s/primary.json' % name]}},
+            {'term': {'kwargs.primary': True}},
+        ],
+    }}}
+    res = es.es.delete_by_query(index=es.index, body=query, conflicts='proceed')
+    return res.get('deleted', 0)
+
+
+def sweep_check(s3, es, name, cutoff, deadline):
+    """Delete results of one check with uuid timestamps before cutoff, an
+    isoformat string, from S3 in 1000 key batches and then from ES.
+
+    Only timestamped keys are listed, and listing stops at the first key
+    at or after cutoff since keys sort by time. latest and primary
+    results are kept, as are results run as primary (kwargs.primary), as
+    with CheckResult.delete_results; old results are read to tell.
+
+    Returns dict of S3 objects and bytes and ES documents deleted, S3
+    results kept as primary, and whether the check was swept completely
+    before the deadline.
+    """
+    result = {'s3_objects': 0, 's3_bytes': 0, 's3_kept_primary': 0, 'es_documents': 0, 'complete': False}
+    kept_keys = []
+    cutoff_key = '%s/%s' % (name, cutoff)
+    batch = []
+
+    def flush():
+        n_objects, n_bytes = delete_s3_batch(s3, batch)
+        result['s3_objects'] += n_objects
+        result['s3_bytes'] += n_bytes
+        del batch[:]
+
+    done = False
+    with ThreadPoolExecutor(max_workers=PRIMARY_READ_WORKERS) as executor:
+        for page in iter_s3_key_pages(s3, prefix=name + '/2'):
+            candidates = []
+            for obj in page:
+                if obj['Key'] >= cutoff_key:
+                    done = True
+                    break
+                candidates.append(obj)
+            primary = executor.map(lambda obj: is_primary_result(s3.client, s3.bucket, obj['Key']), candidates)
+            for obj, is_primary in zip(candidates, primary):
+                if is_primary:
+                    kept_keys.append(obj['Key'])
+                    continue
+                batch.append(obj)
+                if len(batch) == S3_DELETE_BATCH_SIZE:
+                    flush()
+            result['s3_kept_primary'] = len(kept_keys)
+            if done:
+                break
+            if time.time() >= deadline:
+                if batch:
+                    flush()
+                return result, kept_keys
+    if batch:
+        flush()
+    if es is not None and time.time() < deadline:
+        result['es_documents'] = delete_es_results_before(es, name, cutoff)
+        result['complete'] = True
+    return result, kept_keys
+
+
+def sweep_checks(s3, es, cutoff, names=None, workers=DEFAULT_SWEEP_WORKERS, time_limit=270):
+    """Sweep the given (default all) checks concurrently, least recently
+    swept first, until done or time_limit seconds pass.
+
+    Progress per check (time and cutoff of its last complete sweep, and
+    running totals) is stored in S3, so checks not reached or not
+    finished are swept first on the next run.
+
+    Returns tuple of (this run's result by check name, stored progress).
+    """
+    deadline = time.time() + time_limit
+    progress = load_sweep_progress(s3)
+    names = list_check_names(s3) if names is None else names
+    names = sorted(names, key=lambda name: progress.get(name, {}).get('swept_at', ''))
+
+    def sweep(name):
+        if time.time() >= deadline:
+            return name, None, None
+        return (name,) + sweep_check(s3, es, name, cutoff, deadline)
+
+    results = {}
+    kept = {}
+    now = datetime.utcnow().isoformat()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, result, kept_keys in executor.map(sweep, names):
+            if result is None:
+                continue
+            results[name] = result
+            kept[name] = set(kept_keys)
+            entry = progress.setdefault(name, {'s3_objects': 0, 's3_bytes': 0, 'es_documents': 0})
+            for count in ('s3_objects', 's3_bytes', 'es_documents'):
+                entry[count] += result[count]
+            if result['complete']:
+                entry['swept_at'] = now
+                entry['swept_to'] = cutoff
+    s3.put_object(SWEEP_PROGRESS_KEY, json.dumps(progress))
+    prune_reconciliation_index(
+        s3, {name: cutoff for name, result in results.items() if result['complete']}, kept
+    )
+    return results, progress
+
+
+def prune_reconciliation_index(s3, cutoffs, kept=None):
+    """Forget missing keys of swept checks that were deleted, i.e. with
+    timestamps before the check's cutoff and not among the check's kept
+    (primary) keys.
+    """
+    kept = kept or {}
+    index = load_reconciliation_index(s3)
+    changed = False
+    for name, cutoff in cutoffs.items():
+        entry = index.get(name)
+        if not entry or not entry['missing']:
+            continue
+        kept_keys = kept.get(name, ())
+        missing = [key for key in entry['missing'] if key_timestamp(key) >= cutoff or key in kept_keys]
+        if len(missing) != len(entry['missing']):
+            entry['missing'] = missing
+            changed = True
+    if changed:
+        save_reconciliation_index(s3, index)
@@ -1,11 +1,99 @@
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dcicutils import ff_utils
 from magma_ff import create_metawfr
 
+from .utils import search_by_identifiers
+
 
 pattern_nospace = re.compile(r'-v[0-9]+$')
 pattern_pretty = re.compile(r' \(v[0-9]+\)$')
 
+# requests made at once for a single case; cases are also cloned in parallel
+DEFAULT_CLONE_WORKERS = 8
+# case fields needed to decide whether to clone a case
+CASE_TO_CLONE_FIELDS = [
+    'accession', 'uuid', 'superseded_by', 'sample_processing.uuid',
+    'meta_workflow_run.meta_workflow.name', 'meta_workflow_run.meta_workflow.version',
+]
+
+# unique fields the clone gives a new value, by posted item type; deleted
+# from posted items on rollback so a later clone can reuse them
+CLONE_UNIQUE_FIELDS = {
+    'sample': ['bam_sample_id', 'aliases'],
+}
+
+
+class CloneError(Exception):
+    """A request needed to clone a case failed.
+
+    journal holds the entries of the clone that were not rolled back.
+    """
+
+    def __init__(self, message, journal=None):
+        super().__init__(message)
+        self.journal = journal or []
+
+
+class CloneJournal:
+    """Ordered record of the items a clone created and patched.
+
+    Each entry is keyed by a clone step (e.g. 'sample:/samples/ABC/') so a
+    clone given the journal of an earlier failed attempt reuses what that
+    attempt did instead of doing it again. Patches keep the body that
+    reverts them, so a failed clone can be rolled back.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = list(entries or [])
+        self._lock = threading.Lock()
+
+    def get(self, step):
+        """Journal entry for the step, or None if it was not done."""
+        with self._lock:
+            for entry in self.entries:
+                if entry['step'] == step:
+                    return entry
+        return None
+
+    def record_post(self, step, item_type, item):
+        with self._lock:
+            self.entries.append({'step': step, 'action': 'post', 'item_type': item_type,
+                                 '@id': item['@id'], 'uuid': item['uuid'],
+                                 'accession': item.get('accession')})
+
+    def record_patch(self, step, item_id, revert, revert_add_on=''):
+        with self._lock:
+            self.entries.append({'step': step, 'action': 'patch', '@id': item_id,
+                                 'revert': revert, 'revert_add_on': revert_add_on})
+
+    def rollback(self, key):
+        """Undo journal entries, newest first: revert patches and set
+        posted items to deleted, without the unique fields the clone set.
+        Returns errors of requests that failed;
+        entries that could not be undone are kept.
+        """
+        errors = []
+        kept = []
+        for entry in reversed(self.entries):
+            try:
+                if entry['action'] == 'patch':
+                    ff_utils.patch_metadata(entry['revert'], entry['@id'], key=key,
+                                            add_on=entry['revert_add_on'])
+                else:
+                    unique_fields = CLONE_UNIQUE_FIELDS.get(entry['item_type'])
+                    add_on = 'delete_fields=' + ','.join(unique_fields) if unique_fields else ''
+                    ff_utils.patch_metadata({'status': 'deleted'}, entry['uuid'], key=key, add_on=add_on)
+            except Exception as e:
+                errors.append(f"{entry['step']}: {e}")
+                kept.append(entry)
+        self.entries = list(reversed(kept))
+        return errors
+
+    def to_list(self):
+        return list(self.entries)
+
 
 def try_request(func, *args, **kwargs):
     try:
@@ -16,14 +104,41 @@ def try_request(func, *args, **kwargs):
         return resp
 
 
+def get_prior_clone_run(action, kwargs):
+    """Cases cloned, and journals of failed clones, from the latest run of
+    the clone action for the same check result.
+
+    Returns tuple of (new cases by old case accession, journals by accession).
+    """
+    latest = action.get_latest_result()
+    if not latest or not kwargs.get('called_by'):
+        return {}, {}
+    if latest.get('kwargs', {}).get('called_by') != kwargs['called_by']:
+        return {}, {}
+    output = latest.get('output') or {}
+    if not isinstance(output, dict):
+        return {}, {}
+    return output.get('clone success', {}), output.get('clone journal', {})
+
+
 class CaseToClone:
+    """Clone a case, its sample processing and samples under a new
+    pipeline version.
+
+    Independent GETs, sample POSTs and per-case POSTs are made
+    concurrently. Every item created or patched is recorded in
+    self.journal; if a request fails, CloneError is raised after the clone
+    is rolled back (or, with rollback=False, left as is so a new
+    CaseToClone given the journal can resume it).
+    """
 
     keep_fields = ['project', 'institution']
     remove_fields = ['uuid', 'submitted_by', 'last_modified', 'schema_version', 'date_created', 'accession']
 
     def __init__(self, accession, key, metawf_uuid, new_version, steps_to_rerun, create_SNV_mwfr=True,
                  keep_SV_mwfr=False, add_bam_to_sample=False, add_gvcf_to_sample=False, add_rck_to_sample=False,
-                 add_vep_to_sp=False, add_fullvcf_to_sp=False):
+                 add_vep_to_sp=False, add_fullvcf_to_sp=False, journal=None, rollback=True,
+                 max_workers=DEFAULT_CLONE_WORKERS):
         self.accession = accession
         self.key = key
         self.metawf_uuid = metawf_uuid
@@ -41,18 +156,31 @@ class CaseToClone:
             'full': add_fullvcf_to_sp
         }
         self.errors = []
-        self.case_metadata = self.get_case_metadata()
-        self.old_sample_processing = self.case_metadata.get('sample_processing')
-        self.sp_metadata = self.get_sp_metadata()
-        self.old_samples = self.sp_metadata.get('samples')
-        self.samples_metadata = self.get_sample_metadata()
-        self.sample_info = self.clone_samples()
-        self.patch_individual_samples()
-        self.new_sp_item = self.clone_sample_processing()
-        self.new_case_dict = self.clone_cases()
-        self.analysis_type = self.get_analysis_type()
-        if self.metawf_uuid and self.analysis_type and self.create_SNV_mwfr:
-           self.meta_wfr = self.add_metawfr()
+        self.journal = journal if isinstance(journal, CloneJournal) else CloneJournal(journal)
+        self.file_types = {}  # processed file @id --> file_type
+        self.rollback_errors = []
+        self.max_workers = max_workers
+        try:
+            self.case_metadata = self.get_case_metadata()
+            self.old_sample_processing = self.case_metadata.get('sample_processing')
+            self.sp_metadata = self.get_sp_metadata()
+            self.old_samples = self.sp_metadata.get('samples')
+            self.samples_metadata = self.get_sample_metadata()
+            self.sample_info = self.clone_samples()
+            self.patch_individual_samples()
+            self.new_sp_item = self.clone_sample_processing()
+            self.new_case_dict = self.clone_cases()
+            self.analysis_type = self.get_analysis_type()
+            if self.metawf_uuid and self.analysis_type and self.create_SNV_mwfr:
+                self.meta_wfr = self.add_metawfr()
+        except Exception as e:
+            self.errors.append(e)
+            if rollback:
+                self.rollback_errors = self.journal.rollback(self.key)
+            message = f'Clone of {accession} failed: {e}'
+            if self.rollback_errors:
+                message += f' (rollback failed: {"; ".join(self.rollback_errors)})'
+            raise CloneError(message, journal=self.journal.to_list()) from e
 
     def append_version_to_value(self, value, pretty=False):
         if value is None:
@@ -73,33 +201,77 @@ class CaseToClone:
         else:
             return resp
 
+    def map_concurrently(self, func, items):
+        """Results of func for each item, in order, with requests made
+        concurrently.
+        """
+        items = list(items)
+        if len(items) < 2:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(len(items), self.max_workers)) as executor:
+            return list(executor.map(func, items))
+
+    def post_item(self, step, body, item_type):
+        """POST an item for the clone step, or reuse the item a resumed
+        clone already created for it. Returns the item @graph entry.
+        """
+        done = self.journal.get(step)
+        if done:
+            return {'@id': done['@id'], 'uuid': done['uuid'], 'accession': done.get('accession')}
+        item = ff_utils.post_metadata(body, item_type, key=self.key)['@graph'][0]
+        self.journal.record_post(step, item_type, item)
+        return item
+
+    def patch_item(self, step, body, item_id, revert, revert_add_on=''):
+        """PATCH an item for the clone step unless a resumed clone already
+        did, journaling the body that reverts it.
+        """
+        if self.journal.get(step):
+            return
+        ff_utils.patch_metadata(body, item_id, key=self.key)
+        self.journal.record_patch(step, item_id, revert, revert_add_on)
+
+    def prefetch_file_types(self, file_ids):
+        """Look up file_type of the given files not yet cached, with one
+        field-projected search (per 100 files) instead of a
+        GET per file.
+        """
+        to_fetch = [file_id for file_id in file_ids if file_id not in self.file_types]
+        if to_fetch:
+            for file_id, result in search_by_identifiers('File', to_fetch, ['file_type'], self.key).items():
+                self.file_types[file_id] = result.get('file_type', '')
+        for file_id in file_ids:
+            self.file_types.setdefault(file_id, '')
+        return self.file_types
+
     def get_case_metadata(self):
         return ff_utils.get_metadata(self.accession + '?frame=raw', key=self.key)
 
     def get_sp_metadata(self):
-        if self.old_sample_processing:
-            return ff_utils.get_metadata(self.old_sample_processing + '?frame=object', key=self.key)
+        if not self.old_sample_processing:
+            raise CloneError(f'Case {self.accession} has no sample processing')
+        return ff_utils.get_metadata(self.old_sample_processing + '?frame=object', key=self.key)
 
     def get_sample_metadata(self):
-        samples_metadata = []
-        if self.old_samples:
-            for sample in self.old_samples:
-                resp = try_request(ff_utils.get_metadata, sample + '?frame=raw', key=self.key)
-                if resp:
-                    samples_metadata.append(resp)
-        return samples_metadata
+        if not self.old_samples:
+            return []
+        return self.map_concurrently(
+            lambda sample: ff_utils.get_metadata(sample + '?frame=raw', key=self.key), self.old_samples
+        )
 
     def clone_samples(self):
         if not self.samples_metadata:
-            return
+            return {}
         sample_info = {}
         sample_ids = [result['uuid'] for result in self.samples_metadata]
-        search_url = f'search/?type=Sample&uuid={"&uuid=".join(sample_ids)}&field=individual&field=processed_files'
+        search_url = (f'search/?type=Sample&uuid={"&uuid=".join(sample_ids)}&field=individual'
+                      f'&field=processed_files&field=processed_files.file_type')
         sample_individual_search = ff_utils.search_metadata(search_url, key=self.key)
         for search_result in sample_individual_search:
+            sample_info[search_result['@id']] = {}
             # find individual which will need to be patched with new sample
             if 'individual' in search_result:
-                sample_info[search_result['@id']] = {'individual': search_result['individual']['@id']}
+                sample_info[search_result['@id']]['individual'] = search_result['individual']['@id']
             # find processed files
             if 'processed_files' in search_result:
                 sample_info[search_result['@id']]['processed_files'] = []
@@ -107,40 +279,55 @@ class CaseToClone:
                     sample_info[search_result['@id']]['processed_files'].append(
                         {'@id': procfile['@id'], 'filename': procfile['display_title']}
                     )
-        for result in self.samples_metadata:
+                    if 'file_type' in procfile:
+                        self.file_types[procfile['@id']] = procfile['file_type']
+        # cache file types of the other sample processing files for
+        # clone_sample_processing, all in one search
+        if any(self.add_procfiles_to_sp.values()):
+            self.prefetch_file_types(self.sp_metadata.get('processed_files') or [])
+
+        def clone_sample(result):
             sample_id = f'/samples/{result["accession"]}/'
+            result = dict(result)
             for field in self.remove_fields:
                 if field in result:
                     del result[field]
             # change unique fields
-            for field in ['bam_sample_id', 'aliases']:
+            for field in CLONE_UNIQUE_FIELDS['sample']:
                 if field in result:
                     result[field] = self.append_version_to_value(result[field])
             # add indicated processed files to post json
             result['processed_files'] = []
             for k, v in self.add_procfiles_to_sample.items():
                 if v:
-                    matching_files = [item['@id'] for item in sample_info[sample_id]['processed_files']
-                                     if k in item['display_title']]
+                    matching_files = [item['@id'] for item in sample_info[sample_id].get('processed_files', [])
+                                      if k in item['filename']]
                     if matching_files:
                         result['processed_files'].extend(matching_files)
             if not result['processed_files']:
                 del result['processed_files']
-            post_resp = try_request(ff_utils.post_metadata, result, 'sample', key=self.key)
-            if post_resp and sample_id in sample_info:
-                sample_info[sample_id]['new_id'] = post_resp['@graph'][0]['@id']
+            return sample_id, self.post_item('sample:' + sample_id, result, 'sample')['@id']
+
+        for sample_id, new_id in self.map_concurrently(clone_sample, self.samples_metadata):
+            sample_info.setdefault(sample_id, {})['new_id'] = new_id
         return sample_info
 
     def patch_individual_samples(self):
+        # one patch per individual, which may have several of the samples
+        new_samples = {}
         for v in self.sample_info.values():
             if v.get('individual'):
-                individual_metadata = try_request(
-                    ff_utils.get_metadata, v['individual'] + '?frame=object', key=self.key
-                )
-                if not individual_metadata:
-                    continue
-                sample_patch = {'samples': individual_metadata.get('samples', []) + [v['new_id']]}
-                resp = try_request(ff_utils.patch_metadata, sample_patch, v['individual'], key=self.key)
+                new_samples.setdefault(v['individual'], []).append(v['new_id'])
+
+        def patch_individual(individual):
+            individual_metadata = ff_utils.get_metadata(individual + '?frame=object', key=self.key)
+            old_samples = individual_metadata.get('samples', [])
+            to_add = [sample for sample in new_samples[individual] if sample not in old_samples]
+            if to_add:
+                self.patch_item('individual:' + individual, {'samples': old_samples + to_add},
+                                individual, revert={'samples': old_samples})
+
+        self.map_concurrently(patch_individual, new_samples)
 
     def clone_sample_processing(self):
         keep_fields_sp = ['analysis_type', 'families']
@@ -155,17 +342,14 @@ class CaseToClone:
         if self.sp_metadata.get('processed_files'):
             if self.add_procfiles_to_sp['vep'] or self.add_procfiles_to_sp['full']:
                 new_sp_metadata['processed_files'] = []
+                file_types = self.prefetch_file_types(self.sp_metadata['processed_files'])
                 for pfile in self.sp_metadata['processed_files']:
-                    file_resp = try_request(ff_utils.get_metadata, pfile + '?frame=raw', key=self.key)
-                    if file_resp:
-                        for key in self.add_procfiles_to_sp:
-                            if key in file_resp.get('file_type', '') and self.add_procfiles_to_sp[key]:
-                                new_sp_metadata['processed_files'].append(file_resp['@id'])
-                                break
+                    for key in self.add_procfiles_to_sp:
+                        if key in file_types[pfile] and self.add_procfiles_to_sp[key]:
+                            new_sp_metadata['processed_files'].append(pfile)
+                            break
 
-        resp = try_request(ff_utils.post_metadata, new_sp_metadata, 'sample_processing', key=self.key)
-        if resp:
-            return resp['@graph'][0]['@id']
+        return self.post_item('sample_processing', new_sp_metadata, 'sample_processing')['@id']
 
     def clone_cases(self):
         keep_fields_case = [
@@ -173,12 +357,10 @@ class CaseToClone:
         ]
         if self.keep_SV_mwfr:
             keep_fields_case.append('meta_workflow_run_sv')
-        cases = self.sp_metadata.get('cases')
-        new_case_dict = {}
-        for case in cases:
-            old_case_metadata = try_request(ff_utils.get_metadata, case + '?frame=object', key=self.key)
-            if not old_case_metadata:
-                continue
+        cases = self.sp_metadata.get('cases') or []
+
+        def clone_case(case):
+            old_case_metadata = ff_utils.get_metadata(case + '?frame=object', key=self.key)
             new_case_metadata = {}
             for field in self.keep_fields + keep_fields_case:
                 if field in old_case_metadata:
@@ -193,19 +375,22 @@ class CaseToClone:
                     'project': old_case_metadata['project'],
                     'institution': old_case_metadata['institution']
                 }
-                report = try_request(ff_utils.post_metadata, new_report_json, 'report', key=self.key)
-                if report:
-                    new_case_metadata['report'] = report['@graph'][0]['@id']
-
-            post_resp = try_request(ff_utils.post_metadata, new_case_metadata, 'case', key=self.key)
-            if post_resp:
-                new_accession = post_resp['@graph'][0]['accession']
-                new_case_dict[old_case_metadata['accession']] = {
-                    'new case uuid': post_resp['@graph'][0]['uuid'],
-                    'new case accession': new_accession
-                }
-                patch_resp = try_request(ff_utils.patch_metadata, {'superseded_by': new_accession},
-                                         old_case_metadata['@id'], key=self.key)
+                report = self.post_item('report:' + case, new_report_json, 'report')
+                new_case_metadata['report'] = report['@id']
+
+            new_case = self.post_item('case:' + case, new_case_metadata, 'case')
+            return old_case_metadata, new_case
+
+        cloned = self.map_concurrently(clone_case, cases)
+        # mark old cases superseded only once every new case exists
+        new_case_dict = {}
+        for old_case_metadata, new_case in cloned:
+            self.patch_item('superseded_by:' + old_case_metadata['@id'], {'superseded_by': new_case['accession']},
+                            old_case_metadata['@id'], revert={}, revert_add_on='delete_fields=superseded_by')
+            new_case_dict[old_case_metadata['accession']] = {
+                'new case uuid': new_case['uuid'],
+                'new case accession': new_case['accession']
+            }
         return new_case_dict
 
     def get_analysis_type(self):
@@ -226,14 +411,20 @@ class CaseToClone:
         return 'proband'
 
     def add_metawfr(self):
+        # built without posting, so the POST and the case PATCH are journaled
+        case_uuid = self.new_case_dict[self.case_metadata['accession']]['new case uuid']
         metawfr_json = create_metawfr.create_metawfr_from_case(
             metawf_uuid=self.metawf_uuid,
-            case_uuid=self.new_case_dict[self.accession]['new case uuid'],
+            case_uuid=case_uuid,
             type=f'WGS {self.analysis_type}',
             ff_key=self.key,
-            post=True,
-            patch_case=True,
+            post=False,
+            patch_case=False,
             verbose=False)
+        metawfr = self.post_item('meta_workflow_run', metawfr_json, 'MetaWorkflowRun')
+        metawfr_json['uuid'] = metawfr['uuid']
+        self.patch_item('meta_workflow_run:' + case_uuid, {'meta_workflow_run': metawfr['uuid']}, case_uuid,
+                        revert={}, revert_add_on='delete_fields=meta_workflow_run')
         # keep commented out lines below for future development
         # metawfr_json = import_metawfr.import_metawfr(
         #     metawf_uuid=self.metawf_uuid,
@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+
+# Describe results are shared by checks running in the same lambda within
+# this many seconds, i.e. within one scheduling window
+DESCRIBE_CACHE_TTL = 60
+DEFAULT_MAX_WORKERS = 8
+EB_APPLICATION_NAME = '4dn-web'
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def clear_describe_cache(env=None):
+    """Drop cached describe results, for the given env only if given.
+
+    Call after changing an environment so later checks see its new state.
+    """
+    with _cache_lock:
+        if env is None:
+            _cache.clear()
+        else:
+            for key in [key for key in _cache if env in key]:
+                del _cache[key]
+
+
+def _cached(key, fetch, ttl=DESCRIBE_CACHE_TTL):
+    """Get value for key from cache if fresh, otherwise fetch and cache it."""
+    now = time.time()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+    value = fetch()
+    with _cache_lock:
+        _cache[key] = (now + ttl, value)
+    return value
+
+
+def _client(client):
+    return client or boto3.client('elasticbeanstalk')
+
+
+def describe_environment(env, client=None):
+    """Description of a live Elastic Beanstalk environment, or None if
+    there is no such environment.
+    """
+    def fetch():
+        resp = _client(client).describe_environments(EnvironmentNames=[env], IncludeDeleted=False)
+        environments = resp.get('Environments', [])
+        return environments[0] if environments else None
+    return _cached(('environment', env), fetch)
+
+
+def describe_environment_health(env, client=None):
+    """All health attributes of an environment."""
+    return _cached(('environment_health', env), lambda: _client(client).describe_environment_health(
+        EnvironmentName=env, AttributeNames=['All']
+    ))
+
+
+def describe_instances_health(env, client=None):
+    """All health attributes of each instance of an environment."""
+    return _cached(('instances_health', env), lambda: _client(client).describe_instances_health(
+        EnvironmentName=env, AttributeNames=['All']
+    ))
+
+
+def describe_application_versions(version_labels, application=EB_APPLICATION_NAME, client=None):
+    """Descriptions of the given application versions, keyed by label.
+
+    Each distinct label is described once, concurrently, and cached.
+    """
+    client = _client(client)
+
+    def fetch(label):
+        versions = client.describe_application_versions(
+            ApplicationName=application, VersionLabels=[label]
+        ).get('ApplicationVersions', [])
+        return versions[0] if versions else None
+
+    labels = list(dict.fromkeys(version_labels))
+    if not labels:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(len(labels), DEFAULT_MAX_WORKERS)) as executor:
+        versions = executor.map(
+            lambda label: _cached(('application_version', application, label), lambda: fetch(label)),
+            labels
+        )
+        return dict(zip(labels, versions))
+
+
+def collect_environment_health(env, application=EB_APPLICATION_NAME, client=None):
+    """Environment health, instance health and the deployed application
+    versions of an environment, with the two health calls made
+    concurrently.
+
+    Returns tuple of (environment health, instances health, versions by label).
+    """
+    client = _client(client)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        env_health = executor.submit(describe_environment_health, env, client)
+        instances_health = executor.submit(describe_instances_health, env, client)
+        env_health, instances_health = env_health.result(), instances_health.result()
+    labels = [instance['Deployment']['VersionLabel']
+              for instance in instances_health.get('InstanceHealthList', [])]
+    versions = describe_application_versions(labels, application=application, client=client)
+    return env_health, instances_health, versions
@@ -0,0 +1,229 @@
+import base64
+import json
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+
+# Stored next to the item_counts_by_type results; not a timestamped record,
+# so it is not listed among check results
+SERIES_KEY = "item_counts_by_type/series.json"
+SERIES_VERSION = 1
+# Oldest point kept; change_in_item_counts looks back one day
+MAX_SERIES_AGE = timedelta(days=8)
+MISSING = -1  # Count placeholder for types absent at a point
+EPOCH = datetime(1970, 1, 1)
+COUNT_KEYS = ("DB", "ES")
+
+
+def to_epoch(timestamp):
+    """Seconds since epoch for naive UTC datetime."""
+    return (timestamp - EPOCH).total_seconds()
+
+
+def from_epoch(seconds):
+    """Naive UTC datetime for seconds since epoch."""
+    return EPOCH + timedelta(seconds=seconds)
+
+
+def _encode(values):
+    return base64.b64encode(values.tobytes()).decode("ascii")
+
+
+def _decode(typecode, encoded, byteorder):
+    values = array(typecode)
+    values.frombytes(base64.b64decode(encoded))
+    if byteorder != sys.byteorder:
+        values.byteswap()
+    return values
+
+
+class ItemCountSeries:
+    """Append-only time series of per-type DB/ES item counts.
+
+    Times and counts are kept in parallel typed arrays (one pair of count
+    arrays per item type), so a point is a single index and the latest
+    point is always the last one. Points are added in time order by
+    item_counts_by_type, and lookups by time bisect the times array.
+    """
+
+    def __init__(self):
+        self.times = array("d")
+        self.counts = {}  # item type --> {"DB": array, "ES": array}
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, timestamp, item_counts):
+        """Add counts, as given in item_counts_by_type full_output, for
+        the given time.
+        """
+        size = len(self.times)
+        self.times.append(to_epoch(timestamp))
+        for item_type, counts in item_counts.items():
+            if item_type not in self.counts:
+                self.counts[item_type] = {
+                    count_key: array("q", [MISSING] * size) for count_key in COUNT_KEYS
+                }
+            for count_key in COUNT_KEYS:
+                self.counts[item_type][count_key].append(counts[count_key])
+        for item_type, type_counts in self.counts.items():
+            if item_type not in item_counts:
+                for count_key in COUNT_KEYS:
+                    type_counts[count_key].append(MISSING)
+
+    def trim(self, oldest):
+        """Drop points older than the given time."""
+        drop = bisect_left(self.times, to_epoch(oldest))
+        if not drop:
+            return
+        del self.times[:drop]
+        for item_type in list(self.counts):
+            for count_key in COUNT_KEYS:
+                del self.counts[item_type][count_key][:drop]
+            if all(count == MISSING for count in self.counts[item_type]["DB"]):
+                del self.counts[item_type]
+
+    def time_at(self, idx):
+        """Time of point at given index."""
+        return from_epoch(self.times[idx])
+
+    def closest_index(self, timestamp):
+        """Index of point closest in time to given timestamp, or None if
+        the series is empty.
+        """
+        if not self.times:
+            return None
+        target = to_epoch(timestamp)
+        idx = bisect_left(self.times, target)
+        if idx == len(self.times):
+            return idx - 1
+        if idx > 0 and target - self.times[idx - 1] <= self.times[idx] - target:
+            return idx - 1
+        return idx
+
+    def counts_at(self, idx):
+        """Counts at given index in item_counts_by_type full_output
+        format, omitting types absent at that point.
+        """
+        result = {}
+        for item_type, type_counts in self.counts.items():
+            if type_counts["DB"][idx] != MISSING:
+                result[item_type] = {
+                    count_key: type_counts[count_key][idx] for count_key in COUNT_KEYS
+                }
+        return result
+
+    def unindexed_at(self, idx):
+        """Total items in DB but not yet in ES at given index."""
+        total = self.counts.get("ALL")
+        if total is None or total["DB"][idx] == MISSING:
+            return None
+        return total["DB"][idx] - total["ES"][idx]
+
+    def to_json(self):
+        return json.dumps({
+            "version": SERIES_VERSION,
+            "byteorder": sys.byteorder,
+            "times": _encode(self.times),
+            "counts": {
+                item_type: {
+                    count_key: _encode(type_counts[count_key]) for count_key in COUNT_KEYS
+                }
+                for item_type, type_counts in self.counts.items()
+            },
+        })
+
+    @classmethod
+    def from_dict(cls, stored):
+        series = cls()
+        if not stored or stored.get("version") != SERIES_VERSION:
+            return series
+        byteorder = stored["byteorder"]
+        series.times = _decode("d", stored["times"], byteorder)
+        for item_type, type_counts in stored["counts"].items():
+            series.counts[item_type] = {
+                count_key: _decode("q", type_counts[count_key], byteorder)
+                for count_key in COUNT_KEYS
+            }
+        return series
+
+
+def regression_slope(xs, ys):
+    """Least-squares slope of ys over xs; 0 if xs do not vary."""
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs)
+    if not denominator:
+        return 0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+
+
+def forecast_indexing(series, window):
+    """Forecast indexing from points in the trailing time window.
+
+    For each item type with a backlog (DB count above ES count), fit the
+    backlog over time to get the net items indexed per minute, and the
+    minutes until the backlog is cleared at that rate. Type "ALL" gives
+    the totals.
+
+    :param series: Item count series
+    :type series: ItemCountSeries
+    :param window: Trailing time span of points used
+    :type window: datetime.timedelta
+    :returns: Forecast, or None if fewer than 2 points in window
+    :rtype: dict or None
+    """
+    end = len(series)
+    if end < 2:
+        return None
+    start = bisect_left(series.times, series.times[-1] - window.total_seconds())
+    start = min(start, end - 2)
+    result = {
+        "window_minutes": round((series.times[-1] - series.times[start]) / 60, 1),
+        "snapshots": end - start,
+        "types": {},
+    }
+    for item_type, type_counts in series.counts.items():
+        minutes = []
+        backlogs = []
+        for idx in range(start, end):
+            if type_counts["DB"][idx] == MISSING:
+                continue
+            minutes.append((series.times[idx] - series.times[start]) / 60)
+            backlogs.append(type_counts["DB"][idx] - type_counts["ES"][idx])
+        if len(backlogs) < 2 or (backlogs[-1] <= 0 and item_type != "ALL"):
+            continue
+        rate = -regression_slope(minutes, backlogs)
+        backlog = backlogs[-1]
+        eta = round(backlog / rate) if rate > 0 and backlog > 0 else None
+        result["types"][item_type] = {
+            "backlog": backlog,
+            "items_per_minute": round(rate, 2),
+            "eta_minutes": eta,
+        }
+    return result
+
+
+def load_item_count_series(check):
+    """Load series stored alongside the given check's results; empty if
+    none stored yet.
+    """
+    stored = check.get_s3_object(SERIES_KEY)
+    if not isinstance(stored, dict):
+        stored = None
+    return ItemCountSeries.from_dict(stored)
+
+
+def record_item_counts(check, item_counts, timestamp=None):
+    """Append counts to the stored series, dropping old points."""
+    if timestamp is None:
+        timestamp = datetime.utcnow()
+    series = load_item_count_series(check)
+    if series.times and to_epoch(timestamp) <= series.times[-1]:
+        return series
+    series.append(timestamp, item_counts)
+    series.trim(timestamp - MAX_SERIES_AGE)
+    check.connections["s3"].put_object(SERIES_KEY, series.to_json())
+    return series
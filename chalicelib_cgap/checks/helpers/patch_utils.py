@@ -0,0 +1,207 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from dcicutils import ff_utils
+
+
+# Keep concurrency modest; every worker is a live request against the portal
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 3
+# Status codes worth retrying, PATCHes are idempotent so a repeat is safe
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Format of errors raised by ff_utils.standard_request_with_retries
+STATUS_CODE_PATTERN = re.compile(r"^Bad status code for \w+ request for \S+: (\d{3})")
+CONNECTION_ERROR_PREFIX = "Error with "
+
+
+def is_transient_error(error):
+    """Determine if a PATCH error is worth retrying.
+
+    Connection-level failures and 429/5xx responses are considered
+    transient; validation errors and other 4xx responses are not.
+    """
+    message = str(error)
+    if message.startswith(CONNECTION_ERROR_PREFIX):
+        return True
+    match = STATUS_CODE_PATTERN.match(message)
+    if match:
+        return int(match.group(1)) in TRANSIENT_STATUS_CODES
+    return False
+
+
+class PatchReport:
+    """Uniform success/failure report for a bulk PATCH."""
+
+    def __init__(self):
+        self.success = []
+        self.error = {}
+        self.not_attempted = []
+        self.skipped = []
+        self.retries = 0
+        self.elapsed = 0
+
+    def to_dict(self):
+        """Format report for action output."""
+        return {
+            "success": self.success,
+            "error": self.error,
+            "not_attempted": self.not_attempted,
+            "skipped_as_done": self.skipped,
+            "stats": {
+                "patched": len(self.success),
+                "failed": len(self.error),
+                "not_attempted": len(self.not_attempted),
+                "retries": self.retries,
+                "seconds": self.elapsed,
+            },
+        }
+
+
+def _seconds_left(start, time_limit):
+    """Seconds remaining before time limit, or None if no limit."""
+    if time_limit is None:
+        return None
+    return time_limit - (datetime.utcnow() - start).total_seconds()
+
+
+def _patch_with_retries(obj_id, patch_body, key, add_on, max_attempts, start, time_limit):
+    """PATCH a single item, retrying transient errors with backoff while
+    time remains.
+
+    Returns tuple of (error message or None, number of retries).
+    """
+    retries = 0
+    while True:
+        try:
+            ff_utils.patch_metadata(patch_body, obj_id=obj_id, key=key, add_on=add_on)
+        except Exception as e:
+            if retries + 1 >= max_attempts or not is_transient_error(e):
+                return str(e), retries
+            backoff = 2 ** retries
+            seconds_left = _seconds_left(start, time_limit)
+            if seconds_left is not None and seconds_left < backoff:
+                return str(e), retries
+            time.sleep(backoff)
+            retries += 1
+        else:
+            return None, retries
+
+
+def bulk_patch_metadata(
+    patches,
+    key,
+    add_on="",
+    max_workers=DEFAULT_MAX_WORKERS,
+    max_attempts=DEFAULT_MAX_ATTEMPTS,
+    start=None,
+    time_limit=None,
+    already_patched=None,
+):
+    """PATCH many items concurrently.
+
+    Items are submitted in order with at most max_workers requests in
+    flight. Once time_limit (seconds since start) is reached, no new
+    PATCHes are started and remaining items are reported as not
+    attempted so the action can be re-run to pick them up.
+
+    :param patches: Mapping of item identifier to PATCH body
+    :type patches: dict
+    :param key: Portal authorization
+    :type key: dict
+    :param add_on: Query string added to every PATCH
+    :type add_on: str
+    :param start: Time from which time_limit is measured
+    :type start: datetime.datetime
+    :param time_limit: Seconds allowed for all PATCHes
+    :type time_limit: int or None
+    :param already_patched: Identifiers completed in a prior run to skip
+    :type already_patched: set or None
+    :returns: Report of results
+    :rtype: PatchReport
+    """
+    report = PatchReport()
+    if start is None:
+        start = datetime.utcnow()
+    already_patched = already_patched or set()
+    in_flight = {}
+
+    def collect(futures):
+        for future in futures:
+            obj_id = in_flight.pop(future)
+            error, retries = future.result()
+            report.retries += retries
+            if error:
+                report.error[obj_id] = error
+            else:
+                report.success.append(obj_id)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for obj_id, patch_body in patches.items():
+            if obj_id in already_patched:
+                report.skipped.append(obj_id)
+                continue
+            seconds_left = _seconds_left(start, time_limit)
+            if seconds_left is not None and seconds_left <= 0:
+                report.not_attempted.append(obj_id)
+                continue
+            if len(in_flight) >= max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            future = executor.submit(
+                _patch_with_retries, obj_id, patch_body, key, add_on,
+                max_attempts, start, time_limit
+            )
+            in_flight[future] = obj_id
+        collect(list(in_flight))
+    report.elapsed = round((datetime.utcnow() - start).total_seconds(), 2)
+    return report
+
+
+def staged_bulk_patch_metadata(stages, key, start=None, time_limit=None, already_patched=None, **kwargs):
+    """PATCH items in ordered stages, each stage concurrently.
+
+    A stage is only started once every item of the previous stages was
+    patched; otherwise its items are reported as not attempted. Used
+    when items must be patched in dependency order.
+
+    :param stages: Mappings of item identifier to PATCH body, in order
+    :type stages: list(dict)
+    :returns: Combined report of results
+    :rtype: PatchReport
+    """
+    report = PatchReport()
+    if start is None:
+        start = datetime.utcnow()
+    for patches in stages:
+        if report.error or report.not_attempted:
+            report.not_attempted.extend(patches)
+            continue
+        stage_report = bulk_patch_metadata(
+            patches, key, start=start, time_limit=time_limit,
+            already_patched=already_patched, **kwargs
+        )
+        report.success.extend(stage_report.success)
+        report.error.update(stage_report.error)
+        report.not_attempted.extend(stage_report.not_attempted)
+        report.skipped.extend(stage_report.skipped)
+        report.retries += stage_report.retries
+    report.elapsed = round((datetime.utcnow() - start).total_seconds(), 2)
+    return report
+
+
+def get_patched_in_prior_run(action, kwargs):
+    """Identifiers successfully PATCHed by the latest run of this action
+    for the same check result, used to resume a partially completed
+    action.
+    """
+    latest = action.get_latest_result()
+    if not latest or not kwargs.get("called_by"):
+        return set()
+    if latest.get("kwargs", {}).get("called_by") != kwargs["called_by"]:
+        return set()
+    output = latest.get("output") or {}
+    if not isinstance(output, dict):
+        return set()
+    return set(output.get("success", [])) | set(output.get("skipped_as_done", []))
@@ -0,0 +1,333 @@
+import json
+import random
+import sys
+import threading
+import time
+import uuid as uuid_lib
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_DEDUP_WORKERS = 8
+SQS_BATCH_SIZE = 10  # max messages per SQS receive/send/delete call
+RECEIVE_WAIT_SECONDS = 1  # long polling per receive
+RECYCLE_DELAY_SECONDS = 2  # recycled messages are not consumed right away
+MAX_SAMPLED_MESSAGES = 100  # problem/failed messages kept for output
+
+_EMPTY, _FULL, _DELETED = 0, 1, 2
+
+
+class CompactUuidSet:
+    """Set of uuid strings stored as 16 packed bytes each.
+
+    Uses an open-addressing hash table with linear probing over a
+    bytearray of uuid bytes and a bytearray of slot states, so memory is
+    roughly 17 bytes per slot instead of a Python str and set entry per
+    uuid. Values that are not uuids are kept in a regular set.
+    """
+
+    UUID_SIZE = 16
+    MAX_LOAD = 0.7
+
+    def __init__(self, capacity=1024):
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._init_table(size)
+        self._other = set()
+
+    def _init_table(self, size):
+        self._size = size
+        self._keys = bytearray(size * self.UUID_SIZE)
+        self._states = bytearray(size)
+        self._count = 0
+        self._used = 0  # full and deleted slots, which both lengthen probes
+
+    @staticmethod
+    def _pack(value):
+        try:
+            return uuid_lib.UUID(value).bytes
+        except (ValueError, TypeError, AttributeError):
+            return None
+
+    def _find(self, key):
+        """Slot holding key, or first free slot to insert key at.
+
+        Returns tuple of (slot index, True if key found).
+        """
+        mask = self._size - 1
+        idx = int.from_bytes(key[:8], 'little') & mask
+        free = None
+        while True:
+            state = self._states[idx]
+            if state == _EMPTY:
+                return (idx if free is None else free), False
+            if state == _DELETED:
+                if free is None:
+                    free = idx
+            else:
+                start = idx * self.UUID_SIZE
+                if self._keys[start: start + self.UUID_SIZE] == key:
+                    return idx, True
+            idx = (idx + 1) & mask
+
+    def _resize(self, size):
+        keys, states, old_size = self._keys, self._states, self._size
+        self._init_table(size)
+        for idx in range(old_size):
+            if states[idx] == _FULL:
+                key = bytes(keys[idx * self.UUID_SIZE: (idx + 1) * self.UUID_SIZE])
+                self._insert(key)
+
+    def _insert(self, key):
+        idx, found = self._find(key)
+        if found:
+            return
+        if self._states[idx] == _EMPTY:
+            self._used += 1
+        self._keys[idx * self.UUID_SIZE: (idx + 1) * self.UUID_SIZE] = key
+        self._states[idx] = _FULL
+        self._count += 1
+
+    def add(self, value):
+        key = self._pack(value)
+        if key is None:
+            self._other.add(value)
+            return
+        if (self._used + 1) > self._size * self.MAX_LOAD:
+            # grow unless mostly deleted slots, which a rebuild reclaims
+            self._resize(self._size * 2 if self._count * 2 >= self._used else self._size)
+        self._insert(key)
+
+    def discard(self, value):
+        key = self._pack(value)
+        if key is None:
+            self._other.discard(value)
+            return
+        idx, found = self._find(key)
+        if found:
+            self._states[idx] = _DELETED
+            self._count -= 1
+
+    def __contains__(self, value):
+        key = self._pack(value)
+        if key is None:
+            return value in self._other
+        return self._find(key)[1]
+
+    def __len__(self):
+        return self._count + len(self._other)
+
+    @property
+    def nbytes(self):
+        """Approximate memory used."""
+        return len(self._keys) + len(self._states) + set_nbytes(self._other)
+
+
+def set_nbytes(values):
+    """Approximate memory used by a set of strings."""
+    return sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+
+
+class ReservoirSample:
+    """Uniform random sample of at most max_size items from a stream,
+    with a count of all items seen.
+    """
+
+    def __init__(self, max_size=MAX_SAMPLED_MESSAGES):
+        self.max_size = max_size
+        self.items = []
+        self.count = 0
+
+    def add(self, item):
+        self.count += 1
+        if len(self.items) < self.max_size:
+            self.items.append(item)
+        else:
+            idx = random.randrange(self.count)
+            if idx < self.max_size:
+                self.items[idx] = item
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+    def __bool__(self):
+        return self.count > 0
+
+
+class QueueDeduplicator:
+    """Deduplicate uuids on an indexer queue with concurrent workers.
+
+    Every received message is deleted. The first message seen for a uuid
+    (or any message already stamped by this run) is re-sent with the
+    current max sid and the dedup stamp; later messages for a seen uuid
+    are dropped. Workers share the seen-uuid set and counters under a
+    lock, and each runs its own receive/send/delete cycle.
+
+    With compact=True the seen uuids are packed in a CompactUuidSet, for
+    queues too large to hold every uuid as a Python str. Problem and
+    failed messages are always kept as a bounded sample with a count.
+    """
+
+    def __init__(self, client, queue_url, dedup_msg, max_sid, starting_count,
+                 workers=DEFAULT_DEDUP_WORKERS, compact=False):
+        self.client = client
+        self.queue_url = queue_url
+        self.dedup_msg = dedup_msg
+        self.max_sid = max_sid
+        self.starting_count = starting_count
+        self.workers = workers
+        self.compact = compact
+        self.seen_uuids = CompactUuidSet() if compact else set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.exit_reason = 'out of time'
+        self.sent = 0
+        self.deleted = 0
+        self.deduplicated = 0
+        self.total_msgs = 0
+        self.replaced = 0
+        self.repeat_replaced = 0
+        self.problem_msgs = ReservoirSample()
+        self.failed = ReservoirSample()
+        self.elapsed = 0
+
+    def _finish(self, reason):
+        """Stop all workers, keeping the first reason given."""
+        with self.lock:
+            if not self.stop.is_set():
+                self.exit_reason = reason
+                self.stop.set()
+
+    def _process_batch(self, batch):
+        """Sort received messages into ones to delete and ones to re-send.
+
+        Returns tuple of (delete entries, send entries, uuids newly seen).
+        """
+        to_delete = []
+        to_send = []
+        send_uuids = set()
+        with self.lock:
+            for msg in batch:
+                try:
+                    msg_body = json.loads(msg['Body'])
+                except json.JSONDecodeError:
+                    self.problem_msgs.add(msg['Body'])
+                    continue
+                self.total_msgs += 1
+                msg_uuid = msg_body['uuid']
+                # update max_sid with message sid if applicable
+                if msg_body.get('sid') is not None and msg_body['sid'] > self.max_sid:
+                    self.max_sid = msg_body['sid']
+                msg_body['sid'] = self.max_sid
+                # every item gets deleted; original uuids get re-sent
+                to_delete.append({'Id': msg['MessageId'], 'ReceiptHandle': msg['ReceiptHandle']})
+                if msg_uuid in self.seen_uuids and msg_body.get('fs_detail', '') != self.dedup_msg:
+                    self.deduplicated += 1
+                    continue
+                # don't increment replaced count if we've seen the item before
+                if msg_uuid not in self.seen_uuids:
+                    self.replaced += 1
+                    self.seen_uuids.add(msg_uuid)
+                    send_uuids.add(msg_uuid)
+                else:
+                    self.repeat_replaced += 1
+                # add foursight uuid stamp
+                msg_body['fs_detail'] = self.dedup_msg
+                to_send.append({
+                    'Id': str(len(to_send)),  # only unique within the batch
+                    'MessageBody': json.dumps(msg_body),
+                    'DelaySeconds': RECYCLE_DELAY_SECONDS,
+                })
+        return to_delete, to_send, send_uuids
+
+    def _work(self, deadline):
+        while not self.stop.is_set():
+            if time.time() >= deadline:
+                self._finish('out of time')
+                break
+            # end if we are spinning our wheels replacing the same uuids
+            if (self.replaced + self.repeat_replaced) >= self.starting_count:
+                self._finish('starting uuids fully covered')
+                break
+            received = self.client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=SQS_BATCH_SIZE,
+                WaitTimeSeconds=RECEIVE_WAIT_SECONDS,
+            )
+            batch = received.get('Messages', [])
+            if not batch:
+                self._finish('no messages left')
+                break
+            to_delete, to_send, send_uuids = self._process_batch(batch)
+            if to_send:
+                res = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=to_send)
+                res_failed = res.get('Failed', [])
+                if res_failed:
+                    # handle conservatively on error and don't delete; the
+                    # batch stays on the queue, so undo its counts
+                    with self.lock:
+                        self.failed.extend(res_failed)
+                        for uuid in send_uuids:
+                            self.seen_uuids.discard(uuid)
+                        self.total_msgs -= len(to_delete)
+                        self.replaced -= len(send_uuids)
+                        self.repeat_replaced -= len(to_send) - len(send_uuids)
+                        self.deduplicated -= len(to_delete) - len(to_send)
+                    continue
+                with self.lock:
+                    self.sent += len(to_send)
+            if to_delete:
+                res = self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=to_delete)
+                with self.lock:
+                    self.failed.extend(res.get('Failed', []))
+                    self.deleted += len(to_delete)
+
+    def run(self, time_limit):
+        """Deduplicate until time_limit seconds pass, the queue is empty
+        or the starting messages are covered.
+        """
+        t0 = time.time()
+        deadline = t0 + time_limit
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._work, deadline) for _ in range(self.workers)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    # stop other workers, then surface the error
+                    self.stop.set()
+                    raise
+        self.elapsed = round(time.time() - t0, 2)
+        return self
+
+    @property
+    def msgs_per_second(self):
+        return round(self.total_msgs / self.elapsed, 1) if self.elapsed else 0
+
+    @property
+    def seen_nbytes(self):
+        if self.compact:
+            return self.seen_uuids.nbytes
+        return set_nbytes(self.seen_uuids)
+
+    def stats(self):
+        """Summary for check full_output."""
+        return {
+            'total_messages_covered': self.total_msgs,
+            'uuids_covered': len(self.seen_uuids),
+            'deduplicated': self.deduplicated,
+            'replaced': self.replaced,
+            'repeat_replaced': self.repeat_replaced,
+            'sent': self.sent,
+            'deleted': self.deleted,
+            'workers': self.workers,
+            'time': self.elapsed,
+            'messages_per_second': self.msgs_per_second,
+            'problem_messages': self.problem_msgs.items,
+            'problem_message_count': self.problem_msgs.count,
+            'failed_count': self.failed.count,
+            'compact_seen_set': self.compact,
+            'seen_set_bytes': self.seen_nbytes,
+            'exit_reason': self.exit_reason,
+        }
@@ -1,4 +1,5 @@
 import json
+import re
 from datetime import datetime
 
 from dcicutils import ff_utils
@@ -7,6 +8,11 @@ from . import constants
 from .confchecks import CheckResult, ActionResult
 
 
+# items per search by identifier, keeps urls to a sane length
+IDENTIFIER_SEARCH_CHUNK = 100
+UUID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
 def initialize_check(check_name, connection):
     """Create a CheckResult with default attributes.
 
@@ -85,6 +91,50 @@ def add_to_dict_as_list(dictionary, key, value):
         dictionary[key] = [value]
 
 
+def add_field_projection(query, fields):
+    """Add field parameters to search query so only given fields are
+    returned for each hit, skipping any already present.
+    """
+    existing = set(re.findall(r"[?&]field=([^&]+)", query))
+    for field in fields:
+        if field not in existing:
+            query += "&field=" + field
+            existing.add(field)
+    return query
+
+
+def search_with_fields(query, fields, key, **kwargs):
+    """Search portal, returning only given fields for each hit.
+
+    Additional kwargs are passed on to ff_utils.search_metadata.
+    """
+    projected_query = add_field_projection(query, fields)
+    return ff_utils.search_metadata(projected_query, key=key, **kwargs)
+
+
+def search_by_identifiers(item_type, identifiers, fields, key):
+    """Search hits for items given by accession, uuid or @id, with only
+    the given fields, in a search per IDENTIFIER_SEARCH_CHUNK identifiers of each
+    kind.
+
+    Returns dict of identifier to hit; identifiers not found are absent.
+    """
+    by_param = {}
+    for identifier in dict.fromkeys(identifiers):
+        # @ids look like /<collection>/<accession or uuid>/
+        value = identifier.rstrip("/").rsplit("/", 1)[-1]
+        param = "uuid" if UUID_PATTERN.match(value) else "accession"
+        by_param.setdefault(param, {})[value] = identifier
+    found = {}
+    for param, values in by_param.items():
+        for chunk in chunk_ids(list(values), chunk_size=IDENTIFIER_SEARCH_CHUNK):
+            query = f"search/?type={item_type}&{param}=" + f"&{param}=".join(chunk)
+            for result in search_with_fields(query, list(dict.fromkeys([param] + fields)), key):
+                if result.get(param) in values:
+                    found[values[result[param]]] = result
+    return found
+
+
 def make_embed_request(ids, fields, connection):
     """POST to /embed API to get desired fields for all given
     identifiers.
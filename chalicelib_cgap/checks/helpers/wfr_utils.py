@@ -1,15 +1,39 @@
 import json
-from datetime import datetime
-from operator import itemgetter
+import random
+import threading
+import time
+import boto3
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+from types import MappingProxyType
+from botocore.exceptions import ClientError
 from dcicutils import ff_utils
 from dcicutils.s3_utils import s3Utils
+from tibanna.utils import create_jobid
 from tibanna_cgap.core import API
+from tibanna_cgap.vars import AWS_REGION, EXECUTION_ARN
 from .wfrset_utils import (
-    # use wf_dict in workflow version check to make sure latest version and workflow uuid matches
-    wf_dict,
-    step_settings,
+    # use wf_templates in workflow_index, so the workflow version check can make sure
+    # latest version and workflow uuid matches
+    wf_templates,
     LAMBDA_LIMIT,
 )
+from .utils import is_past_time_limit, search_by_identifiers
+
+
+# workflow runs started with Tibanna at once, and attempts per run when throttled
+DEFAULT_SUBMIT_WORKERS = 4
+MAX_SUBMIT_ATTEMPTS = 4
+SUBMIT_BACKOFF_SECONDS = 1
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException')
+EXECUTION_URL = 'https://console.aws.amazon.com/states/home?region=%s#/executions/details/%s'
+# files whose runs or qcs are looked up at once
+DEFAULT_QC_WORKERS = 8
+# parsed workflow run summaries kept, enough for the runs on a few thousand files
+WFR_SUMMARY_CACHE_SIZE = 50000
 
 
 # wfr_name, accepted versions, expected run time
@@ -136,6 +160,32 @@ workflow_details = {
 }
 
 
+# Compiled view of workflow_details and wf_dict, for membership checks
+# without list scans; versions keep workflow_details order for latest_version
+WorkflowInfo = namedtuple('WorkflowInfo', ['versions', 'latest_version', 'run_time', 'workflow_uuid'])
+
+
+def build_workflow_index(details, templates):
+    """Read-only mapping of app_name to WorkflowInfo, with accepted
+    versions as a frozenset and the workflow uuid from the step settings
+    (None if the app has no settings, or ambiguous ones).
+    """
+    index = {}
+    for app_name, info in details.items():
+        versions = info['accepted_versions']
+        template = templates.get(app_name)
+        index[app_name] = WorkflowInfo(
+            versions=frozenset(versions),
+            latest_version=versions[-1],
+            run_time=info['run_time'],
+            workflow_uuid=template['workflow_uuid'] if template else None,
+        )
+    return MappingProxyType(index)
+
+
+workflow_index = build_workflow_index(workflow_details, wf_templates)
+
+
 # Reference Files (should be @id)
 bwa_index = {'human': '/files-reference/GAPFI4U1HXIY/'}
 
@@ -284,22 +334,22 @@ def check_latest_workflow_version(workflows):
        If a new version is decleared on foursight, it should be released on the portal, if not stop the check.
     """
     errors = []
+    # sometimes there are 2 or more workflows with same app name
+    # and the old one might not have the latest version
+    # group all wfs with same name, keeping portal order, to look for the latest version on one
+    workflows_by_name = {}
     for a_wf in workflows:
-        wf_name = a_wf['app_name']
+        workflows_by_name.setdefault(a_wf['app_name'], []).append(a_wf)
+    for wf_name, same_wf_name_workflows in workflows_by_name.items():
         # make sure the workflow is in our control list on wfr_utils.py
-        if wf_name not in workflow_details:
+        wf_info = workflow_index.get(wf_name)
+        if wf_info is None:
             continue
         # make sure the workflow is in our settings list on wfrset_utils.py
-        if wf_name not in [i['app_name'] for i in wf_dict]:
+        if wf_name not in wf_templates:
             continue
-        wf_info = workflow_details[wf_name]
-        versions = wf_info['accepted_versions']
         # latest version should be the last one on the list
-        last_version = versions[-1]
-        # sometimes there are 2 or more workflows with same app name
-        # and the old one might not have the latest version
-        # look for all wfs with same name and make sure the latest version is on one
-        same_wf_name_workflows = [i for i in workflows if i['app_name'] == wf_name]
+        last_version = wf_info.latest_version
         all_wf_versions = [i.get('app_version', '') for i in same_wf_name_workflows]
         # make sure the latest is also on one of the wfrs
         if last_version not in all_wf_versions:
@@ -314,8 +364,7 @@ def check_latest_workflow_version(workflows):
             continue
         # check if the lastest version workflow uuids is correct on wfr_dict (wfrset_utils.py)
         latest_workflow_uuid = [i['uuid'] for i in same_wf_name_workflows if i['app_version'] == last_version][0]
-        wf_dict_item = [i['workflow_uuid'] for i in wf_dict if i['app_name'] == wf_name][0]
-        if latest_workflow_uuid != wf_dict_item:
+        if latest_workflow_uuid != wf_info.workflow_uuid:
             err = '{} item on wf_dict does not have the latest workflow uuid'.format(wf_name)
             errors.append(err)
             continue
@@ -382,6 +431,17 @@ def collect_inputs_from_workflow_run(wfr_resp):
     return input_files
 
 
+def run_signature(value):
+    """Hashable form of run settings or input files, equal for equal
+    values whatever the order of dictionary keys.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(((k, run_signature(v)) for k, v in value.items()), key=itemgetter(0)))
+    if isinstance(value, (list, tuple)):
+        return tuple(run_signature(i) for i in value)
+    return value
+
+
 def remove_duplicate_need_runs(need_runs_dictionary):
     """In rare cases, the same run can be triggered by two different sample_processings
     example is a quad analyzed for 2 different probands. In this case you want a single
@@ -397,7 +457,7 @@ def remove_duplicate_need_runs(need_runs_dictionary):
              ]]}]
     """
     # keep a track of sorted runs
-    sorted_runs = []
+    seen_runs = set()
     unique_needs_runs_dictionary = []
 
     for an_item in need_runs_dictionary:
@@ -409,19 +469,72 @@ def remove_duplicate_need_runs(need_runs_dictionary):
                 run_setttings = a_run[1]
                 input_files = a_run[2]
                 ordered_input = order_input_dictionary(input_files)
-                # get elements that should be unique and store as string
-                run_info = str(run_setttings) + str(ordered_input)
-                if run_info in sorted_runs:
+                # get elements that should be unique (settings include app name and tag)
+                run_info = (run_signature(run_setttings), run_signature(ordered_input))
+                if run_info in seen_runs:
                     continue
                 else:
                     keep_runs.append(a_run)
-                    sorted_runs.append(run_info)
+                    seen_runs.add(run_info)
             if keep_runs:
                 unique_needs_runs_dictionary.append({an_sp_id: keep_runs})
     return unique_needs_runs_dictionary
 
 
-def filter_wfrs_with_input_and_tag(all_wfr_items, app_name, input_file_dict, tag, match_all_input=True):
+class WorkflowRunIndex:
+    """Workflow runs of a library indexed by their input files.
+
+    Runs are keyed by their sorted input @ids, so an exact input match is
+    a single lookup, and listed per input file, so runs containing some
+    files are an intersection of the shortest lists. The app name prefix
+    and tag are checked on the few runs found, and exact lookups are
+    cached per (app_name, tag, inputs). Matches keep library order.
+    """
+
+    def __init__(self, wfr_items):
+        self.source = wfr_items
+        self.wfrs = list(wfr_items)
+        self.by_inputs = {}
+        self.by_file = {}
+        self._exact_matches = {}
+        for idx, a_wfr in enumerate(self.wfrs):
+            wfr_inputs = collect_inputs_from_workflow_run(a_wfr)
+            self.by_inputs.setdefault(tuple(sorted(wfr_inputs)), []).append(idx)
+            for a_file in set(wfr_inputs):
+                self.by_file.setdefault(a_file, []).append(idx)
+
+    def indexes(self, wfr_items):
+        """Whether this index is of wfr_items as they are now; a list
+        replaced or grown since the index was built needs a new one.
+        """
+        return wfr_items is self.source and len(wfr_items) == len(self.wfrs)
+
+    def _matches(self, idx, app_name, tag):
+        a_wfr = self.wfrs[idx]
+        if not a_wfr['display_title'].startswith(app_name):
+            return False
+        return not tag or tag in a_wfr.get('tags', [])
+
+    def filter(self, app_name, input_files, tag, match_all_input=True):
+        """Runs of app_name, with tag if given, whose input files are
+        exactly input_files, or include all of them if not match_all_input.
+        """
+        if match_all_input:
+            key = (app_name, tag, tuple(sorted(input_files)))
+            if key not in self._exact_matches:
+                self._exact_matches[key] = [self.wfrs[idx] for idx in self.by_inputs.get(key[2], [])
+                                            if self._matches(idx, app_name, tag)]
+            return list(self._exact_matches[key])
+        if input_files:
+            postings = sorted((self.by_file.get(a_file, []) for a_file in set(input_files)), key=len)
+            candidates = sorted(set(postings[0]).intersection(*postings[1:]))
+        else:
+            candidates = range(len(self.wfrs))
+        return [self.wfrs[idx] for idx in candidates if self._matches(idx, app_name, tag)]
+
+
+def filter_wfrs_with_input_and_tag(all_wfr_items, app_name, input_file_dict, tag, match_all_input=True,
+                                   wfr_index=None):
     """given an input file dictionary and list of workflow_run items, filter wfrs
     for input files that match the input file dictionary. If a filter tag is given
     also filter for workflow_runs that have the given filter_tag in tags field
@@ -431,7 +544,9 @@ def filter_wfrs_with_input_and_tag(all_wfr_items, app_name, input_file_dict, tag
     input_file_dict: all input files
     tag: if filter should look for a tag (ie sample_processing uuid) on wfr
     match_all_input: (Bool) True by default. Looks for exact match between input file dict and the workflowrun
-    # TODO: for combine GVCF, we need to implement the False case, where we utilize the partial match
+                     if False, looks for workflowruns with all files in the input file dict among their inputs
+                     (ie combine GVCF runs over a larger cohort)
+    wfr_index: WorkflowRunIndex of all_wfr_items, built if not given; pass one to reuse it across steps
     """
     # filter workflows for workflow_name, the ones with same input files, and if exist, tags
     # filtering with input - important for steps like combine gVCF there same input file
@@ -440,41 +555,13 @@ def filter_wfrs_with_input_and_tag(all_wfr_items, app_name, input_file_dict, tag
     # filtering with tag - for some steps, even if the input files are the same,
     #                      you need to run different versions for different sample processing items
     #                      (ie 2 quads made up of the same samples with different probands.)
-
-    # filter for app_name
-    wfrs_with_app_name = [i for i in all_wfr_items if i['display_title'].startswith(app_name)]
-
-    for wf_ in wfrs_with_app_name:
-        print('\t\twfr filter, ' + wf_['title'])
-
-    # filter for tag
-    if tag:
-        print('\t\t-> TAG')
-        wfrs_with_tag = [i for i in wfrs_with_app_name if tag in i.get('tags', [])]
-    else:
-        print('\t\t-> NO TAG')
-        wfrs_with_tag = wfrs_with_app_name
-    # filter for input files
+    if wfr_index is None or not wfr_index.indexes(all_wfr_items):
+        wfr_index = WorkflowRunIndex(all_wfr_items)
+    print('\t\t-> TAG' if tag else '\t\t-> NO TAG')
     # collect input files
     input_files = collect_input_files_from_input_dictionary(input_file_dict)
     print('\t\t-> input_files, ' + str(input_files))
-    # check for workflows with same inputs
-    filtered_wfrs = []
-    for a_wfr in wfrs_with_tag:
-        # get all input files from the workflow item
-        wfr_inputs = collect_inputs_from_workflow_run(a_wfr)
-        print('\t\t\t-> wfr_input, ' + str(wfr_inputs))
-        # expectation is exact match of input files, if so pass the filter
-        if match_all_input:
-            if sorted(wfr_inputs) == sorted(input_files):
-                filtered_wfrs.append(a_wfr)
-        # if input files are contained by the wfr input files, pass the filter
-        else:
-            if all(file in wfr_inputs for file in input_files):
-                filtered_wfrs.append(a_wfr)
-        # for wf_ in filtered_wfrs:
-        #     print('\t\tfiltered_wfrs, ' + wf_['title'])
-
+    filtered_wfrs = wfr_index.filter(app_name, input_files, tag, match_all_input=match_all_input)
     for wf_ in filtered_wfrs:
         print('\t\tfiltered_wfrs, ' + wf_['title'])
     return filtered_wfrs
@@ -512,7 +599,9 @@ def stepper(library, keep,
     input files, it will return the status of process on these files.
     It will also check for failed qcs on input files.
     - args
-      -library:   dictionary with keys files/wfrs/qcs that contain all related items
+      -library:   dictionary with keys files/wfrs/qcs that contain all related items,
+                  the workflow run index built from wfrs is kept under wfr_index,
+                  and rebuilt if wfrs is replaced or added to
       -keep:      tracking run progress with keys running/problematic_run/missing_run
       -step_tag:  informative summary used in the output (ie step name + input file accession)
       -new_step_input_file:  files to check for qc and get attribution from
@@ -536,6 +625,8 @@ def stepper(library, keep,
     all_files = library['files']
     all_wfrs = library['wfrs']
     all_qcs = library['qcs']
+    if library.get('wfr_index') is None or not library['wfr_index'].indexes(all_wfrs):
+        library['wfr_index'] = WorkflowRunIndex(all_wfrs)
     # unpack keep
     running = keep['running']
     problematic_run = keep['problematic_run']
@@ -579,7 +670,8 @@ def stepper(library, keep,
         # filtering with tag - for some steps, even if the input files are the same,
         #                      you need to run different versions for different sample processing items
         #                      (ie 2 quads made up of the same samples with different probands.)
-        filtered_wfrs = filter_wfrs_with_input_and_tag(all_wfrs, new_step_name, input_file_dict, tag=tag)
+        filtered_wfrs = filter_wfrs_with_input_and_tag(all_wfrs, new_step_name, input_file_dict, tag=tag,
+                                                       wfr_index=library['wfr_index'])
 
         # for wf_ in all_wfrs:
         #     if 'granite' in wf_['title']:
@@ -629,6 +721,47 @@ def stepper(library, keep,
     return keep, step_status, step_output
 
 
+class WfrSummary:
+    """Workflow run fields used by get_wfr_out, parsed from the run's
+    display title ("<type> <version> run <time>").
+    """
+
+    __slots__ = ('uuid', 'type', 'version', 'status', 'run_epoch')
+
+    def __init__(self, uuid, type, version, status, run_epoch):
+        self.uuid = uuid
+        self.type = type
+        self.version = version
+        self.status = status
+        self.run_epoch = run_epoch
+
+    def run_hours(self):
+        """Hours since the run started."""
+        return (time.time() - self.run_epoch) / 3600
+
+
+@lru_cache(maxsize=WFR_SUMMARY_CACHE_SIZE)
+def parse_wfr_summary(uuid, display_title, status=None):
+    """WfrSummary for a workflow run, cached as display titles do not
+    change once a run is created.
+    """
+    wfr_type, time_info = display_title.split(' run ')
+    wfr_type_base, wfr_version = wfr_type.strip().split(' ')
+    # user submitted ones use run on insteand of run
+    time_info = time_info.strip('on').strip()
+    try:
+        wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S')
+    run_epoch = wfr_time.replace(tzinfo=timezone.utc).timestamp()
+    return WfrSummary(uuid, wfr_type_base.strip(), wfr_version.strip(), status, run_epoch)
+
+
+def wfr_summary(wfr_item):
+    """WfrSummary for a workflow run item, which is left unchanged."""
+    return parse_wfr_summary(wfr_item['uuid'], wfr_item['display_title'], wfr_item.get('run_status'))
+
+
 def get_wfr_out(emb_file, wfr_name, key=None, all_wfrs='not given', versions=None, md_qc=False, run=None):
     """For a given file, fetches the status of last wfr (of wfr_name type)
     If there is a successful run, it will return the output files as a dictionary of
@@ -655,13 +788,13 @@ def get_wfr_out(emb_file, wfr_name, key=None, all_wfrs='not given', versions=Non
     error_at_failed_runs = 1
     # you should provide key or all_wfrs
     # assert key or all_wfrs
-    assert wfr_name in workflow_details
+    assert wfr_name in workflow_index
+    wf_info = workflow_index[wfr_name]
     # get default accepted versions if not provided
-    if not versions:
-        versions = workflow_details[wfr_name]['accepted_versions']
+    versions = wf_info.versions if not versions else frozenset(versions)
     # get default run out time
     if not run:
-        run = workflow_details[wfr_name]['run_time']
+        run = wf_info.run_time
     workflows = emb_file.get('workflow_run_inputs', [])
     wfr = {}
     run_status = 'did not run'
@@ -671,38 +804,27 @@ def get_wfr_out(emb_file, wfr_name, key=None, all_wfrs='not given', versions=Non
         my_workflows = wfrs_on_file
     # otherwise, limit the workflows to the ones from all_wfrs
     else:
-        library_uuids = [i['uuid'] for i in all_wfrs]
-        my_workflows = [i for i in wfrs_on_file if i['uuid'] in library_uuids]
+        library_wfrs = {i['uuid']: i for i in all_wfrs}
+        my_workflows = [i for i in wfrs_on_file if i['uuid'] in library_wfrs]
     if not my_workflows:
         return {'status': "no workflow on file"}
     # if all_wfrs were given and there were no wfrs, it means that prefiltering did not return any
     if not key and not all_wfrs:
         return {'status': "no workflow on file"}
 
-    for a_wfr in my_workflows:
-        wfr_type, time_info = a_wfr['display_title'].split(' run ')
-        wfr_type_base, wfr_version = wfr_type.strip().split(' ')
-        # user submitted ones use run on insteand of run
-        time_info = time_info.strip('on').strip()
-        try:
-            wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S.%f')
-        except ValueError:
-            wfr_time = datetime.strptime(time_info, '%Y-%m-%d %H:%M:%S')
-        a_wfr['run_hours'] = (datetime.utcnow() - wfr_time).total_seconds() / 3600
-        a_wfr['run_type'] = wfr_type_base.strip()
-        a_wfr['run_version'] = wfr_version.strip()
-    my_workflows = [i for i in my_workflows if i['run_version'] in versions]
-    if not my_workflows:
+    summaries = [summary for summary in map(wfr_summary, my_workflows) if summary.version in versions]
+    if not summaries:
         return {'status': "no workflow in file with accepted version"}
-    my_workflows = sorted(my_workflows, key=lambda k: k['run_hours'])
-    same_type_wfrs = [i for i in my_workflows if i['run_type'] == wfr_name]
+    # newest first
+    summaries.sort(key=attrgetter('run_epoch'), reverse=True)
+    same_type_wfrs = [i for i in summaries if i.type == wfr_name]
     last_wfr = same_type_wfrs[0]
     # get metadata for the last wfr
     if all_wfrs == 'not given':
-        wfr = ff_utils.get_metadata(last_wfr['uuid'], key)
+        wfr = ff_utils.get_metadata(last_wfr.uuid, key)
     else:
-        wfr = [i for i in all_wfrs if i['uuid'] == last_wfr['uuid']][0]
-    run_duration = last_wfr['run_hours']
+        wfr = library_wfrs[last_wfr.uuid]
+    run_duration = last_wfr.run_hours()
     run_status = wfr['run_status']
 
     if run_status == 'complete':
@@ -759,8 +881,10 @@ def extract_file_info(obj_uuid, arg_name, additional_parameters):
     return template
 
 
-def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, sfn):
-    """Create workflow run and execute with Tibanna"""
+def build_wfr_input(input_json, input_files_and_params, run_name, env):
+    """Tibanna input for a workflow run, from a template and its input
+    files; the template is not changed.
+    """
     all_inputs = []
     input_files = {k: v for k, v in input_files_and_params.items() if k != 'additional_file_parameters'}
     input_file_parameters = input_files_and_params.get('additional_file_parameters', {})
@@ -775,6 +899,7 @@ def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, sfn
     # (even less since repeats need unique names)
     if len(run_name) > 30:
         run_name = run_name[:30] + '...'
+    input_json = dict(input_json)
     input_json['input_files'] = all_inputs
     input_json["_tibanna"] = {
         "env": env,
@@ -782,6 +907,12 @@ def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, sfn
         "run_id": run_name
     }
     input_json['public_postrun_json'] = True
+    return input_json
+
+
+def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, sfn):
+    """Create workflow run and execute with Tibanna"""
+    input_json = build_wfr_input(input_json, input_files_and_params, run_name, env)
     try:
         res = API().run_workflow(input_json, sfn=sfn, verbose=False)
         url = res['_tibanna']['url']
@@ -790,9 +921,152 @@ def run_missing_wfr(input_json, input_files_and_params, run_name, auth, env, sfn
         return str(e)
 
 
-def check_runs_without_output(res, check, run_name, my_auth, start):
+def get_file_attributions(file_ids, key):
+    """Project and institution uuids of files given by accession, uuid or
+    @id, fetched in bulk.
+
+    Returns dict of file id to dict with uuid, accession, project and
+    institution; files not found are absent.
+    """
+    fields = ['uuid', 'accession', 'project.uuid', 'institution.uuid']
+    found = {}
+    for file_id, hit in search_by_identifiers('File', file_ids, fields, key).items():
+        attribution = {'uuid': hit['uuid'], 'accession': hit.get('accession')}
+        for field in ('project', 'institution'):
+            value = hit.get(field)
+            attribution[field] = value.get('uuid') if isinstance(value, dict) else value
+        found[file_id] = attribution
+    return found
+
+
+def error_code(error):
+    """AWS error code of error, or None if it is not a ClientError."""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code')
+    return None
+
+
+def is_throttling_error(error):
+    """True if error is AWS rejecting a request for its rate."""
+    if error_code(error) in THROTTLING_ERROR_CODES:
+        return True
+    return 'Rate exceeded' in str(error)
+
+
+class WorkflowSubmitter:
+    """Start many workflow runs with one Tibanna API, a few at a time.
+
+    Step Functions throttles StartExecution per account, so a throttled
+    submission pauses every worker, with a backoff doubling per attempt
+    and some jitter, before it is retried. Starting a run is not
+    idempotent, so each run's jobid and execution name are fixed before
+    the first attempt, and a run whose execution already exists is not
+    started again. Other errors fail the submission right away, as
+    retrying would not help.
+    """
+
+    def __init__(self, env, sfn, api=None, workers=DEFAULT_SUBMIT_WORKERS,
+                 max_attempts=MAX_SUBMIT_ATTEMPTS, backoff=SUBMIT_BACKOFF_SECONDS, sfn_client=None):
+        self.env = env
+        self.sfn = sfn
+        self.api = api or API()
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sfn_client = sfn_client
+        self._lock = threading.Lock()
+        self._paused_until = 0
+
+    def _wait(self):
+        with self._lock:
+            pause = self._paused_until - time.time()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _throttled(self, attempt):
+        pause = self.backoff * 2 ** (attempt - 1) * (1 + random.random())
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + pause)
+
+    def execution_exists(self, run_name):
+        """Whether the execution named run_name was started."""
+        if self.sfn_client is None:
+            self.sfn_client = boto3.client('stepfunctions', region_name=AWS_REGION)
+        try:
+            self.sfn_client.describe_execution(executionArn=EXECUTION_ARN(run_name, self.sfn))
+        except ClientError as e:
+            if error_code(e) == 'ExecutionDoesNotExist':
+                return False
+            raise
+        return True
+
+    def submit(self, input_json, input_files_and_params, run_name):
+        """Start one workflow run.
+
+        Returns dict with status 'started', the execution url and whether
+        tibanna also started its cost updater and recorded the job, or
+        status 'failed' and the error, with the attempts made. A run found
+        already started on a retry was interrupted before either.
+        """
+        input_json = build_wfr_input(input_json, input_files_and_params, run_name, self.env)
+        # tibanna would make new ones on each attempt, starting a throttled run twice
+        input_json['jobid'] = create_jobid()
+        tibanna = input_json['_tibanna']
+        tibanna['run_name'] = self.api.randomize_run_name(
+            '%s_%s' % (tibanna['run_type'].replace('/', '-'), tibanna['run_id']), self.sfn
+        )
+        input_json['config'] = dict(input_json['config'], run_name=tibanna['run_name'])
+        arn = EXECUTION_ARN(tibanna['run_name'], self.sfn)
+        started = {'status': 'started', 'url': EXECUTION_URL % (AWS_REGION, arn), 'costupdater_started': False}
+        attempt = 0
+        while True:
+            attempt += 1
+            self._wait()
+            try:
+                # the throttled request may have been the cost updater's, after the run started
+                if attempt > 1 and self.execution_exists(tibanna['run_name']):
+                    return dict(started, attempts=attempt - 1)
+                # no need for tibanna's sleep after starting, runs are not polled here
+                res = self.api.run_workflow(input_json, sfn=self.sfn, sleep=0, verbose=False)
+                return {'status': 'started', 'url': res['_tibanna']['url'], 'costupdater_started': True,
+                        'attempts': attempt}
+            except Exception as e:
+                if error_code(e) == 'ExecutionAlreadyExists':
+                    return dict(started, attempts=attempt)
+                if attempt < self.max_attempts and is_throttling_error(e):
+                    self._throttled(attempt)
+                    continue
+                return {'status': 'failed', 'error': str(e), 'attempts': attempt}
+
+    def submit_all(self, submissions, start=None, time_limit=LAMBDA_LIMIT):
+        """Start workflow runs concurrently.
+
+        :param submissions: Run key to (input_json, input_files_and_params,
+            run_name) tuple
+        :type submissions: dict
+        :param start: UTC time the time limit counts from, if any
+        :type start: datetime.datetime or None
+        :param time_limit: Seconds after start when no more runs are started
+        :type time_limit: int
+        :returns: Run key to submit result; runs not started within the
+            time limit have status 'not_attempted'
+        :rtype: dict
+        """
+        def submit(item):
+            run_key, args = item
+            if start is not None and is_past_time_limit(start, time_limit):
+                return run_key, {'status': 'not_attempted'}
+            return run_key, self.submit(*args)
+
+        if not submissions:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(submissions))) as executor:
+            return dict(executor.map(submit, submissions.items()))
+
+
+def check_runs_without_output(res, check, run_name, my_auth, start, workers=DEFAULT_QC_WORKERS):
     """Common processing for checks that are running on files and not producing output files
-    like qcs ones producing extra files"""
+    like qcs ones producing extra files. Runs of workers files are looked up at a time."""
     # no successful run
     missing_run = []
     # successful run but no expected metadata change (qc or extra file)
@@ -802,14 +1076,19 @@ def check_runs_without_output(res, check, run_name, my_auth, start):
     # multiple failed runs
     problems = []
 
-    for a_file in res:
+    def get_report(a_file):
         # lambda has a time limit (300sec), kill before it is reached so we get some results
-        now = datetime.utcnow()
-        if (now-start).seconds > lambda_limit:
+        if is_past_time_limit(start, LAMBDA_LIMIT):
+            return None
+        return get_wfr_out(a_file, run_name,  key=my_auth, md_qc=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        reports = list(executor.map(get_report, res))
+    for a_file, report in zip(res, reports):
+        if report is None:
             check.brief_output.append('did not complete checking all')
             break
         file_id = a_file['accession']
-        report = get_wfr_out(a_file, run_name,  key=my_auth, md_qc=True)
         if report['status'] == 'running':
             running.append(file_id)
         elif report['status'].startswith("no complete run, too many"):
@@ -846,10 +1125,40 @@ def check_runs_without_output(res, check, run_name, my_auth, start):
     return check
 
 
-def is_there_my_qc_metric(file_meta, qc_metric_name, my_auth):
+class QualityMetricCache:
+    """QualityMetric items by uuid, each fetched once even when several
+    threads ask for it at the same time. Failed fetches are not cached.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def get(self, qc_uuid):
+        with self._lock:
+            future = self._futures.get(qc_uuid)
+            fetch = future is None
+            if fetch:
+                future = self._futures[qc_uuid] = Future()
+        if fetch:
+            try:
+                future.set_result(ff_utils.get_metadata(qc_uuid, key=self.key))
+            except Exception as e:
+                with self._lock:
+                    del self._futures[qc_uuid]
+                future.set_exception(e)
+        return future.result()
+
+
+def is_there_my_qc_metric(file_meta, qc_metric_name, my_auth, qc_cache=None):
     if not file_meta.get('quality_metric'):
         return False
-    qc_results = ff_utils.get_metadata(file_meta['quality_metric']['uuid'], key=my_auth)
+    qc_uuid = file_meta['quality_metric']['uuid']
+    if qc_cache is not None:
+        qc_results = qc_cache.get(qc_uuid)
+    else:
+        qc_results = ff_utils.get_metadata(qc_uuid, key=my_auth)
     if qc_results['display_title'].startswith('QualityMetricQclist'):
         if not qc_results.get('qc_list'):
             return False
@@ -862,6 +1171,21 @@ def is_there_my_qc_metric(file_meta, qc_metric_name, my_auth):
     return True
 
 
+def files_with_qc_metric(files, qc_metric_name, my_auth, workers=DEFAULT_QC_WORKERS, qc_cache=None):
+    """is_there_my_qc_metric for many files at once, with QualityMetrics
+    shared by files fetched once.
+
+    Returns list of bools in the order of files.
+    """
+    if qc_cache is None:
+        qc_cache = QualityMetricCache(my_auth)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(
+            lambda file_meta: is_there_my_qc_metric(file_meta, qc_metric_name, my_auth, qc_cache=qc_cache),
+            files
+        ))
+
+
 def fetch_wfr_associated(wfr_info):
     """Given wfr embedded frame, find associated output files and qcs"""
     wfr_as_list = []
@@ -1,3 +1,8 @@
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
+
+
 # lambda limit
 LAMBDA_LIMIT = 800
 
@@ -25,23 +30,54 @@ wf_dict = [
 ]
 
 
-def step_settings(step_name, my_organism, attribution, overwrite=None):
-    """Return a setting dict for given step, and modify variables in
-    output files; genome assembly, file_type, desc
-    overwrite is a dictionary, if given will overwrite keys in resulting template
-    overwrite = {'config': {"a": "b"},
-                 'parameters': {'c': "d"},
-                 'custom_pf_fields': { 'file_arg': {'e': 'f'}}
-                    }
+def freeze(value):
+    """Read-only copy of a settings value: dicts become mappingproxies and
+    lists tuples, recursively.
+    """
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    """Plain, mutable copy of a frozen settings value."""
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+def index_templates(templates):
+    """Frozen templates by app_name, built once so steps are looked up
+    directly and no call can change them. App names listed more than once
+    map to None, as they are ambiguous.
+    """
+    index = {}
+    for template in templates:
+        name = template['app_name']
+        index[name] = None if name in index else freeze(template)
+    return MappingProxyType(index)
+
+
+wf_templates = index_templates(wf_dict)
+
+
+@lru_cache(maxsize=None)
+def base_step_settings(step_name, my_organism):
+    """Frozen settings for given step and organism, before attribution and
+    overwrites; computed once per pair.
     """
-    genome = ""
     genome = mapper.get(my_organism)
 
-    templates = [i for i in wf_dict if i['app_name'] == step_name]
     # every app name should exist only once in wf_dict
-    if len(templates) != 1:
+    if step_name not in wf_templates:
+        raise ValueError('There are no {} settings on wfrset_utils.py'.format(step_name))
+    if wf_templates[step_name] is None:
         raise ValueError('There are multiple {} settings on wfr_cgap_utils.py'.format(step_name))
-    template = templates[0]
+    template = thaw(wf_templates[step_name])
 
     # add genomes to output files
     if template.get('custom_pf_fields'):
@@ -63,8 +99,23 @@ def step_settings(step_name, my_organism, attribution, overwrite=None):
     if not template.get('parameters'):
         template['parameters'] = {}
 
-    template['common_fields'] = attribution
     template['custom_qc_fields'] = {}
+    return freeze(template)
+
+
+def step_settings(step_name, my_organism, attribution, overwrite=None):
+    """Return a setting dict for given step, and modify variables in
+    output files; genome assembly, file_type, desc
+    overwrite is a dictionary, if given will overwrite keys in resulting template
+    overwrite = {'config': {"a": "b"},
+                 'parameters': {'c': "d"},
+                 'custom_pf_fields': { 'file_arg': {'e': 'f'}}
+                    }
+    Each call gets its own copy of the memoized base settings, so callers
+    may change it freely, and concurrently.
+    """
+    template = thaw(base_step_settings(step_name, my_organism))
+    template['common_fields'] = attribution
 
     if overwrite:
         for a_key in overwrite:
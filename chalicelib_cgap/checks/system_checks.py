@@ -1,8 +1,6 @@
 import os
-import json
 import datetime
 import boto3
-import time
 from foursight_core.stage import Stage
 from foursight_core.checks.helpers.sys_utils import (
     wipe_build_indices
@@ -18,6 +16,10 @@ from dcicutils import (
 # individually - they're now part of class Decorators in foursight-core::decorators
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
+from .helpers.eb_utils import collect_environment_health
+from .helpers.item_counts import forecast_indexing, load_item_count_series
+from .helpers.queue_utils import DEFAULT_DEDUP_WORKERS, QueueDeduplicator
+from .helpers.utils import search_with_fields
 
 
 # XXX: put into utils?
@@ -26,6 +28,18 @@ CGAP_TEST_CLUSTER = 'search-cgap-testing-6-8-vo4mdkmkshvmyddc65ux7dtaou.us-east-
 TEST_ES_CLUSTERS = [
     CGAP_TEST_CLUSTER,
 ]
+ONE_MB = 1024 ** 2
+ONE_GB = 1024 ** 3
+# cat.indices columns reported by status_of_elasticsearch_indices
+ES_INDEX_COLUMNS = 'health,status,index,uuid,pri,rep,docs.count,docs.deleted,store.size,pri.store.size'
+INDEXING_RECORDS_WINDOW = datetime.timedelta(days=3)
+AWSEM_JOB_SEARCH_CHUNK = 50  # awsem job ids per workflow run search
+INDEXING_RECORDS_PAGE_SIZE = 500
+# fields of indexing records shown by indexing_records
+INDEXING_RECORD_FIELDS = [
+    'indexing_status', 'indexing_started', 'indexing_finished',
+    'indexing_elapsed', 'indexing_count', 'errors',
+]
 
 
 @check_function()
@@ -41,19 +55,25 @@ def elastic_search_space(connection, **kwargs):
     check = CheckResult(connection, 'elastic_search_space')
     full_output = {}
     client = es_utils.create_es_client(connection.ff_es, True)
-    # use cat.nodes to get id,diskAvail for all nodes, filter out empties
-    node_space_entries = filter(None, [data.split() for data in client.cat.nodes(h='id,diskAvail').split('\n')])
+    # use cat.nodes to get id,diskAvail for all nodes, in bytes
+    node_space_entries = client.cat.nodes(h='id,diskAvail', bytes='b', format='json')
     check.summary = check.description = None
     full_output['nodes'] = {}
-    for _id, remaining_space in node_space_entries:
-        if 'gb' not in remaining_space:
-            if 'mb' not in remaining_space:
+    for node in node_space_entries:
+        if node.get('diskAvail') is None:
+            continue
+        remaining_bytes = int(node['diskAvail'])
+        if remaining_bytes < ONE_GB:
+            if remaining_bytes < ONE_MB:
                 check.status = 'FAIL'
                 check.summary = check.description = 'At least one of the nodes in this env has no space remaining'
-            else:
+            elif check.status != 'FAIL':
                 check.status = 'WARN'
                 check.summary = check.description = 'At least one of the nodes in this env is low on space'
-        full_output['nodes'][_id.strip()] = { 'remaining_space': remaining_space }
+        full_output['nodes'][node['id']] = {
+            'remaining_space': '%.1fgb' % (remaining_bytes / ONE_GB),
+            'remaining_bytes': remaining_bytes,
+        }
     if check.summary is None:
         check.status = 'PASS'
         check.summary = check.description = 'All nodes have >1gb remaining disk space'
@@ -137,11 +157,7 @@ def elastic_beanstalk_health(connection, **kwargs):
     """
     check = CheckResult(connection, 'elastic_beanstalk_health')
     full_output = {}
-    eb_client = boto3.client('elasticbeanstalk')
-    resp = eb_client.describe_environment_health(
-        EnvironmentName=connection.ff_env,
-        AttributeNames=['All']
-    )
+    resp, instances_resp, versions = collect_environment_health(connection.ff_env)
     resp_status = resp.get('ResponseMetadata', {}).get('HTTPStatusCode', None)
     if resp_status >= 400:
         check.status = 'ERROR'
@@ -154,26 +170,18 @@ def elastic_beanstalk_health(connection, **kwargs):
     full_output['causes'] = resp.get('Causes')
     full_output['instance_health'] = []
     # now look at the individual instances
-    resp = eb_client.describe_instances_health(
-        EnvironmentName=connection.ff_env,
-        AttributeNames=['All']
-    )
-    resp_status = resp.get('ResponseMetadata', {}).get('HTTPStatusCode', None)
+    resp_status = instances_resp.get('ResponseMetadata', {}).get('HTTPStatusCode', None)
     if resp_status >= 400:
         check.status = 'ERROR'
         check.description = 'Could not establish a connection to AWS (status %s).' % resp_status
         return check
-    instances_health = resp.get('InstanceHealthList', [])
+    instances_health = instances_resp.get('InstanceHealthList', [])
     for instance in instances_health:
         inst_info = {}
         inst_info['deploy_status'] = instance['Deployment']['Status']
         inst_info['deploy_version'] = instance['Deployment']['VersionLabel']
         # get version deployment time
-        application_versions = eb_client.describe_application_versions(
-            ApplicationName='4dn-web',
-            VersionLabels=[inst_info['deploy_version']]
-        )
-        deploy_info = application_versions['ApplicationVersions'][0]
+        deploy_info = versions[inst_info['deploy_version']]
         inst_info['version_deployed_at'] = datetime.datetime.strftime(deploy_info['DateCreated'], "%Y-%m-%dT%H:%M:%S")
         inst_info['instance_deployed_at'] = datetime.datetime.strftime(instance['Deployment']['DeploymentTime'], "%Y-%m-%dT%H:%M:%S")
         inst_info['instance_launced_at'] = datetime.datetime.strftime(instance['LaunchedAt'], "%Y-%m-%dT%H:%M:%S")
@@ -203,17 +211,30 @@ def status_of_elasticsearch_indices(connection, **kwargs):
     check = CheckResult(connection, 'status_of_elasticsearch_indices')
     ### the check
     client = es_utils.create_es_client(connection.ff_es, True)
-    indices = client.cat.indices(v=True).split('\n')
-    split_indices = [ind.split() for ind in indices]
-    headers = split_indices.pop(0)
+    indices = client.cat.indices(h=ES_INDEX_COLUMNS, bytes='b', format='json')
     index_info = {} # for full output
     warn_index_info = {} # for brief output
-    for index in split_indices:
-        if len(index) == 0:
-            continue
-        index_info[index[2]] = {header: index[idx] for idx, header in enumerate(headers)}
-        if index_info[index[2]]['health'] != 'green' or index_info[index[2]]['status'] != 'open':
-            warn_index_info[index[2]] = index_info[index[2]]
+    for index in indices:
+        index_info[index['index']] = index
+        if index['health'] != 'green' or index['status'] != 'open':
+            warn_index_info[index['index']] = index
+    # growth of each index since the last run
+    prior = check.get_latest_result()
+    if prior and isinstance(prior.get('full_output'), dict):
+        hours = (datetime.datetime.utcnow() -
+                 datetime.datetime.strptime(prior['uuid'], "%Y-%m-%dT%H:%M:%S.%f")).total_seconds() / 3600
+        for name, info in index_info.items():
+            prior_info = prior['full_output'].get(name)
+            if not isinstance(prior_info, dict):
+                continue
+            for column, delta_key in [('docs.count', 'docs.delta'), ('store.size', 'store.size.delta')]:
+                try:
+                    delta = int(info[column]) - int(prior_info[column])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                info[delta_key] = delta
+                if hours > 0:
+                    info[delta_key + '.per_hour'] = round(delta / hours, 1)
     # set fields, store result
     if not index_info:
         check.status = 'FAIL'
@@ -231,20 +252,52 @@ def status_of_elasticsearch_indices(connection, **kwargs):
     return check
 
 
-@check_function()
+@check_function(forecast_window_mins=120, rate_floor=1)
 def indexing_progress(connection, **kwargs):
+    """Compare unindexed item counts to 30 mins ago and, given enough
+    item_counts_by_type history, forecast indexing over the trailing
+    forecast_window_mins. Warn if there is a backlog and the net
+    indexing rate (items/min) is below rate_floor.
+    """
     check = CheckResult(connection, 'indexing_progress')
-    # get latest and db/es counts closest to 10 mins ago
+    # get latest and db/es counts closest to 30 mins ago
     counts_check = CheckResult(connection, 'item_counts_by_type')
-    latest = counts_check.get_primary_result()
-    prior = counts_check.get_closest_result(diff_mins=30)
-    if not latest.get('full_output') or not prior.get('full_output'):
+    series = load_item_count_series(counts_check)
+    if len(series) > 1:
+        latest_idx = len(series) - 1
+        latest_time = series.time_at(latest_idx)
+        # always compare against an earlier point
+        prior_idx = min(series.closest_index(latest_time - datetime.timedelta(minutes=30)), latest_idx - 1)
+        latest_unindexed = series.unindexed_at(latest_idx)
+        prior_unindexed = series.unindexed_at(prior_idx)
+        elapsed_mins = (latest_time - series.time_at(prior_idx)).total_seconds() / 60
+    else:
+        # no stored series yet, fall back to item_counts_by_type results
+        latest = counts_check.get_primary_result()
+        prior = counts_check.get_closest_result(diff_mins=30)
+        if not latest.get('full_output') or not prior.get('full_output'):
+            check.status = 'ERROR'
+            check.description = 'There are no item_counts_by_type results to run this check with.'
+            return check
+        latest_unindexed = latest['full_output']['ALL']['DB'] - latest['full_output']['ALL']['ES']
+        prior_unindexed = prior['full_output']['ALL']['DB'] - prior['full_output']['ALL']['ES']
+        elapsed_mins = (datetime.datetime.strptime(latest['uuid'], "%Y-%m-%dT%H:%M:%S.%f") -
+                        datetime.datetime.strptime(prior['uuid'], "%Y-%m-%dT%H:%M:%S.%f")).total_seconds() / 60
+    if latest_unindexed is None or prior_unindexed is None:
         check.status = 'ERROR'
-        check.description = 'There are no item_counts_by_type results to run this check with.'
+        check.description = 'There are no total counts in item_counts_by_type results to run this check with.'
         return check
-    latest_unindexed = latest['full_output']['ALL']['DB'] - latest['full_output']['ALL']['ES']
-    prior_unindexed = prior['full_output']['ALL']['DB'] - prior['full_output']['ALL']['ES']
     diff_unindexed = latest_unindexed - prior_unindexed
+    # net items indexed per minute, and time to clear the backlog at that rate
+    rate = -diff_unindexed / elapsed_mins if elapsed_mins > 0 else 0
+    eta_mins = round(latest_unindexed / rate) if rate > 0 and latest_unindexed > 0 else None
+    check.full_output = {
+        'unindexed': latest_unindexed,
+        'change': diff_unindexed,
+        'minutes_compared': round(elapsed_mins, 1),
+        'items_per_minute': round(rate, 2),
+        'eta_minutes': eta_mins,
+    }
     if diff_unindexed == 0 and latest_unindexed != 0:
         check.status = 'FAIL'
         check.summary = 'Indexing is not progressing'
@@ -262,6 +315,25 @@ def indexing_progress(connection, **kwargs):
         check.summary = 'Indexing seems healthy'
         check.description = ' '.join(['Indexing seems healthy. There are', str(latest_unindexed),
         'remaining items to index, a change of', str(diff_unindexed), 'from thirty minutes ago.'])
+    forecast = forecast_indexing(series, datetime.timedelta(minutes=kwargs['forecast_window_mins']))
+    if forecast and 'ALL' in forecast['types']:
+        check.full_output['forecast'] = forecast
+        total = forecast['types']['ALL']
+        # the forecast's ETA replaces the two-point one, even when it has none
+        eta_mins = total['eta_minutes']
+        check.full_output['eta_minutes'] = eta_mins
+        rate_floor = kwargs['rate_floor']
+        if (check.status == 'PASS' and rate_floor is not None and total['backlog'] > 0
+                and total['items_per_minute'] < rate_floor):
+            check.status = 'WARN'
+            check.summary = 'Indexing rate is below %s items per minute' % rate_floor
+            check.description = ' '.join(['Indexed', str(total['items_per_minute']),
+                'items per minute over the past', str(forecast['window_minutes']),
+                'minutes, with', str(total['backlog']), 'items remaining to index.'])
+            check.brief_output = {item_type: info for item_type, info in forecast['types'].items()
+                                  if item_type != 'ALL'}
+    if eta_mins is not None:
+        check.description += ' Estimated %s minutes to index remaining items.' % eta_mins
     return check
 
 
@@ -277,40 +349,47 @@ def indexing_records(connection, **kwargs):
         check.status = 'PASS'
         return check
 
-    res = client.search(index=namespaced_index, doc_type='indexing', sort='uuid:desc', size=1000,
-                        body={'query': {'query_string': {'query': '_exists_:indexing_status'}}})
-    delta_days = datetime.timedelta(days=3)
-    all_records = res.get('hits', {}).get('hits', [])
+    # record uuids are their start timestamps, so a range on uuid selects
+    # the time window and sorting on it puts most recent records first
+    from_uuid = (datetime.datetime.utcnow() - INDEXING_RECORDS_WINDOW).strftime("%Y-%m-%dT%H:%M:%S.%f")
+    body = {
+        'query': {'bool': {'filter': [
+            {'exists': {'field': 'indexing_status'}},
+            {'range': {'uuid': {'gte': from_uuid}}},
+        ]}},
+        'sort': [{'uuid': {'order': 'desc'}}],
+        '_source': INDEXING_RECORD_FIELDS,
+        'size': INDEXING_RECORDS_PAGE_SIZE,
+    }
     recent_records = []
     warn_records = []
-    for rec in all_records:
-        if rec['_id'] == 'latest_indexing':
-            continue
-        time_diff = (datetime.datetime.utcnow() -
-            datetime.datetime.strptime(rec['_id'], "%Y-%m-%dT%H:%M:%S.%f"))
-        if time_diff < delta_days:
-            body = rec['_source']
+    while True:
+        res = client.search(index=namespaced_index, doc_type='indexing', body=body)
+        hits = res.get('hits', {}).get('hits', [])
+        for rec in hits:
+            if rec['_id'] == 'latest_indexing':
+                continue
+            record = rec['_source']
             # needed to handle transition to queue. can use 'indexing_started'
-            body['timestamp'] = rec['_id']
-            if body.get('errors') or body.get('indexing_status') != 'finished':
-                warn_records.append(body)
-            recent_records.append(body)
-    del all_records
-    # sort so most recent records are first
-    sort_records = sorted(recent_records, key=lambda rec: datetime.datetime.strptime(rec['timestamp'], "%Y-%m-%dT%H:%M:%S.%f"), reverse=True)
-    check.full_output = sort_records
+            record['timestamp'] = rec['_id']
+            if record.get('errors') or record.get('indexing_status') != 'finished':
+                warn_records.append(record)
+            recent_records.append(record)
+        if len(hits) < INDEXING_RECORDS_PAGE_SIZE:
+            break
+        body['search_after'] = hits[-1]['sort']
+    check.full_output = recent_records
     if warn_records:
-        sort_warn_records = sorted(warn_records, key=lambda rec: datetime.datetime.strptime(rec['timestamp'], "%Y-%m-%dT%H:%M:%S.%f"), reverse=True)
         check.summary = check.description = 'Indexing runs in the past three days may require attention'
         check.status = 'WARN'
-        check.brief_output = sort_warn_records
+        check.brief_output = warn_records
     else:
         check.summary = check.description = 'Indexing runs from the past three days seem normal'
         check.status = 'PASS'
     return check
 
 
-@check_function(time_limit=480)
+@check_function(time_limit=480, workers=DEFAULT_DEDUP_WORKERS, compact_seen_set=False)
 def secondary_queue_deduplication(connection, **kwargs):
     check = CheckResult(connection, 'secondary_queue_deduplication')
     # maybe handle this in check_setup.json
@@ -332,17 +411,6 @@ def secondary_queue_deduplication(connection, **kwargs):
     visible = attrs.get('Attributes', {}).get('ApproximateNumberOfMessages', '0')
     starting_count = int(visible)
     time_limit = kwargs['time_limit']
-    t0 = time.time()
-    sent = 0
-    deleted = 0
-    deduplicated = 0
-    total_msgs = 0
-    replaced = 0
-    repeat_replaced = 0
-    problem_msgs = []
-    elapsed = round(time.time() - t0, 2)
-    failed = []
-    seen_uuids = set()
     # this is a bit of a hack -- send maximum sid with every message we replace
     # get the maximum sid at the start of deduplication and update it if we
     # encounter a higher sid
@@ -354,112 +422,25 @@ def secondary_queue_deduplication(connection, **kwargs):
         return check
     max_sid = max_sid_resp['max_sid']
 
-    exit_reason = 'out of time'
     dedup_msg = 'FS dedup uuid: %s' % kwargs['uuid']
-    while elapsed < time_limit:
-        # end if we are spinning our wheels replacing the same uuids
-        if (replaced + repeat_replaced) >= starting_count:
-            exit_reason = 'starting uuids fully covered'
-            break
-        send_uuids = set()
-        to_send = []
-        to_delete = []
-        recieved = client.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=10,  # batch size for all sqs ops
-            WaitTimeSeconds=1  # 1 second of long polling
-        )
-        batch = recieved.get("Messages", [])
-        if not batch:
-            exit_reason = 'no messages left'
-            break
-        for msg in batch:
-            try:
-                msg_body = json.loads(msg['Body'])
-            except json.JSONDecodeError:
-                problem_msgs.append(msg['Body'])
-                continue
-            total_msgs += 1
-            msg_uuid = msg_body['uuid']
-            # update max_sid with message sid if applicable
-            if msg_body.get('sid') is not None and msg_body['sid'] > max_sid:
-                max_sid = msg_body['sid']
-            msg_body['sid'] = max_sid
-            to_process = {
-                'Id': msg['MessageId'],
-                'ReceiptHandle': msg['ReceiptHandle']
-            }
-            # every item gets deleted; original uuids get re-sent
-            to_delete.append(to_process)
-            if msg_uuid in seen_uuids and msg_body.get('fs_detail', '') != dedup_msg:
-                deduplicated += 1
-            else:
-                # don't increment replaced count if we've seen the item before
-                if msg_uuid not in seen_uuids:
-                    replaced += 1
-                else:
-                    repeat_replaced += 1
-                time.sleep(0.0001)  # slight sleep for time-based Id
-                # add foursight uuid stamp
-                msg_body['fs_detail'] = dedup_msg
-                # add a slight delay to recycled messages, so that they are
-                # not available for consumption for 2 seconds
-                send_info = {
-                    'Id': str(int(time.time() * 1000000)),
-                    'MessageBody': json.dumps(msg_body),
-                    'DelaySeconds': 2
-                }
-                to_send.append(send_info)
-                seen_uuids.add(msg_uuid)
-                send_uuids.add(msg_uuid)
-        if to_send:
-            res = client.send_message_batch(
-                QueueUrl=queue_url,
-                Entries=to_send
-            )
-            # undo deduplication if errors are detected
-            res_failed = res.get('Failed', [])
-            failed.extend(res_failed)
-            if res_failed:
-                # handle conservatively on error and don't delete
-                for uuid in send_uuids:
-                    if uuid in seen_uuids:
-                        seen_uuids.remove(uuid)
-                        replaced -= 1
-                continue
-            sent += len(to_send)
-        if to_delete:
-            res = client.delete_message_batch(
-                QueueUrl=queue_url,
-                Entries=to_delete
-            )
-            failed.extend(res.get('Failed', []))
-            deleted += len(to_delete)
-        elapsed = round(time.time() - t0, 2)
-
-    check.full_output = {
-        'total_messages_covered': total_msgs,
-        'uuids_covered': len(seen_uuids),
-        'deduplicated': deduplicated,
-        'replaced': replaced,
-        'repeat_replaced': repeat_replaced,
-        'time': elapsed,
-        'problem_messages': problem_msgs,
-        'exit_reason': exit_reason
-    }
+    dedup = QueueDeduplicator(client, queue_url, dedup_msg, max_sid, starting_count,
+                              workers=kwargs['workers'], compact=kwargs['compact_seen_set'])
+    dedup.run(time_limit)
+    check.full_output = dedup.stats()
     # these are some standard things about the result that should always be true
-    if replaced != len(seen_uuids) or (deduplicated + replaced + repeat_replaced) != total_msgs:
+    if (dedup.replaced != len(dedup.seen_uuids) or
+            (dedup.deduplicated + dedup.replaced + dedup.repeat_replaced) != dedup.total_msgs):
         check.status = 'FAIL'
         check.summary = 'Message totals do not add up. Report to Carl'
-    if failed:
+    if dedup.failed:
         if check.status != 'FAIL':
             check.status = 'WARN'
             check.summary = 'Queue deduplication encountered an error'
-        check.full_output['failed'] = failed
+        check.full_output['failed'] = dedup.failed.items
     else:
         check.status = 'PASS'
-        check.summary = 'Removed %s duplicates from %s secondary queue' % (deduplicated, connection.ff_env)
-    check.description = 'Items on %s secondary queue were deduplicated. Started with approximately %s items; replaced %s items and removed %s duplicates. Covered %s unique uuids. Took %s seconds.' % (connection.ff_env, starting_count, replaced, deduplicated, len(seen_uuids), elapsed)
+        check.summary = 'Removed %s duplicates from %s secondary queue' % (dedup.deduplicated, connection.ff_env)
+    check.description = 'Items on %s secondary queue were deduplicated. Started with approximately %s items; replaced %s items and removed %s duplicates. Covered %s unique uuids. Took %s seconds (%s messages/second).' % (connection.ff_env, starting_count, dedup.replaced, dedup.deduplicated, len(dedup.seen_uuids), dedup.elapsed, dedup.msgs_per_second)
 
     return check
 
@@ -484,12 +465,15 @@ def check_long_running_ec2s(connection, **kwargs):
                  datetime.timedelta(days=7))
     fail_time = (datetime.datetime.now(datetime.timezone.utc) -
                  datetime.timedelta(days=14))
-    ec2_res = client.describe_instances(
+    paginator = client.get_paginator('describe_instances')
+    pages = paginator.paginate(
         Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]
     )
     check.full_output = []
     check.brief_output = {'one_week': [], 'two_weeks': []}
-    for ec2_info in ec2_res.get('Reservations', []):
+    # awsem job id --> logs of long running instances for the job
+    job_logs = {}
+    for ec2_info in (reservation for page in pages for reservation in page.get('Reservations', [])):
         instances = ec2_info.get('Instances', [])
         if not instances:
             continue
@@ -519,14 +503,9 @@ def check_long_running_ec2s(connection, **kwargs):
                 flag_instance = False
             # see if long running instances are associated with a deleted WFR
             if flag_instance and inst_name and created < warn_time:
-                search_url = 'search/?type=WorkflowRunAwsem&awsem_job_id='
-                search_url += '&awsem_job_id='.join([name[6:] for name in inst_name if name.startswith('awsem-')])
-                wfrs = ff_utils.search_metadata(search_url, key=connection.ff_keys)
-                if wfrs:
-                    ec2_log['active workflow runs'] = [wfr['@id'] for wfr in wfrs]
-                deleted_wfrs = ff_utils.search_metadata(search_url + '&status=deleted', key=connection.ff_keys)
-                if deleted_wfrs:
-                    ec2_log['deleted workflow runs'] = [wfr['@id'] for wfr in deleted_wfrs]
+                for name in inst_name:
+                    if name.startswith('awsem-'):
+                        job_logs.setdefault(name[6:], []).append(ec2_log)
             # always add record to full_output; add to brief_output if
             # the instance is flagged based on 'Name' tag
             if created < fail_time:
@@ -538,6 +517,19 @@ def check_long_running_ec2s(connection, **kwargs):
                     check.brief_output['one_week'].append(ec2_log)
                 check.full_output.append(ec2_log)
 
+    # look up workflow runs for all jobs at once, a chunk of job ids per search
+    job_ids = list(job_logs)
+    for idx in range(0, len(job_ids), AWSEM_JOB_SEARCH_CHUNK):
+        search_url = 'search/?type=WorkflowRunAwsem'
+        search_url += ''.join('&awsem_job_id=' + job_id for job_id in job_ids[idx: idx + AWSEM_JOB_SEARCH_CHUNK])
+        fields = ['@id', 'awsem_job_id', 'status']
+        wfrs = search_with_fields(search_url, fields, connection.ff_keys)
+        wfrs += search_with_fields(search_url + '&status=deleted', fields, connection.ff_keys)
+        for wfr in wfrs:
+            log_key = 'deleted workflow runs' if wfr.get('status') == 'deleted' else 'active workflow runs'
+            for ec2_log in job_logs.get(wfr.get('awsem_job_id'), []):
+                ec2_log.setdefault(log_key, []).append(wfr['@id'])
+
     if check.brief_output['one_week'] or check.brief_output['two_weeks']:
         num_1wk = len(check.brief_output['one_week'])
         num_2wk = len(check.brief_output['two_weeks'])
@@ -13,6 +13,7 @@ from magma_ff.create_metawfr import (
 from .helpers import constants
 from .helpers import wfr_utils
 from .helpers.confchecks import action_function, check_function
+from .helpers.patch_utils import bulk_patch_metadata, get_patched_in_prior_run
 from .helpers.utils import (
     initialize_check,
     initialize_action,
@@ -22,6 +23,7 @@ from .helpers.utils import (
     make_embed_request,
     get_step_function_name,
     is_past_time_limit,
+    search_with_fields,
 )
 from .helpers.wfrset_utils import LAMBDA_LIMIT
 
@@ -42,6 +44,14 @@ FINAL_STATUS_TO_KILL = [
     constants.MWFR_PENDING,
     constants.MWFR_FAILED,
 ]
+# Fields required from file searches by md5runCGAP_status
+MD5_STATUS_FIELDS = [
+    "@type",
+    "accession",
+    "upload_key",
+    "workflow_run_inputs.uuid",
+    "workflow_run_inputs.display_title",
+]
 SPOT_FAILURE_DESCRIPTIONS = ["EC2 unintended termination", "EC2 Idle error"]
 
 
@@ -119,7 +129,7 @@ def md5runCGAP_status(connection, file_type="", start_date=None, **kwargs):
     query += "&type=" + file_type
     if start_date is not None:
         query += "&date_created.from=" + start_date
-    res = ff_utils.search_metadata(query, key=my_auth)
+    res = search_with_fields(query, MD5_STATUS_FIELDS, my_auth)
     if not res:
         check.status = constants.CHECK_PASS
         check.summary = "All Good!"
@@ -200,6 +210,7 @@ def md5runCGAP_start(connection, start_missing=True, start_not_switched=True, **
 
     targets = []
     runs_started = {}
+    runs_started_without_costupdater = []
     runs_failed = {}
     step_function_name = get_step_function_name(connection)
     if start_missing:
@@ -216,13 +227,13 @@ def md5runCGAP_start(connection, start_missing=True, start_not_switched=True, **
         action.output["error"] = msg
         action.description = msg
         return action
+    attributions = wfr_utils.get_file_attributions(targets, connection.ff_keys)
+    submissions = {}
     for target_file in targets:
-        if is_past_time_limit(start, LAMBDA_LIMIT):
-            action.description = "Did not complete action due to time limitations"
-            break
-        target_file_properties = ff_utils.get_metadata(
-            target_file, key=connection.ff_keys, add_on="frame=raw"
-        )
+        target_file_properties = attributions.get(target_file)
+        if target_file_properties is None:
+            runs_failed[target_file] = "File not found"
+            continue
         workflow_run_common_fields = {
             "project": target_file_properties["project"],
             "institution": target_file_properties["institution"],
@@ -245,19 +256,25 @@ def md5runCGAP_start(connection, start_missing=True, start_not_switched=True, **
             "input_file": target_file_properties["uuid"],
             "additional_file_parameters": {"input_file": {"mount": True}},
         }
-        run_result = wfr_utils.run_missing_wfr(
+        submissions[target_file] = (
             workflow_run_template,
             file_parameters,
-            target_file_properties["accession"],
-            connection.ff_keys,
-            connection.ff_env,
-            step_function_name,
+            target_file_properties["accession"] or target_file,
         )
-        if run_result.startswith("http"):  # Success is AWS URL
-            runs_started[target_file] = run_result
-        else:  # Failure is error message
-            runs_failed[target_file] = run_result
+    submitter = wfr_utils.WorkflowSubmitter(connection.ff_env, step_function_name)
+    submit_results = submitter.submit_all(submissions, start=start, time_limit=LAMBDA_LIMIT)
+    for target_file, result in submit_results.items():
+        if result["status"] == "started":
+            runs_started[target_file] = result["url"]
+            if not result["costupdater_started"]:
+                # throttled after the run started, so no cost updater or job record
+                runs_started_without_costupdater.append(target_file)
+        elif result["status"] == "failed":
+            runs_failed[target_file] = result["error"]
+        else:
+            action.description = "Did not complete action due to time limitations"
     action.output["runs_started"] = runs_started
+    action.output["runs_started_without_costupdater"] = runs_started_without_costupdater
     action.output["runs_failed"] = runs_failed
     if not runs_failed:
         action.status = constants.ACTION_PASS
@@ -737,26 +754,23 @@ def check_vcf_ingestion_errors(connection, file_accessions=None, **kwargs):
 @action_function()
 def reset_vcf_ingestion_errors(connection, **kwargs):
     """Reset VCF metadata for reingestion."""
+    start = datetime.utcnow()
     action, check_result = initialize_action(
         "reset_vcf_ingestion_errors", connection, kwargs
     )
 
-    success = []
-    error = []
-    for vcf_atid in check_result:
-        patch = {"file_ingestion_status": "N/A"}
-        try:
-            ff_utils.patch_metadata(
-                patch,
-                vcf_atid + "?delete_fields=file_ingestion_error",
-                key=connection.ff_keys,
-            )
-            success.append(vcf_atid)
-        except Exception as e:
-            error[vcf_atid] = str(e)
-    action.output["success"] = success
-    action.output["error"] = error
-    if not error:
+    patch = {"file_ingestion_status": "N/A"}
+    patches = {vcf_atid: patch for vcf_atid in check_result}
+    report = bulk_patch_metadata(
+        patches,
+        connection.ff_keys,
+        add_on="delete_fields=file_ingestion_error",
+        start=start,
+        time_limit=LAMBDA_LIMIT,
+        already_patched=get_patched_in_prior_run(action, kwargs),
+    )
+    action.output.update(report.to_dict())
+    if not report.error and not report.not_attempted:
         action.status = constants.ACTION_PASS
     return action
 
@@ -1083,26 +1097,29 @@ def find_meta_workflow_runs_to_kill(
 @action_function()
 def kill_meta_workflow_runs(connection, **kwargs):
     """Stop MetaWorkflowRuns from further foursight checks/actions."""
+    start = datetime.utcnow()
     action, check_result = initialize_action(
         "kill_meta_workflow_runs", connection, kwargs
     )
     action.description = "Stop MetaWorkflowfuns from further updates"
 
-    success = []
-    error = {}
     meta_workflow_runs_to_patch = check_result["meta_workflow_runs"]
     patch_body = {"final_status": "stopped"}
-    for meta_workflow_run_uuid in meta_workflow_runs_to_patch:
-        try:
-            ff_utils.patch_metadata(
-                patch_body, obj_id=meta_workflow_run_uuid, key=connection.ff_keys
-            )
-            success.append(meta_workflow_run_uuid)
-        except Exception as error_msg:
-            error[meta_workflow_run_uuid] = str(error_msg)
-    action.output["success"] = success
-    action.output["error"] = error
-    if not error:
+    patches = {
+        meta_workflow_run_uuid: patch_body
+        for meta_workflow_run_uuid in meta_workflow_runs_to_patch
+    }
+    report = bulk_patch_metadata(
+        patches,
+        connection.ff_keys,
+        start=start,
+        time_limit=LAMBDA_LIMIT,
+        already_patched=get_patched_in_prior_run(action, kwargs),
+    )
+    action.output.update(report.to_dict())
+    if report.not_attempted:
+        action.description = "Did not complete action due to time limitations"
+    if not report.error and not report.not_attempted:
         action.status = constants.ACTION_PASS
     return action
 
@@ -6,6 +6,7 @@ import time
 import itertools
 import random
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dcicutils import ff_utils
 from dcicutils.env_utils import prod_bucket_env_for_app
 from foursight_core.checks.helpers import wrangler_utils
@@ -16,20 +17,144 @@ from foursight_core.checks.helpers import wrangler_utils
 # that requires initialization with foursight prefix.
 from .helpers.confchecks import *
 from .helpers import clone_utils
+from .helpers.item_counts import load_item_count_series, record_item_counts
+from .helpers.patch_utils import (
+    DEFAULT_MAX_WORKERS, bulk_patch_metadata, get_patched_in_prior_run, staged_bulk_patch_metadata
+)
+from .helpers.utils import is_past_time_limit, search_with_fields
+from .helpers.wfrset_utils import LAMBDA_LIMIT
 
 
 # use a random number to stagger checks
 random_wait = 20
 
+# fields requested from searches, so checks do not pull full embedded frames
+DELETED_INPUT_WFR_FIELDS = [
+    'uuid', 'display_title',
+    'input_files.value.uuid', 'input_files.value.status',
+    'output_files.value.uuid', 'output_files.value_qc.uuid',
+    'output_quality_metrics.value.uuid',
+]
+# number of file uuids per downstream wfr search, keeps urls to a sane length
+CASCADE_SEARCH_CHUNK = 20
+# cases cloned at once by clone_cases, each making its own concurrent requests
+CLONE_CASE_WORKERS = 4
+OPF_LAB_FIELDS = [
+    '@id', 'experiment_sets.uuid', 'experiments.uuid',
+    'lab.uuid', 'lab.display_title', 'contributing_labs.uuid',
+]
+
+
+def wfr_associated_items(wfr_info):
+    """Given wfr info, find uuids of associated output files and qcs"""
+    associated = []
+    for o in wfr_info.get('output_files', []):
+        if o.get('value'):
+            associated.append(o['value']['uuid'])
+        if o.get('value_qc'):
+            associated.append(o['value_qc']['uuid'])
+    for qc in wfr_info.get('output_quality_metrics', []):
+        if qc.get('value'):
+            associated.append(qc['value']['uuid'])
+    return list(dict.fromkeys(associated))
+
+
+def wfr_output_files(wfr_info):
+    """Given wfr info, find uuids of output files, which other wfrs may use as input"""
+    return list(dict.fromkeys(o['value']['uuid'] for o in wfr_info.get('output_files', []) if o.get('value')))
+
+
+def search_downstream_wfrs(file_uuids, key):
+    """Find live wfrs that take any of the given files as input"""
+    search_query = 'search/?type=WorkflowRun&status!=deleted'
+    search_query += ''.join('&input_files.value.uuid=' + file_uuid for file_uuid in file_uuids)
+    return search_with_fields(search_query, DELETED_INPUT_WFR_FIELDS, key)
+
+
+def expand_deleted_input_cascade(root_wfrs, key, start, time_limit=LAMBDA_LIMIT):
+    """Breadth-first expansion from wfrs with deleted inputs to all live
+    downstream wfrs that consume their output files.
+
+    Each level's output files (not qcs, which are never wfr inputs) are
+    searched concurrently in chunks, and a visited set ensures an output
+    shared by several wfrs is expanded once, attributed to the first root.
+
+    Returns a tuple of:
+        - dict of wfr uuid to dict with depth, root wfr uuid and
+          associated output/qc uuids
+        - list of [input file uuid, wfr uuid] for downstream provenance wfrs
+        - bool, True if expansion stopped early due to time limit
+    """
+    wfrs = {}
+    provenance = []
+    visited = set()
+    file_root = {}  # output file uuid --> root wfr it descends from
+    frontier = []
+    for wfr in root_wfrs:
+        associated = wfr_associated_items(wfr)
+        wfrs[wfr['uuid']] = {'depth': 0, 'root': wfr['uuid'], 'items': associated}
+        visited.add(wfr['uuid'])
+        outputs = wfr_output_files(wfr)
+        for output in outputs:
+            file_root.setdefault(output, wfr['uuid'])
+        frontier.extend(outputs)
+    depth = 0
+    with ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS) as executor:
+        while frontier:
+            if is_past_time_limit(start, time_limit):
+                return wfrs, provenance, True
+            frontier = [uuid for uuid in dict.fromkeys(frontier) if uuid not in visited]
+            visited.update(frontier)
+            depth += 1
+            chunks = [frontier[i: i + CASCADE_SEARCH_CHUNK]
+                      for i in range(0, len(frontier), CASCADE_SEARCH_CHUNK)]
+            next_frontier = []
+            for found in executor.map(lambda chunk: search_downstream_wfrs(chunk, key), chunks):
+                for wfr in found:
+                    if wfr['uuid'] in visited:
+                        continue
+                    visited.add(wfr['uuid'])
+                    infile = [f['value']['uuid'] for f in wfr.get('input_files', [])
+                              if (f.get('value') or {}).get('uuid') in file_root][0]
+                    if wfr['display_title'].startswith('File Provenance Tracking'):
+                        provenance.append([infile, wfr['uuid']])
+                        continue
+                    associated = wfr_associated_items(wfr)
+                    wfrs[wfr['uuid']] = {'depth': depth, 'root': file_root[infile], 'items': associated}
+                    outputs = wfr_output_files(wfr)
+                    for output in outputs:
+                        file_root.setdefault(output, file_root[infile])
+                    next_frontier.extend(outputs)
+            frontier = next_frontier
+    return wfrs, provenance, False
+
+
+def deletion_stages(wfrs):
+    """Order items for deletion so that dependents are deleted first:
+    deepest wfrs first, and each wfr only after its outputs and qcs.
+    A partially completed deletion then always leaves a live wfr with a
+    deleted input, which the check will find again.
+    """
+    max_depth = max(info['depth'] for info in wfrs.values())
+    stages = []
+    for level in range(max_depth, -1, -1):
+        level_wfrs = [uuid for uuid, info in wfrs.items() if info['depth'] == level]
+        outputs = [item for uuid in level_wfrs for item in wfrs[uuid]['items']]
+        stages.extend([list(dict.fromkeys(outputs)), level_wfrs])
+    return [stage for stage in stages if stage]
+
 
 @check_function(cmp_to_last=False, action="patch_workflow_run_to_deleted")
 def workflow_run_has_deleted_input_file(connection, **kwargs):
     """Checks all wfrs that are not deleted, and have deleted input files
     There is an option to compare to the last, and only report new cases (cmp_to_last)
-    The full output has 2 keys, because we report provenance wfrs but not run action on them
+    The full output has 3 keys, because we report provenance wfrs but not run action on them
     problematic_provenance: stores uuid of deleted file, and the wfr that is not deleted
-    problematic_wfr:        stores deleted file,  wfr to be deleted, and its downstream items (qcs and output files)
+    problematic_wfr:        stores deleted file,  wfr to be deleted, and its downstream items (qcs and output files,
+                            and live wfrs that use those output files, with their own downstream items)
+    deletion_stages:        items to delete, grouped in the order the action patches them
     """
+    start = datetime.datetime.utcnow()
     check = CheckResult(connection, 'workflow_run_has_deleted_input_file')
     check.status = "PASS"
     check.action = "patch_workflow_run_to_deleted"
@@ -39,53 +164,49 @@ def workflow_run_has_deleted_input_file(connection, **kwargs):
     time.sleep(wait)
     # run the check
     search_query = 'search/?type=WorkflowRun&status!=deleted&input_files.value.status=deleted&limit=all'
-    bad_wfrs = ff_utils.search_metadata(search_query, key=my_key)
+    bad_wfrs = search_with_fields(search_query, DELETED_INPUT_WFR_FIELDS, my_key)
     if kwargs.get('cmp_to_last', False):
         # filter out wfr uuids from last run if so desired
         prevchk = check.get_latest_result()
         if prevchk:
-            prev_wfrs = prevchk.get('full_output', [])
-            filtered = [b.get('uuid') for b in bad_wfrs if b.get('uuid') not in prev_wfrs]
-            bad_wfrs = filtered
+            prev_output = prevchk.get('full_output') or {}
+            prev_wfrs = {case[1] for case in prev_output.get('problematic_wfrs', [])}
+            prev_wfrs.update(case[1] for case in prev_output.get('problematic_provenance', []))
+            bad_wfrs = [b for b in bad_wfrs if b.get('uuid') not in prev_wfrs]
     if not bad_wfrs:
         check.summmary = check.description = "No live WorkflowRuns linked to deleted input Files"
         return check
     brief = str(len(bad_wfrs)) + " live WorkflowRuns linked to deleted input Files"
     # problematic_provenance stores uuid of deleted file, and the wfr that is not deleted
     # problematic_wfr stores deleted file,  wfr to be deleted, and its downstream items (qcs and output files)
-    fulloutput = {'problematic_provenance': [], 'problematic_wfrs': []}
+    fulloutput = {'problematic_provenance': [], 'problematic_wfrs': [], 'deletion_stages': []}
     no_of_items_to_delete = 0
 
-    def fetch_wfr_associated(wfr_info):
-        """Given wfr_uuid, find associated output files and qcs"""
-        wfr_as_list = []
-        wfr_as_list.append(wfr_info['uuid'])
-        if wfr_info.get('output_files'):
-            for o in wfr_info['output_files']:
-                if o.get('value'):
-                    wfr_as_list.append(o['value']['uuid'])
-                if o.get('value_qc'):
-                    wfr_as_list.append(o['value_qc']['uuid'])
-        if wfr_info.get('output_quality_metrics'):
-            for qc in wfr_info['output_quality_metrics']:
-                if qc.get('value'):
-                    wfr_as_list.append(qc['value']['uuid'])
-        return list(set(wfr_as_list))
-
+    root_wfrs = []
     for wfr in bad_wfrs:
         infiles = wfr.get('input_files', [])
         delfile = [f.get('value').get('uuid') for f in infiles if f.get('value').get('status') == 'deleted'][0]
         if wfr['display_title'].startswith('File Provenance Tracking'):
             fulloutput['problematic_provenance'].append([delfile, wfr['uuid']])
         else:
-            del_list = fetch_wfr_associated(wfr)
+            root_wfrs.append((delfile, wfr))
+    if root_wfrs:
+        wfrs, provenance, timed_out = expand_deleted_input_cascade([wfr for _, wfr in root_wfrs], my_key, start)
+        fulloutput['problematic_provenance'].extend(provenance)
+        fulloutput['deletion_stages'] = deletion_stages(wfrs)
+        for delfile, wfr in root_wfrs:
+            del_list = [uuid for uuid, info in wfrs.items() if info['root'] == wfr['uuid']]
+            del_list += [item for uuid in del_list for item in wfrs[uuid]['items']]
+            del_list = list(dict.fromkeys(del_list))
             fulloutput['problematic_wfrs'].append([delfile, wfr['uuid'], del_list])
-            no_of_items_to_delete += len(del_list)
+        no_of_items_to_delete = sum(len(stage) for stage in fulloutput['deletion_stages'])
+        if timed_out:
+            brief += " (downstream search incomplete due to time limitations)"
     check.summary = "Live WorkflowRuns found linked to deleted Input Files"
     check.description = "{} live workflows were found linked to deleted input files - \
                          found {} items to delete, use action for cleanup".format(len(bad_wfrs), no_of_items_to_delete)
     if fulloutput.get('problematic_provenance'):
-        brief += " ({} provenance tracking)"
+        brief += " ({} provenance tracking)".format(len(fulloutput['problematic_provenance']))
     check.brief_output = brief
     check.full_output = fulloutput
     check.status = 'WARN'
@@ -96,25 +217,20 @@ def workflow_run_has_deleted_input_file(connection, **kwargs):
 
 @action_function()
 def patch_workflow_run_to_deleted(connection, **kwargs):
+    start = datetime.datetime.utcnow()
     action = ActionResult(connection, 'patch_workflow_run_to_deleted')
     check_res = action.get_associated_check_result(kwargs)
-    action_logs = {'patch_failure': [], 'patch_success': []}
-    my_key = connection.ff_keys
-    for a_case in check_res['full_output']['problematic_wfrs']:
-        wfruid = a_case[1]
-        del_list = a_case[2]
-        patch_data = {'status': 'deleted'}
-        for delete_me in del_list:
-            try:
-                ff_utils.patch_metadata(patch_data, obj_id=delete_me, key=my_key)
-            except Exception as e:
-                acc_and_error = [delete_me, str(e)]
-                action_logs['patch_failure'].append(acc_and_error)
-            else:
-                action_logs['patch_success'].append(wfruid + " - " + delete_me)
-    action.output = action_logs
+    patch_data = {'status': 'deleted'}
+    stages = check_res['full_output'].get('deletion_stages')
+    if not stages:
+        # results from before deletion stages were stored
+        stages = [[delete_me for a_case in check_res['full_output']['problematic_wfrs'] for delete_me in a_case[2]]]
+    report = staged_bulk_patch_metadata([{uuid: patch_data for uuid in stage} for stage in stages],
+                                        connection.ff_keys, start=start, time_limit=LAMBDA_LIMIT,
+                                        already_patched=get_patched_in_prior_run(action, kwargs))
+    action.output = report.to_dict()
     action.status = 'DONE'
-    if action_logs.get('patch_failure'):
+    if report.error or report.not_attempted:
         action.status = 'FAIL'
     return action
 
@@ -151,6 +267,12 @@ def item_counts_by_type(connection, **kwargs):
     # add ALL for total counts
     total_counts = process_counts(counts_json['db_es_total'])
     item_counts['ALL'] = total_counts
+    # keep a compact history of counts for change_in_item_counts and indexing_progress;
+    # the counts are still reported if the history cannot be updated
+    try:
+        record_item_counts(check, item_counts)
+    except Exception as e:
+        print('item_counts_by_type: could not update item count series: %s' % str(e))
     # set fields, store result
     if not item_counts:
         check.status = 'FAIL'
@@ -174,17 +296,31 @@ def change_in_item_counts(connection, **kwargs):
     wait = round(random.uniform(0.1, random_wait), 1)
     time.sleep(wait)
     counts_check = CheckResult(connection, 'item_counts_by_type')
-    latest_check = counts_check.get_primary_result()
-    # get_item_counts run closest to 10 mins
-    prior_check = counts_check.get_closest_result(diff_hours=24)
-    if not latest_check.get('full_output') or not prior_check.get('full_output'):
-        check.status = 'ERROR'
-        check.description = 'There are no counts_check results to run this check with.'
-        return check
+    series = load_item_count_series(counts_check)
+    if len(series) > 1:
+        latest_idx = len(series) - 1
+        # always compare against an earlier point
+        prior_idx = min(series.closest_index(series.time_at(latest_idx) - datetime.timedelta(hours=24)),
+                        latest_idx - 1)
+        latest = series.counts_at(latest_idx)
+        prior = series.counts_at(prior_idx)
+        latest_time = series.time_at(latest_idx)
+        prior_time = series.time_at(prior_idx)
+    else:
+        # no stored series yet, fall back to item_counts_by_type results
+        latest_check = counts_check.get_primary_result()
+        # get_item_counts run closest to 24 hours ago
+        prior_check = counts_check.get_closest_result(diff_hours=24)
+        if not latest_check.get('full_output') or not prior_check.get('full_output'):
+            check.status = 'ERROR'
+            check.description = 'There are no counts_check results to run this check with.'
+            return check
+        # drill into full_output
+        latest = latest_check['full_output']
+        prior = prior_check['full_output']
+        latest_time = datetime.datetime.strptime(latest_check['uuid'], "%Y-%m-%dT%H:%M:%S.%f")
+        prior_time = datetime.datetime.strptime(prior_check['uuid'], "%Y-%m-%dT%H:%M:%S.%f")
     diff_counts = {}
-    # drill into full_output
-    latest = latest_check['full_output']
-    prior = prior_check['full_output']
     # get any keys that are in prior but not latest
     prior_unique = list(set(prior.keys()) - set(latest.keys()))
     for index in latest:
@@ -202,16 +338,17 @@ def change_in_item_counts(connection, **kwargs):
     # now do a metadata search to make sure they match
     # date_created endpoints for the FF search
     # XXX: We should revisit if we really think this search is necessary. - will 3-26-2020
-    to_date = datetime.datetime.strptime(latest_check['uuid'], "%Y-%m-%dT%H:%M:%S.%f").strftime('%Y-%m-%d+%H:%M')
-    from_date = datetime.datetime.strptime(prior_check['uuid'], "%Y-%m-%dT%H:%M:%S.%f").strftime('%Y-%m-%d+%H:%M')
+    to_date = latest_time.strftime('%Y-%m-%d+%H:%M')
+    from_date = prior_time.strftime('%Y-%m-%d+%H:%M')
     # tracking items and ontology terms must be explicitly searched for
+    # only the item type is needed from each hit
     search_query = ''.join(['search/?type=Item&type=TrackingItem',
-                            '&frame=object&date_created.from=',
+                            '&date_created.from=',
                             from_date, '&date_created.to=', to_date])
-    search_resp = ff_utils.search_metadata(search_query, key=connection.ff_keys)
+    search_resp = search_with_fields(search_query, ['@type'], connection.ff_keys)
     # add deleted/replaced items
     search_query += '&status=deleted&status=replaced'
-    search_resp.extend(ff_utils.search_metadata(search_query, key=connection.ff_keys))
+    search_resp.extend(search_with_fields(search_query, ['@type'], connection.ff_keys))
     for res in search_resp:
 
         # Stick with given type name in CamelCase since this is now what we get on the counts page
@@ -315,24 +452,22 @@ def identify_files_without_filesize(connection, **kwargs):
 
 @action_function()
 def patch_file_size(connection, **kwargs):
+    start = datetime.datetime.utcnow()
     action = ActionResult(connection, 'patch_file_size')
-    action_logs = {'s3_file_not_found': [], 'patch_failure': [], 'patch_success': []}
+    action_logs = {'s3_file_not_found': []}
     # get the associated identify_files_without_filesize run result
     filesize_check_result = action.get_associated_check_result(kwargs)
+    patches = {}
     for hit in filesize_check_result.get('full_output', []):
         bucket = connection.ff_s3.outfile_bucket if 'FileProcessed' in hit['@type'] else connection.ff_s3.raw_file_bucket
         head_info = connection.ff_s3.does_key_exist(hit['upload_key'], bucket)
         if not head_info:
             action_logs['s3_file_not_found'].append(hit['accession'])
         else:
-            patch_data = {'file_size': head_info['ContentLength']}
-            try:
-                ff_utils.patch_metadata(patch_data, obj_id=hit['uuid'], key=connection.ff_keys)
-            except Exception as e:
-                acc_and_error = '\n'.join([hit['accession'], str(e)])
-                action_logs['patch_failure'].append(acc_and_error)
-            else:
-                action_logs['patch_success'].append(hit['accession'])
+            patches[hit['accession']] = {'file_size': head_info['ContentLength']}
+    report = bulk_patch_metadata(patches, connection.ff_keys, start=start, time_limit=LAMBDA_LIMIT,
+                                 already_patched=get_patched_in_prior_run(action, kwargs))
+    action_logs.update(report.to_dict())
     action.status = 'DONE'
     action.output = action_logs
     return action
@@ -865,9 +1000,8 @@ def check_opf_lab_different_than_experiment(connection, **kwargs):
     search = ('search/?type=FileProcessed' +
               '&track_and_facet_info.experiment_bucket%21=No+value' +
               '&track_and_facet_info.experiment_bucket%21=processed+file' +
-              '&field=experiment_sets&field=experiments' +
-              '&field=lab&field=contributing_labs' + from_date_query)
-    result = ff_utils.search_metadata(search, key=connection.ff_keys)
+              from_date_query)
+    result = search_with_fields(search, OPF_LAB_FIELDS, connection.ff_keys)
 
     opf = {'to_patch': [], 'problematic': []}
     exp_set_uuids = []  # Exp or ExpSet uuid list
@@ -1005,23 +1139,18 @@ def grouped_with_file_relation_consistency(connection, **kwargs):
 
 @action_function()
 def add_grouped_with_file_relation(connection, **kwargs):
+    start = datetime.datetime.utcnow()
     action = ActionResult(connection, 'add_grouped_with_file_relation')
     check_res = action.get_associated_check_result(kwargs)
     files_to_patch = check_res['full_output']
-    action_logs = {'patch_success': [], 'patch_failure': []}
-    for a_file, related_list in files_to_patch.items():
-        patch_body = {"related_files": related_list}
-        try:
-            ff_utils.patch_metadata(patch_body, a_file, key=connection.ff_keys)
-        except Exception as e:
-            action_logs['patch_failure'].append({a_file: str(e)})
-        else:
-            action_logs['patch_success'].append(a_file)
-    if action_logs['patch_failure']:
+    patches = {a_file: {"related_files": related_list} for a_file, related_list in files_to_patch.items()}
+    report = bulk_patch_metadata(patches, connection.ff_keys, start=start, time_limit=LAMBDA_LIMIT,
+                                 already_patched=get_patched_in_prior_run(action, kwargs))
+    if report.error or report.not_attempted:
         action.status = 'FAIL'
     else:
         action.status = 'DONE'
-    action.output = action_logs
+    action.output = report.to_dict()
     return action
 
 
@@ -1078,6 +1207,7 @@ def share_core_project(connection, **kwargs):
     Patches the status of the output of core_project_status above.
     """
 
+    start = datetime.datetime.utcnow()
     action = ActionResult(connection, 'share_core_project')
     check_response = action.get_associated_check_result(kwargs)
     check_full_output = check_response['full_output']
@@ -1087,20 +1217,14 @@ def share_core_project(connection, **kwargs):
     # Concatenate list of lists from full_output to single list of uuids
     uuids_to_patch = [item for sublist in check_full_output.values()
                       for item in sublist]
-    action_logs = {'patch_success': [], 'patch_failure': []}
-    for uuid in uuids_to_patch:
-        patch_body = {'status': 'shared'}
-        try:
-            ff_utils.patch_metadata(patch_body, uuid, key=connection.ff_keys)
-        except Exception as patch_error:
-            action_logs['patch_failure'].append({uuid: str(patch_error)})
-        else:
-            action_logs['patch_success'].append(uuid)
-    if action_logs['patch_failure']:
+    patches = {uuid: {'status': 'shared'} for uuid in uuids_to_patch}
+    report = bulk_patch_metadata(patches, connection.ff_keys, start=start, time_limit=LAMBDA_LIMIT,
+                                 already_patched=get_patched_in_prior_run(action, kwargs))
+    if report.error or report.not_attempted:
         action.status = 'FAIL'
     else:
         action.status = 'DONE'
-    action.output = action_logs
+    action.output = report.to_dict()
     return action
 
 
@@ -1266,10 +1390,18 @@ def get_metadata_for_cases_to_clone(connection, **kwargs):
         check.description = check.summary
         check.status = 'ERROR'
         return check
-    meta_workflow_dict = {mwf['name']: mwf for mwf in meta_workflows}
+    # name --> uuid, for direct lookup of each case's meta-workflow
+    meta_workflow_uuids = {mwf['name']: mwf['uuid'] for mwf in meta_workflows}
+    # all cases resolved with a few field-projected searches
+    cases_metadata = clone_utils.search_by_identifiers(
+        'Case', accessions, clone_utils.CASE_TO_CLONE_FIELDS, connection.ff_keys
+    )
     output = {'run': {}, 'ignore': {}}
     for case in accessions:
-        case_metadata = ff_utils.get_metadata(case, key=connection.ff_keys)
+        case_metadata = cases_metadata.get(case)
+        if case_metadata is None:
+            output['ignore'][case] = 'Case not found.'
+            continue
         if case_metadata.get('superseded_by'):
             output['ignore'][case] = 'This case has already been cloned.'
             continue
@@ -1281,22 +1413,19 @@ def get_metadata_for_cases_to_clone(connection, **kwargs):
         if current_mwfr_version and current_mwfr_version.upper() == version.upper():
             output['ignore'][case] = 'The case has already been run with this pipeline version.'
             continue
-        updated_mwf = False
-        for k, v in meta_workflow_dict.items():
-            # TODO: this is a bit hacky right now, should change the mwf metadata to have title separate from version,
-            # and a calcprop that combines title and version
-            if k == mwfr.get('meta_workflow', {}).get('name'):
-                # value is a dict so that we can add more metadata in future iterations
-                output['run'][case] = {
-                    'metawf_uuid': v['uuid'],
-                    'create_SNV_mwfr': create_SNV_mwfr,
-                    'keep_SV_mwfr': keep_SV_mwfr
-                }
-                updated_mwf = True
-                break
-        if not updated_mwf:
+        # TODO: this is a bit hacky right now, should change the mwf metadata to have title separate from version,
+        # and a calcprop that combines title and version
+        metawf_uuid = meta_workflow_uuids.get(mwfr.get('meta_workflow', {}).get('name'))
+        if metawf_uuid is None:
             output['ignore'][case] = f"{version} pipeline not found for this case's meta-workflow."
             continue
+        # value is a dict so that we can add more metadata in future iterations
+        output['run'][case] = {
+            'sample_processing': (case_metadata.get('sample_processing') or {}).get('uuid'),
+            'metawf_uuid': metawf_uuid,
+            'create_SNV_mwfr': create_SNV_mwfr,
+            'keep_SV_mwfr': keep_SV_mwfr
+        }
 
     check.full_output = output
     check.status = 'PASS'
@@ -1306,23 +1435,63 @@ def get_metadata_for_cases_to_clone(connection, **kwargs):
     return check
 
 
-@action_function()
+@action_function(rollback=True, case_workers=CLONE_CASE_WORKERS)
 def clone_cases(connection, **kwargs):
     """
+    Clone the cases found by the check, several at a time. Cases of the
+    same sample processing share its samples and individuals, so they are
+    cloned one after another, and a case already cloned with another of
+    them is skipped. A failed clone is rolled back; with rollback=False it
+    is left as is and its journal kept in the output, so the next run of
+    this action for the same check result resumes it.
     """
     action = ActionResult(connection, 'clone_cases')
     check_response = action.get_associated_check_result(kwargs)
-    clone_dict = {}
+    rollback = kwargs.get('rollback', True)
+    # cases cloned by an earlier run for the same check result are kept
+    clone_dict, prior_journals = clone_utils.get_prior_clone_run(action, kwargs)
     errors = {}
+    journals = {}
+
+    def clone_group(group):
+        """Clone the cases of one sample processing serially. Returns a
+        list of (case, new case dict or exception) pairs.
+        """
+        cloned = {}
+        results = []
+        for case, data in group:
+            if case in cloned:
+                continue
+            if any(isinstance(result, Exception) for _, result in results):
+                results.append((case, Exception('Not cloned: a case of the same sample processing failed')))
+                continue
+            try:
+                new_case = clone_utils.CaseToClone(case, connection.ff_keys, data['metawf_uuid'],
+                                                   check_response['kwargs']['version'], [],
+                                                   journal=prior_journals.get(case), rollback=rollback)
+            except Exception as e:
+                results.append((case, e))
+            else:
+                cloned.update(new_case.new_case_dict)
+                results.append((case, new_case.new_case_dict))
+        return results
+
+    # group by sample processing; cases from older check results without it are their own group
+    groups = {}
     for case, data in check_response['full_output']['run'].items():
-        try:
-            new_case = clone_utils.CaseToClone(case, connection.ff_keys, data['metawf_uuid'],
-                                               check_response['kwargs']['version'], [])
-        except Exception as e:
-            errors[case] = str(e)
-        else:
-            clone_dict.update(new_case.new_case_dict)
-    action.output = {'clone success': clone_dict, 'clone fail': errors}
+        if case not in clone_dict:
+            groups.setdefault(data.get('sample_processing') or case, []).append((case, data))
+    workers = max(1, min(len(groups), int(kwargs.get('case_workers') or CLONE_CASE_WORKERS)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(clone_group, groups.values()):
+            for case, result in results:
+                if isinstance(result, Exception):
+                    errors[case] = str(result)
+                    if isinstance(result, clone_utils.CloneError) and result.journal:
+                        journals[case] = result.journal
+                else:
+                    clone_dict.update(result)
+    action.output = {'clone success': clone_dict, 'clone fail': errors, 'clone journal': journals}
     if errors:
         action.status = 'FAIL'
     else:
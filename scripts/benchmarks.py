@@ -0,0 +1,205 @@
+"""Benchmarks for foursight-cgap check helpers.
+
+Run from the root directory of this repository, e.g.
+
+    python scripts/benchmarks.py projection --env cgap --limit 100
+    python scripts/benchmarks.py workflow_index --workflows 2000
+    python scripts/benchmarks.py need_runs --sample-processings 5000
+
+Benchmarks that talk to a portal use the access keys for the given env.
+"""
+import argparse
+import sys
+import time
+import timeit
+sys.path.append('.')
+from dcicutils import ff_utils
+
+from chalicelib_cgap.checks.audit_checks import PAIRED_END_FIELDS, PAGE_CHILDREN_FIELDS
+from chalicelib_cgap.checks.helpers.utils import add_field_projection
+from chalicelib_cgap.checks.helpers.wfr_utils import (
+    check_latest_workflow_version, order_input_dictionary, remove_duplicate_need_runs, workflow_details, workflow_index
+)
+from chalicelib_cgap.checks.helpers.wfrset_utils import wf_dict
+from chalicelib_cgap.checks.wfr_checks import MD5_STATUS_FIELDS
+from chalicelib_cgap.checks.wrangler_checks import DELETED_INPUT_WFR_FIELDS, OPF_LAB_FIELDS
+
+
+# check name --> (search made by the check, fields the check declares)
+PROJECTED_SEARCHES = {
+    'workflow_run_has_deleted_input_file': (
+        'search/?type=WorkflowRun&status!=deleted&input_files.value.status=deleted',
+        DELETED_INPUT_WFR_FIELDS,
+    ),
+    'md5runCGAP_status': (
+        'search/?status=uploading&status=upload failed&type=File',
+        MD5_STATUS_FIELDS,
+    ),
+    'check_opf_lab_different_than_experiment': (
+        'search/?type=FileProcessed&track_and_facet_info.experiment_bucket%21=No+value'
+        '&track_and_facet_info.experiment_bucket%21=processed+file',
+        OPF_LAB_FIELDS,
+    ),
+    'page_children_routes': (
+        'search/?type=Page&children.name%21=No+value',
+        PAGE_CHILDREN_FIELDS,
+    ),
+    'paired_end_info_consistent': (
+        'search/?type=FileFastq&file_format.file_format=fastq'
+        '&related_files.relationship_type=paired+with&paired_end=No+value',
+        PAIRED_END_FIELDS,
+    ),
+}
+
+
+def timed_search_bytes(query, auth, limit):
+    """GET a single page of search results, returning the response size
+    in bytes and the time taken in seconds.
+    """
+    url = auth['server'].rstrip('/') + '/' + query + '&limit=%s&format=json' % limit
+    start = time.time()
+    response = ff_utils.authorized_request(url, auth=auth)
+    return len(response.content), time.time() - start
+
+
+def benchmark_projection(args):
+    """Compare payload size of full and field-projected searches for
+    each check that declares its fields.
+    """
+    auth = ff_utils.get_authentication_with_server(ff_env=args.env)
+    print('%-42s %12s %12s %8s %8s %8s' % ('check', 'full (B)', 'fields (B)', 'saved', 'full s', 'fields s'))
+    for check_name, (query, fields) in PROJECTED_SEARCHES.items():
+        full_bytes, full_seconds = timed_search_bytes(query, auth, args.limit)
+        projected_query = add_field_projection(query, fields)
+        projected_bytes, projected_seconds = timed_search_bytes(projected_query, auth, args.limit)
+        saved = 1 - projected_bytes / full_bytes if full_bytes else 0
+        print('%-42s %12d %12d %7.1f%% %8.2f %8.2f' % (
+            check_name, full_bytes, projected_bytes, saved * 100, full_seconds, projected_seconds
+        ))
+
+
+def list_check_latest_workflow_version(workflows):
+    """Workflow lookups of check_latest_workflow_version as list scans, as
+    before the compiled workflow index, for comparison.
+    """
+    for a_wf in workflows:
+        wf_name = a_wf['app_name']
+        if wf_name not in workflow_details:
+            continue
+        if wf_name not in [i['app_name'] for i in wf_dict]:
+            continue
+        last_version = workflow_details[wf_name]['accepted_versions'][-1]
+        same_wf_name_workflows = [i for i in workflows if i['app_name'] == wf_name]
+        all_wf_versions = [i.get('app_version', '') for i in same_wf_name_workflows]
+        if last_version in all_wf_versions:
+            [i['uuid'] for i in same_wf_name_workflows if i['app_version'] == last_version]
+            [i['workflow_uuid'] for i in wf_dict if i['app_name'] == wf_name]
+
+
+def benchmark_workflow_index(args):
+    """Compare list scans with the compiled workflow index for version
+    filtering (as in get_wfr_out) and check_latest_workflow_version.
+    """
+    app_names = list(workflow_details)
+    workflows = [
+        {'app_name': app_names[idx % len(app_names)], 'app_version': 'v%s' % (idx % 25), 'uuid': str(idx)}
+        for idx in range(args.workflows)
+    ]
+    wfrs = [{'run_version': wf['app_version'], 'run_type': wf['app_name']} for wf in workflows]
+
+    def list_filter():
+        for wfr in wfrs:
+            wfr['run_version'] in workflow_details[wfr['run_type']]['accepted_versions']
+
+    def index_filter():
+        for wfr in wfrs:
+            wfr['run_version'] in workflow_index[wfr['run_type']].versions
+
+    print('%-36s %12s %12s %8s' % ('operation', 'lists (ms)', 'index (ms)', 'speedup'))
+    for name, baseline, indexed in [
+        ('version filter', list_filter, index_filter),
+        ('check_latest_workflow_version', lambda: list_check_latest_workflow_version(workflows),
+         lambda: check_latest_workflow_version(workflows)),
+    ]:
+        baseline_ms = min(timeit.repeat(baseline, number=args.number, repeat=3)) / args.number * 1000
+        indexed_ms = min(timeit.repeat(indexed, number=args.number, repeat=3)) / args.number * 1000
+        print('%-36s %12.3f %12.3f %7.1fx' % (name, baseline_ms, indexed_ms, baseline_ms / indexed_ms))
+
+
+def list_remove_duplicate_need_runs(need_runs_dictionary):
+    """remove_duplicate_need_runs comparing each run with a list of the
+    runs kept, as before keying runs by signature, for comparison.
+    """
+    sorted_runs = []
+    unique_needs_runs_dictionary = []
+    for an_item in need_runs_dictionary:
+        for an_sp_id in an_item:
+            keep_runs = []
+            for a_run in an_item[an_sp_id]:
+                run_info = str(a_run[1]) + str(order_input_dictionary(a_run[2]))
+                if run_info not in sorted_runs:
+                    keep_runs.append(a_run)
+                    sorted_runs.append(run_info)
+            if keep_runs:
+                unique_needs_runs_dictionary.append({an_sp_id: keep_runs})
+    return unique_needs_runs_dictionary
+
+
+def benchmark_need_runs(args):
+    """Compare list and signature based remove_duplicate_need_runs on
+    synthetic sample_processing items. Each family of four is in two items
+    (one per proband), so only the tagged runs of the second are kept.
+    """
+    need_runs = []
+    for idx in range(args.sample_processings):
+        family = idx // 2
+        samples = ['/files-processed/GAPFI%05dS%s/' % (family, sample) for sample in range(4)]
+        runs = [
+            ['step1_%s' % sample.split('/')[2], ['workflow_gatk-HaplotypeCaller', 'human', {}],
+             {'input_bam': sample}, sample.split('/')[2]]
+            for sample in samples
+        ]
+        runs.append(['step2', ['workflow_gatk-CombineGVCFs', 'human', {}],
+                     {'input_gvcfs': samples[::-1], 'reference': '/files-reference/GAPFIXRDPDK5/'},
+                     '_'.join(sample.split('/')[2] for sample in samples)])
+        runs.append(['step3', ['workflow_granite-mpileupCounts', 'human', {'wfr_meta': {'tags': ['sp%s' % idx]}}],
+                     {'input_bams': samples}, 'sp%s' % idx])
+        need_runs.append({'/sample-processings/GAPSP%05d/' % idx: runs})
+    assert list_remove_duplicate_need_runs(need_runs) == remove_duplicate_need_runs(need_runs)
+    total_runs = sum(len(runs) for an_item in need_runs for runs in an_item.values())
+    baseline_ms = min(timeit.repeat(lambda: list_remove_duplicate_need_runs(need_runs),
+                                    number=args.number, repeat=3)) / args.number * 1000
+    keyed_ms = min(timeit.repeat(lambda: remove_duplicate_need_runs(need_runs),
+                                 number=args.number, repeat=3)) / args.number * 1000
+    print('%-24s %12s %12s %12s %8s' % ('sample_processings', 'runs', 'list (ms)', 'keyed (ms)', 'speedup'))
+    print('%-24d %12d %12.1f %12.1f %7.1fx' % (
+        args.sample_processings, total_runs, baseline_ms, keyed_ms, baseline_ms / keyed_ms
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    projection = subparsers.add_parser('projection', help='Payload reduction from field-projected searches')
+    projection.add_argument('--env', default='cgap', help='Environment to search')
+    projection.add_argument('--limit', type=int, default=100, help='Search hits to fetch per query')
+    projection.set_defaults(func=benchmark_projection)
+
+    index = subparsers.add_parser('workflow_index', help='Workflow version lookups, lists vs compiled index')
+    index.add_argument('--workflows', type=int, default=2000, help='Number of synthetic workflows')
+    index.add_argument('--number', type=int, default=10, help='Runs per timing')
+    index.set_defaults(func=benchmark_workflow_index)
+
+    need_runs = subparsers.add_parser('need_runs', help='Duplicate run removal, list scans vs run signatures')
+    need_runs.add_argument('--sample-processings', type=int, default=5000,
+                           help='Number of synthetic sample_processing items')
+    need_runs.add_argument('--number', type=int, default=1, help='Runs per timing')
+    need_runs.set_defaults(func=benchmark_need_runs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
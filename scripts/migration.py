@@ -1,11 +1,14 @@
 import sys
 import datetime
 import boto3
-import json
+import re
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append('..')
 import app
 from foursight_core.es_connection import ESConnection
 from chalicelib_cgap.vars import FOURSIGHT_PREFIX
+from chalicelib_cgap.checks.helpers.check_store_utils import is_primary_result
 
 # TODO
 # Not yet sure what to do about this refereneces to 'app' here.
@@ -21,6 +24,7 @@ from chalicelib_cgap.vars import FOURSIGHT_PREFIX
 # directory of this repository.
 # Set MIGRATE to false to trigger an s3 clean
 # Set PRIMARY to true to keep primary results while doing a clean
+# Pass --dry-run to report what a clean would delete without deleting
 # You can also do - 'python migration.py' whe MIGRATE is true to automatically
 # migrate all checks from all environments into the appropriate ES index
 # This script reall just refactors the functionality in RunResult.delete_results
@@ -32,48 +36,80 @@ ONE_WEEK_AGO = datetime.datetime.utcnow() - datetime.timedelta(days=7)
 MIGRATE = False # set this option based on what you want to do
 PRIMARY = False # set to true if you want to keep primary results
 
-def filename_to_datetime(key):
-    try:
-        name, tstamp = key.split('/')
-        time, sec, _ = tstamp.split('.')
-        return datetime.datetime.strptime('.'.join([time, sec]), '%Y-%m-%dT%H:%M:%S.%f')
-    except:
-        return None
-
-def filt(k):
-    t = filename_to_datetime(k)
-    if t is None:
-        return False
-    else:
-        return t < ONE_WEEK_AGO
+WORKERS = 16  # concurrent reads when checking for primary results
+DELETE_BATCH_SIZE = 1000  # max keys per delete_objects call
+TIMESTAMPED_KEY = re.compile(r'^[^/]+/(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d+)\.json$')
+
+
+def is_old_result(key, cutoff=ONE_WEEK_AGO.isoformat()):
+    """ True for timestamped result keys before cutoff, comparing the key's
+        isoformat timestamp as a string instead of parsing it """
+    match = TIMESTAMPED_KEY.match(key)
+    return match is not None and match.group(1) < cutoff
 
-def clean(env, stage):
+
+def clean(env, stage, dry_run=False, keep_primary=PRIMARY, cutoff=ONE_WEEK_AGO, workers=WORKERS):
+    """ Delete results older than cutoff, streaming: keys are listed a page
+        at a time and filtered by their timestamp, primary results are
+        checked concurrently, and deletes are sent in batches as candidates
+        arrive. With dry_run only a report is printed """
     bucket_name = FOURSIGHT_PREFIX + '-' + stage + '-' + env
-    bucket = boto3.resource('s3').Bucket(bucket_name)
     client = boto3.client('s3')
-    keys = []
-    for obj in bucket.objects.all():
-        keys.append(obj.key)
-
-    keys_to_delete = list(filter(filt, keys))
-
-    # filter on primary
-    def is_not_primary(key):
-        try:
-            obj = json.loads(client.get_object(Bucket=bucket_name, Key=key)['Body'].read())
-            return not obj['kwargs'].get('primary')
-        except:
-            return False
-
-    # if primary is set to true in file then we keep them
-    if PRIMARY:
-        keys_to_delete = list(filter(is_not_primary, keys_to_delete))
-
-    print("Total keys: %s" % len(keys))
-    print("Keys to delete: %s" % len(keys_to_delete))
-    for i in range(0, len(keys_to_delete), 1000):
-        fmt = {'Objects': [{'Key': key} for key in keys_to_delete[i:i+1000]]}
-        client.delete_objects(Bucket=bucket_name, Delete=fmt)
+    cutoff = cutoff.isoformat()
+    report = {'listed': 0, 'candidates': 0, 'kept_primary': 0, 'deleted': 0, 'bytes': 0,
+              'failed': 0, 'by_check': {}}
+    to_delete = []
+
+    def flush():
+        if not dry_run:
+            fmt = {'Objects': [{'Key': obj['Key']} for obj in to_delete], 'Quiet': True}
+            errors = client.delete_objects(Bucket=bucket_name, Delete=fmt).get('Errors', [])
+            report['failed'] += len(errors)
+            failed = {error['Key'] for error in errors}
+        else:
+            failed = set()
+        for obj in to_delete:
+            if obj['Key'] in failed:
+                continue
+            report['deleted'] += 1
+            report['bytes'] += obj['Size']
+            name = obj['Key'].split('/', 1)[0]
+            report['by_check'][name] = report['by_check'].get(name, 0) + 1
+        del to_delete[:]
+
+    paginator = client.get_paginator('list_objects_v2')
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for page in paginator.paginate(Bucket=bucket_name):
+            objects = page.get('Contents', [])
+            report['listed'] += len(objects)
+            candidates = [obj for obj in objects if is_old_result(obj['Key'], cutoff)]
+            report['candidates'] += len(candidates)
+            # if primary is set to true in file then we keep them
+            if keep_primary:
+                primary = executor.map(lambda obj: is_primary_result(client, bucket_name, obj['Key']), candidates)
+                kept = [obj for obj, is_prim in zip(candidates, primary) if not is_prim]
+                report['kept_primary'] += len(candidates) - len(kept)
+                candidates = kept
+            for obj in candidates:
+                to_delete.append(obj)
+                if len(to_delete) == DELETE_BATCH_SIZE:
+                    flush()
+        if to_delete:
+            flush()
+
+    print("%s clean of %s, results before %s" % ('Dry run' if dry_run else 'Done', bucket_name, cutoff))
+    print("Total keys: %s" % report['listed'])
+    print("Keys before cutoff: %s" % report['candidates'])
+    if keep_primary:
+        print("Primary results kept: %s" % report['kept_primary'])
+    print("Keys %s: %s (%.1f MB)" % ('to delete' if dry_run else 'deleted', report['deleted'],
+                                     report['bytes'] / (1024 * 1024)))
+    if report['failed']:
+        print("Keys failed to delete: %s" % report['failed'])
+    for name, count in sorted(report['by_check'].items(), key=lambda item: -item[1]):
+        print("    %-60s %s" % (name, count))
+    return report
+
 
 def migrate(env, stage):
     index_name = FOURSIGHT_PREFIX + '-' + stage + '-' + env
@@ -89,16 +125,28 @@ def migrate(env, stage):
     print(diff)
 
 def main():
+    parser = argparse.ArgumentParser(description='Migrate checks to ES, or clean old checks from s3')
+    parser.add_argument('env', nargs='?', help='Environment, e.g. cgap')
+    parser.add_argument('stage', nargs='?', help='Stage, dev or prod')
+    parser.add_argument('--dry-run', action='store_true', help='Report what a clean would delete')
+    parser.add_argument('--keep-primary', action='store_true', default=PRIMARY, help='Keep primary results')
+    parser.add_argument('--days', type=int, default=7, help='Clean results older than this many days')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Concurrent primary result reads')
+    args = parser.parse_args()
     if MIGRATE:
-        if len(sys.argv) < 3:
+        if not args.stage:
             for env in ENVS:
                 for stage in STAGES:
                     migrate(env, stage)
         else:
-            migrate(sys.argv[1], sys.argv[2])
+            migrate(args.env, args.stage)
         exit(0)
     else:
-        clean(sys.argv[1], sys.argv[2])
+        if not args.stage:
+            parser.error('env and stage are required for a clean')
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=args.days)
+        clean(args.env, args.stage, dry_run=args.dry_run, keep_primary=args.keep_primary,
+              cutoff=cutoff, workers=args.workers)
 
 if __name__ == '__main__':
     main()
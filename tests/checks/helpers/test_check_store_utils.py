@@ -0,0 +1,317 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import boto3
+from moto import mock_aws
+
+from chalicelib_cgap.checks.helpers import check_store_utils
+from chalicelib_cgap.checks.helpers.check_store_utils import (
+    CheckStoreMigrator,
+    is_result_key,
+    iter_s3_key_pages,
+    list_check_names,
+    reconcile_check,
+    load_reconciliation_index,
+    load_resume_markers,
+    load_sweep_progress,
+    reconcile_s3_es,
+    save_reconciliation_index,
+    save_resume_marker,
+    sweep_checks,
+)
+
+
+class FakeS3:
+    """The parts of foursight_core S3Connection the helpers use."""
+
+    def __init__(self, bucket='test-foursight-checks'):
+        self.bucket = bucket
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket=bucket)
+
+    def put_object(self, key, value):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=value)
+
+    def get_object(self, key):
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError:
+            return body
+
+
+class FakeBulkClient:
+
+    def __init__(self, fail_ids=()):
+        self.docs = {}
+        self.requests = 0
+        self.fail_ids = set(fail_ids)
+
+    def bulk(self, body, index):
+        self.requests += 1
+        lines = body.strip('\n').split('\n')
+        items = []
+        for action, source in zip(lines[::2], lines[1::2]):
+            _id = json.loads(action)['index']['_id']
+            if _id in self.fail_ids:
+                items.append({'index': {'_id': _id, 'status': 400, 'error': 'mapper_parsing_exception'}})
+            else:
+                self.docs[_id] = json.loads(source)
+                items.append({'index': {'_id': _id, 'status': 201}})
+        return {'errors': bool(self.fail_ids), 'items': items}
+
+
+class FakeES:
+
+    def __init__(self, fail_ids=()):
+        self.index = 'test-foursight-checks'
+        self.es = FakeBulkClient(fail_ids)
+
+
+def put_results(s3, name, count):
+    keys = []
+    for idx in range(count):
+        key = '%s/2024-01-01T00:00:%02d.000000.json' % (name, idx)
+        s3.put_object(key, json.dumps({'name': name, 'uuid': key[len(name) + 1: -5], 'id_alias': key}))
+        keys.append(key)
+    s3.put_object('%s/latest.json' % name, json.dumps({'name': name}))
+    return keys + ['%s/latest.json' % name]
+
+
+class TestCheckStoreMigrator:
+
+    def test_is_result_key(self):
+        assert is_result_key('some_check/2024-01-01T00:00:00.123456.json')
+        assert is_result_key('some_check/latest.json')
+        assert is_result_key('some_check/primary.json')
+        assert not is_result_key('action_records/2024-01-01T00:00:00.123456.json')
+        assert not is_result_key('item_counts_by_type/series.json')
+        assert not is_result_key('migrate_checks_to_es/resume_marker.json')
+
+    @mock_aws
+    def test_migrate_all_in_batches(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 7) + put_results(s3, 'check_b', 5)
+        s3.put_object('item_counts_by_type/series.json', '{}')
+        es = FakeES(fail_ids=['check_b/latest.json'])
+        migrator = CheckStoreMigrator(s3, es, workers=4, max_bulk_docs=3).run(time_limit=60)
+        stats = migrator.stats()
+        assert set(es.es.docs) == set(keys) - {'check_b/latest.json'}
+        assert stats['n_migrated'] == len(keys) - 1
+        assert stats['n_failed'] == 1
+        assert stats['failures'][0]['key'] == 'check_b/latest.json'
+        assert stats['n_skipped'] == 1
+        assert stats['bulk_requests'] == 5
+        assert stats['complete'] is True
+
+    @mock_aws
+    def test_resume_after_marker(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 6)
+        save_resume_marker(s3, 'check_a/', keys[2])
+        assert load_resume_markers(s3) == {'check_a/': keys[2]}
+        es = FakeES()
+        migrator = CheckStoreMigrator(s3, es).run(prefix='check_a/', start_after=keys[2], time_limit=60)
+        assert sorted(es.es.docs) == sorted(keys[3:])
+        assert migrator.last_key == keys[-1]
+        save_resume_marker(s3, 'check_a/', None)
+        assert load_resume_markers(s3) == {}
+
+    @mock_aws
+    def test_out_of_time_keeps_marker(self):
+        s3 = FakeS3()
+        put_results(s3, 'check_a', 3)
+        es = FakeES()
+        migrator = CheckStoreMigrator(s3, es).run(time_limit=0)
+        assert es.es.docs == {}
+        assert migrator.complete is False
+        assert migrator.last_key is None
+        assert migrator.exit_reason == 'out of time'
+
+
+class FakeMgetClient(FakeBulkClient):
+
+    def mget(self, body, index, _source=True):
+        return {'docs': [{'_id': _id, 'found': _id in self.docs} for _id in body['ids']]}
+
+
+class TestReconciliation:
+
+    @mock_aws
+    def test_incremental_reconcile(self):
+        s3 = FakeS3()
+        a_keys = put_results(s3, 'check_a', 4)[:-1]
+        b_keys = put_results(s3, 'check_b', 3)[:-1]
+        s3.put_object('action_records/2024-01-01T00:00:00.000000.json', '{}')
+        es = FakeES()
+        es.es = FakeMgetClient()
+        es.es.docs = {key: {} for key in a_keys[:2] + b_keys}
+        assert list_check_names(s3) == ['check_a', 'check_b']
+
+        index, names, reconciled, n_new = reconcile_s3_es(s3, es, workers=2)
+        assert names == ['check_a', 'check_b']
+        assert reconciled == ['check_a', 'check_b']
+        assert n_new == 7
+        assert index['check_a']['missing'] == a_keys[2:]
+        assert index['check_a']['last_s3_key'] == a_keys[-1]
+        assert index['check_a']['es_max_timestamp'] == '2024-01-01T00:00:01.000000'
+        assert index['check_b']['missing'] == []
+
+        # only new keys and previous misses are looked up next time
+        es.es.docs[a_keys[2]] = {}
+        new_key = 'check_b/2024-01-02T00:00:00.000000.json'
+        s3.put_object(new_key, '{}')
+        save_reconciliation_index(s3, index)
+        index, _, reconciled, n_new = reconcile_s3_es(s3, es, index=load_reconciliation_index(s3))
+        assert n_new == 1
+        assert index['check_a']['missing'] == a_keys[3:]
+        assert index['check_a']['es_max_timestamp'] == '2024-01-01T00:00:01.000000'
+        assert index['check_b']['missing'] == [new_key]
+        assert index['check_b']['last_s3_key'] == new_key
+
+    @mock_aws
+    def test_out_of_time_lists_checks(self):
+        s3 = FakeS3()
+        put_results(s3, 'check_a', 2)
+        es = FakeES()
+        es.es = FakeMgetClient()
+        index, names, reconciled, n_new = reconcile_s3_es(s3, es, time_limit=0)
+        # a check new to the index is listed though not reached
+        assert (index, names, reconciled, n_new) == ({}, ['check_a'], [], 0)
+
+    @mock_aws
+    def test_reconcile_stops_between_pages(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 6)[:-1]
+        es = FakeES()
+        es.es = FakeMgetClient()
+        es.es.docs = {keys[0]: {}}
+        clock = SimpleNamespace(now=0)
+        list_pages = iter_s3_key_pages
+
+        def pages_of_two(s3, prefix='', start_after=None):
+            # each page takes 10 seconds
+            for page in list_pages(s3, prefix=prefix, start_after=start_after):
+                for start in range(0, len(page), 2):
+                    yield page[start: start + 2]
+                    clock.now += 10
+
+        with patch.object(check_store_utils, 'iter_s3_key_pages', pages_of_two), \
+                patch.object(check_store_utils, 'time', SimpleNamespace(time=lambda: clock.now)):
+            entry, n_new, complete = reconcile_check(s3, es, 'check_a', None, deadline=15)
+            assert (n_new, complete) == (4, False)
+            assert entry['last_s3_key'] == keys[3]
+            assert entry['missing'] == keys[1:4]
+            # next run resumes after the last page looked up
+            entry, n_new, complete = reconcile_check(s3, es, 'check_a', entry, deadline=clock.now + 100)
+        assert (n_new, complete) == (2, True)
+        assert entry['last_s3_key'] == keys[-1]
+        assert entry['missing'] == keys[1:]
+
+    @mock_aws
+    def test_reconcile_caps_missing(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 6)[:-1]
+        es = FakeES()
+        es.es = FakeMgetClient()
+
+        def pages_of_two(s3, prefix='', start_after=None):
+            for page in iter_s3_key_pages(s3, prefix=prefix, start_after=start_after):
+                for start in range(0, len(page), 2):
+                    yield page[start: start + 2]
+
+        with patch.object(check_store_utils, 'iter_s3_key_pages', pages_of_two), \
+                patch.object(check_store_utils, 'MAX_TRACKED_MISSING', 2):
+            entry, n_new, complete = reconcile_check(s3, es, 'check_a', None)
+            assert (n_new, complete, entry['capped']) == (2, False, True)
+            assert entry['missing'] == keys[:2]
+            # listing goes on once the missing keys are migrated
+            es.es.docs = {key: {} for key in keys[:2]}
+            entry, n_new, complete = reconcile_check(s3, es, 'check_a', entry)
+        assert entry['missing'] == keys[2:4]
+        assert entry['last_s3_key'] == keys[3]
+
+    @mock_aws
+    def test_run_keys(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 3)
+        es = FakeES()
+        migrator = CheckStoreMigrator(s3, es).run_keys(keys[1:], time_limit=60)
+        assert sorted(es.es.docs) == sorted(keys[1:])
+        assert migrator.complete is True
+
+
+class FakeDeleteClient(FakeBulkClient):
+
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def delete_by_query(self, index, body, conflicts):
+        self.queries.append(body)
+        return {'deleted': 2}
+
+
+class TestSweepChecks:
+
+    @mock_aws
+    def test_sweep_all_checks(self):
+        s3 = FakeS3()
+        a_keys = put_results(s3, 'check_a', 6)
+        b_keys = put_results(s3, 'check_b', 2)
+        s3.put_object('check_a/primary.json', '{}')
+        index = {'check_a': {'last_s3_key': a_keys[-2], 'missing': a_keys[:1] + a_keys[4:5]}}
+        save_reconciliation_index(s3, index)
+        es = FakeES()
+        es.es = FakeDeleteClient()
+        cutoff = '2024-01-01T00:00:03'
+        results, progress = sweep_checks(s3, es, cutoff, workers=2, time_limit=60)
+
+        remaining = {obj['Key'] for page in iter_s3_key_pages(s3) for obj in page}
+        assert remaining >= {'check_a/latest.json', 'check_a/primary.json', 'check_b/latest.json'}
+        assert not remaining & set(a_keys[:3] + b_keys[:2])
+        assert results['check_a']['s3_objects'] == 3
+        assert results['check_a']['s3_bytes'] > 0
+        assert results['check_b']['s3_objects'] == 2
+        assert results['check_a']['es_documents'] == 2
+        assert all(result['complete'] for result in results.values())
+        assert progress['check_a']['swept_to'] == cutoff
+        assert load_sweep_progress(s3)['check_b']['s3_objects'] == 2
+        # the reconciliation index is stored under its check's name too
+        assert set(results) == {'check_a', 'check_b', 'elasticsearch_s3_count_diff'}
+        assert len(es.es.queries) == 3
+        # deleted keys are no longer reported missing
+        assert load_reconciliation_index(s3)['check_a']['missing'] == a_keys[4:5]
+
+    @mock_aws
+    def test_out_of_time(self):
+        s3 = FakeS3()
+        put_results(s3, 'check_a', 2)
+        results, progress = sweep_checks(s3, None, '2025-01-01T00:00:00', time_limit=0)
+        assert results == {}
+        assert progress == {}
+
+    @mock_aws
+    def test_primary_results_kept(self):
+        s3 = FakeS3()
+        keys = put_results(s3, 'check_a', 3)
+        # a result run as primary, with its kwargs stored last as CheckResult does
+        s3.put_object(keys[1], json.dumps({'name': 'check_a', 'uuid': keys[1][8:-5], 'id_alias': keys[1],
+                                           'kwargs': {'uuid': keys[1][8:-5], 'primary': True}}))
+        save_reconciliation_index(s3, {'check_a': {'last_s3_key': keys[2], 'missing': keys[:2]}})
+        es = FakeES()
+        es.es = FakeDeleteClient()
+        results, _ = sweep_checks(s3, es, '2025-01-01T00:00:00', time_limit=60)
+
+        remaining = {obj['Key'] for page in iter_s3_key_pages(s3, prefix='check_a/') for obj in page}
+        assert remaining == {keys[1], 'check_a/latest.json'}
+        assert results['check_a']['s3_objects'] == 2
+        assert results['check_a']['s3_kept_primary'] == 1
+        assert all({'term': {'kwargs.primary': True}} in query['query']['bool']['must_not']
+                   for query in es.es.queries)
+        # the kept primary result is still reported missing
+        assert load_reconciliation_index(s3)['check_a']['missing'] == keys[1:2]
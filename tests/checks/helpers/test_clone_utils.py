@@ -0,0 +1,181 @@
+from unittest.mock import patch
+
+import pytest
+
+from chalicelib_cgap.checks.helpers.clone_utils import (
+    CASE_TO_CLONE_FIELDS, CaseToClone, CloneError, search_by_identifiers
+)
+
+
+class FakePortal:
+    """In-memory portal with the ff_utils calls CaseToClone makes."""
+
+    def __init__(self, fail_post_type=None):
+        self.fail_post_type = fail_post_type
+        self.searches = []
+        self.posts = []
+        self.patches = []
+        self.unique_keys = {}  # posted uuid --> unique fields it holds, kept when deleted as on the portal
+        self.items = {
+            '/cases/CASE1/': {'@id': '/cases/CASE1/', 'accession': 'CASE1', 'uuid': 'case1',
+                              'sample_processing': '/sample-processings/SP1/', 'project': 'p',
+                              'institution': 'i', 'case_title': 'Case One', 'report': '/reports/R1/'},
+            '/sample-processings/SP1/': {'@id': '/sample-processings/SP1/', 'analysis_type': 'WES',
+                                         'samples': ['/samples/S1/', '/samples/S2/'],
+                                         'cases': ['/cases/CASE1/'], 'project': 'p', 'institution': 'i',
+                                         'processed_files': ['/files-processed/F1/', '/files-processed/F2/',
+                                                             '/files-processed/F3/']},
+            '/samples/S1/': {'@id': '/samples/S1/', 'accession': 'S1', 'uuid': 's1', 'bam_sample_id': 'S1-v1',
+                             'aliases': ['lab:S1-v1']},
+            '/samples/S2/': {'@id': '/samples/S2/', 'accession': 'S2', 'uuid': 's2', 'bam_sample_id': 'S2-v1'},
+            '/individuals/I1/': {'@id': '/individuals/I1/', 'samples': ['/samples/S1/', '/samples/S2/']},
+        }
+
+    def get_metadata(self, obj_id, key=None, add_on=''):
+        return dict(self.items[obj_id.split('?')[0]])
+
+    def search_metadata(self, search, key=None):
+        self.searches.append(search)
+        if 'type=File&' in search:
+            return [{'@id': '/files-processed/F1/', 'accession': 'F1', 'file_type': 'full annotated VCF'},
+                    {'@id': '/files-processed/F2/', 'accession': 'F2', 'file_type': 'vep-annotated vcf'}]
+        return [{'@id': '/samples/S1/', 'individual': {'@id': '/individuals/I1/'}},
+                {'@id': '/samples/S2/', 'individual': {'@id': '/individuals/I1/'}}]
+
+    def post_metadata(self, body, item_type, key=None):
+        if item_type == self.fail_post_type:
+            raise Exception('Bad status code for POST request: 422')
+        keys = {('bam_sample_id', body['bam_sample_id'])} if 'bam_sample_id' in body else set()
+        keys.update(('aliases', alias) for alias in body.get('aliases', []))
+        if any(keys & held for held in self.unique_keys.values()):
+            raise Exception('Bad status code for POST request: 409 conflict')
+        idx = len(self.posts)
+        self.unique_keys['new%s' % idx] = keys
+        item = {'@id': '/%s/NEW%s/' % (item_type, idx), 'uuid': 'new%s' % idx, 'accession': 'NEW%s' % idx}
+        self.posts.append((item_type, body))
+        return {'@graph': [item]}
+
+    def patch_metadata(self, body, obj_id, key=None, add_on=''):
+        self.patches.append((obj_id, body, add_on))
+        if add_on.startswith('delete_fields=') and obj_id in self.unique_keys:
+            fields = add_on[len('delete_fields='):].split(',')
+            self.unique_keys[obj_id] = {(field, value) for field, value in self.unique_keys[obj_id]
+                                        if field not in fields}
+
+
+@pytest.fixture
+def portal():
+    return FakePortal()
+
+
+def patch_portal(portal):
+    return patch.multiple(
+        'dcicutils.ff_utils', get_metadata=portal.get_metadata, search_metadata=portal.search_metadata,
+        post_metadata=portal.post_metadata, patch_metadata=portal.patch_metadata
+    )
+
+
+class TestCaseToClone:
+
+    def test_clone(self, portal):
+        with patch_portal(portal):
+            clone = CaseToClone('/cases/CASE1/', {}, None, '2', [])
+        assert sorted(item_type for item_type, _ in portal.posts) == [
+            'case', 'report', 'sample', 'sample', 'sample_processing'
+        ]
+        sample_ids = sorted(body['bam_sample_id'] for item_type, body in portal.posts if item_type == 'sample')
+        assert sample_ids == ['S1-v2', 'S2-v2']
+        # both new samples added to the shared individual in one patch
+        individual_patches = [body for obj_id, body, _ in portal.patches if obj_id == '/individuals/I1/']
+        assert len(individual_patches) == 1
+        assert len(individual_patches[0]['samples']) == 4
+        assert clone.new_case_dict['CASE1']['new case accession'].startswith('NEW')
+        assert [entry['step'] for entry in clone.journal.entries][-1] == 'superseded_by:/cases/CASE1/'
+
+    def test_sample_processing_files_in_one_search(self, portal):
+        with patch_portal(portal):
+            CaseToClone('/cases/CASE1/', {}, None, '2', [], add_vep_to_sp=True)
+        file_searches = [search for search in portal.searches if 'type=File&' in search]
+        assert file_searches == [
+            'search/?type=File&accession=F1&accession=F2&accession=F3&field=accession&field=file_type'
+        ]
+        sp_body = [body for item_type, body in portal.posts if item_type == 'sample_processing'][0]
+        assert sp_body['processed_files'] == ['/files-processed/F2/']
+
+    def test_failed_clone_rolled_back(self):
+        portal = FakePortal(fail_post_type='case')
+        with patch_portal(portal):
+            with pytest.raises(CloneError) as exc_info:
+                CaseToClone('/cases/CASE1/', {}, None, '2', [])
+        assert exc_info.value.journal == []
+        reverted = {obj_id: body for obj_id, body, _ in portal.patches[1:]}
+        assert reverted['/individuals/I1/'] == {'samples': ['/samples/S1/', '/samples/S2/']}
+        deleted = [obj_id for obj_id, body, _ in portal.patches if body == {'status': 'deleted'}]
+        assert len(deleted) == 4  # 2 samples, sample processing and report
+
+    def test_clone_again_after_rollback(self):
+        portal = FakePortal(fail_post_type='case')
+        with patch_portal(portal):
+            with pytest.raises(CloneError):
+                CaseToClone('/cases/CASE1/', {}, None, '2', [])
+            sample_rollbacks = [add_on for _, body, add_on in portal.patches
+                                if body == {'status': 'deleted'} and add_on]
+            assert sample_rollbacks == ['delete_fields=bam_sample_id,aliases'] * 2
+            portal.fail_post_type = None
+            clone = CaseToClone('/cases/CASE1/', {}, None, '2', [])
+        new_samples = [body for item_type, body in portal.posts if item_type == 'sample'][-2:]
+        assert sorted(body['bam_sample_id'] for body in new_samples) == ['S1-v2', 'S2-v2']
+        assert 'CASE1' in clone.new_case_dict
+
+    def test_resume_from_journal(self):
+        portal = FakePortal(fail_post_type='case')
+        with patch_portal(portal):
+            with pytest.raises(CloneError) as exc_info:
+                CaseToClone('/cases/CASE1/', {}, None, '2', [], rollback=False)
+            journal = exc_info.value.journal
+            assert len(journal) == 5
+            portal.fail_post_type = None
+            n_posts = len(portal.posts)
+            clone = CaseToClone('/cases/CASE1/', {}, None, '2', [], journal=journal)
+        assert [item_type for item_type, _ in portal.posts[n_posts:]] == ['case']
+        assert 'CASE1' in clone.new_case_dict
+
+    @patch('chalicelib_cgap.checks.helpers.clone_utils.create_metawfr.create_metawfr_from_case', create=True)
+    def test_metawfr_journaled(self, mock_create):
+        portal = FakePortal(fail_post_type='MetaWorkflowRun')
+        portal.items['/sample-processings/SP1/']['analysis_type'] = 'WGS'
+        mock_create.side_effect = lambda **kwargs: {'uuid': 'local', 'case': kwargs['case_uuid']}
+        with patch_portal(portal):
+            with pytest.raises(CloneError) as exc_info:
+                CaseToClone('/cases/CASE1/', {}, 'mwf', '2', [], rollback=False)
+            assert mock_create.call_args[1]['post'] is False
+            assert mock_create.call_args[1]['patch_case'] is False
+            portal.fail_post_type = None
+            n_posts = len(portal.posts)
+            clone = CaseToClone('/cases/CASE1/', {}, 'mwf', '2', [], journal=exc_info.value.journal)
+        assert [item_type for item_type, _ in portal.posts[n_posts:]] == ['MetaWorkflowRun']
+        new_case_uuid = clone.new_case_dict['CASE1']['new case uuid']
+        assert portal.patches[-1] == (new_case_uuid, {'meta_workflow_run': clone.meta_wfr['uuid']}, '')
+        assert [entry['step'] for entry in clone.journal.entries][-2:] == [
+            'meta_workflow_run', 'meta_workflow_run:' + new_case_uuid
+        ]
+
+
+class TestSearchByIdentifiers:
+
+    @patch('dcicutils.ff_utils.search_metadata')
+    def test_search_by_identifiers(self, mock_search):
+        case_uuid = '6a1c7b9e-5f3e-4d2a-9c1b-0e8f7a6d5c4b'
+        mock_search.side_effect = [
+            [{'@id': '/cases/GAPCA1/', 'accession': 'GAPCA1', 'superseded_by': None},
+             {'@id': '/cases/GAPCA2/', 'accession': 'GAPCA2'}],
+            [{'@id': '/cases/GAPCA3/', 'uuid': case_uuid}],
+        ]
+        identifiers = ['GAPCA1', '/cases/GAPCA2/', 'GAPCA9', case_uuid]
+        found = search_by_identifiers('Case', identifiers, CASE_TO_CLONE_FIELDS, {})
+        assert sorted(found) == sorted(['GAPCA1', '/cases/GAPCA2/', case_uuid])
+        assert mock_search.call_count == 2
+        accession_query = mock_search.call_args_list[0][0][0]
+        assert accession_query.startswith('search/?type=Case&accession=GAPCA1&accession=GAPCA2&accession=GAPCA9')
+        assert '&field=meta_workflow_run.meta_workflow.name' in accession_query
+        assert accession_query.count('&field=accession') == 1
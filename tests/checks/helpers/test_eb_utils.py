@@ -0,0 +1,33 @@
+import datetime
+from unittest.mock import MagicMock
+
+from chalicelib_cgap.checks.helpers import eb_utils
+
+
+class TestEbUtils:
+
+    def make_client(self):
+        client = MagicMock()
+        client.describe_environment_health.return_value = {'Color': 'Green'}
+        client.describe_instances_health.return_value = {'InstanceHealthList': [
+            {'Deployment': {'VersionLabel': label}} for label in ['v1', 'v2', 'v1', 'v1']
+        ]}
+        client.describe_application_versions.side_effect = lambda ApplicationName, VersionLabels: {
+            'ApplicationVersions': [{'VersionLabel': VersionLabels[0], 'DateCreated': datetime.datetime(2022, 1, 1)}]
+        }
+        return client
+
+    def test_collect_environment_health(self):
+        eb_utils.clear_describe_cache()
+        client = self.make_client()
+        env_health, instances_health, versions = eb_utils.collect_environment_health('cgap-test', client=client)
+        assert env_health == {'Color': 'Green'}
+        assert sorted(versions) == ['v1', 'v2']
+        assert client.describe_application_versions.call_count == 2
+        # second collection in the same window is served from cache
+        eb_utils.collect_environment_health('cgap-test', client=client)
+        assert client.describe_environment_health.call_count == 1
+        assert client.describe_application_versions.call_count == 2
+        eb_utils.clear_describe_cache('cgap-test')
+        eb_utils.collect_environment_health('cgap-test', client=client)
+        assert client.describe_environment_health.call_count == 2
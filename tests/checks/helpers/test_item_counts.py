@@ -0,0 +1,50 @@
+import datetime
+import json
+
+from chalicelib_cgap.checks.helpers.item_counts import ItemCountSeries, forecast_indexing
+
+
+class TestItemCountSeries:
+
+    start = datetime.datetime(2022, 5, 24)
+
+    def make_series(self):
+        series = ItemCountSeries()
+        for minutes, (db, es) in enumerate([(10, 8), (12, 12), (15, 13)]):
+            counts = {'ALL': {'DB': db, 'ES': es}}
+            if minutes != 1:
+                counts['Case'] = {'DB': db - 5, 'ES': es - 5}
+            series.append(self.start + datetime.timedelta(minutes=10 * minutes), counts)
+        return series
+
+    def test_lookups(self):
+        series = self.make_series()
+        assert len(series) == 3
+        assert series.closest_index(self.start - datetime.timedelta(days=1)) == 0
+        assert series.closest_index(self.start + datetime.timedelta(minutes=14)) == 1
+        assert series.closest_index(self.start + datetime.timedelta(days=1)) == 2
+        assert series.counts_at(1) == {'ALL': {'DB': 12, 'ES': 12}}
+        assert series.counts_at(2)['Case'] == {'DB': 10, 'ES': 8}
+        assert series.unindexed_at(0) == 2
+
+    def test_round_trip_and_trim(self):
+        series = ItemCountSeries.from_dict(json.loads(self.make_series().to_json()))
+        assert series.time_at(2) == self.start + datetime.timedelta(minutes=20)
+        series.trim(self.start + datetime.timedelta(minutes=5))
+        assert len(series) == 2
+        assert series.counts_at(0) == {'ALL': {'DB': 12, 'ES': 12}}
+        assert series.counts_at(1)['Case'] == {'DB': 10, 'ES': 8}
+
+    def test_forecast_indexing(self):
+        series = ItemCountSeries()
+        for minutes in range(0, 50, 10):
+            backlog = 100 - 2 * minutes
+            series.append(self.start + datetime.timedelta(minutes=minutes), {
+                'ALL': {'DB': 1000, 'ES': 1000 - backlog},
+                'Case': {'DB': 500, 'ES': 500 - backlog},
+                'Family': {'DB': 10, 'ES': 10},
+            })
+        forecast = forecast_indexing(series, datetime.timedelta(minutes=25))
+        assert forecast['snapshots'] == 3
+        assert forecast['types']['ALL'] == {'backlog': 20, 'items_per_minute': 2.0, 'eta_minutes': 10}
+        assert 'Family' not in forecast['types']
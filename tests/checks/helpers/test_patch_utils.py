@@ -0,0 +1,62 @@
+import datetime
+from unittest.mock import patch
+
+from chalicelib_cgap.checks.helpers.patch_utils import (
+    bulk_patch_metadata, is_transient_error, staged_bulk_patch_metadata
+)
+
+
+class TestBulkPatchMetadata:
+
+    bad_request = "Bad status code for PATCH request for https://cgap.org/abc: 422. Reason: invalid"
+    unavailable = "Bad status code for PATCH request for https://cgap.org/abc: 503. Reason: unavailable"
+
+    def test_is_transient_error(self):
+        assert is_transient_error(Exception(self.unavailable))
+        assert is_transient_error(Exception("Error with PATCH request for https://cgap.org/abc"))
+        assert not is_transient_error(Exception(self.bad_request))
+        assert not is_transient_error(Exception("Something else"))
+
+    @patch('dcicutils.ff_utils.patch_metadata')
+    def test_bulk_patch_metadata(self, mock_patch_metadata):
+        def patch_metadata(patch_body, obj_id=None, key=None, add_on=None):
+            if obj_id == "bad":
+                raise Exception(self.bad_request)
+
+        mock_patch_metadata.side_effect = patch_metadata
+        patches = {obj_id: {"status": "deleted"} for obj_id in ["a", "b", "bad", "done"]}
+        report = bulk_patch_metadata(patches, {}, max_workers=2, already_patched={"done"})
+        assert sorted(report.success) == ["a", "b"]
+        assert list(report.error) == ["bad"]
+        assert report.skipped == ["done"]
+        assert report.not_attempted == []
+        assert mock_patch_metadata.call_count == 3
+
+    @patch('chalicelib_cgap.checks.helpers.patch_utils.time.sleep')
+    @patch('dcicutils.ff_utils.patch_metadata')
+    def test_bulk_patch_metadata_retries(self, mock_patch_metadata, mock_sleep):
+        mock_patch_metadata.side_effect = [Exception(self.unavailable), None]
+        report = bulk_patch_metadata({"a": {}}, {})
+        assert report.success == ["a"]
+        assert report.retries == 1
+        assert mock_sleep.call_count == 1
+
+    @patch('dcicutils.ff_utils.patch_metadata')
+    def test_bulk_patch_metadata_time_limit(self, mock_patch_metadata):
+        start = datetime.datetime.utcnow() - datetime.timedelta(seconds=10)
+        report = bulk_patch_metadata({"a": {}, "b": {}}, {}, start=start, time_limit=5)
+        assert report.not_attempted == ["a", "b"]
+        mock_patch_metadata.assert_not_called()
+
+    @patch('dcicutils.ff_utils.patch_metadata')
+    def test_staged_bulk_patch_metadata(self, mock_patch_metadata):
+        def patch_metadata(patch_body, obj_id=None, key=None, add_on=None):
+            if obj_id == "bad":
+                raise Exception(self.bad_request)
+
+        mock_patch_metadata.side_effect = patch_metadata
+        stages = [{"a": {}, "b": {}}, {"bad": {}}, {"c": {}}]
+        report = staged_bulk_patch_metadata(stages, {})
+        assert sorted(report.success) == ["a", "b"]
+        assert list(report.error) == ["bad"]
+        assert report.not_attempted == ["c"]
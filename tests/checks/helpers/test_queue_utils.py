@@ -0,0 +1,74 @@
+import json
+import uuid
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from chalicelib_cgap.checks.helpers.queue_utils import CompactUuidSet, QueueDeduplicator, ReservoirSample
+
+
+class TestQueueDeduplicator:
+
+    dedup_msg = 'FS dedup uuid: test'
+
+    def make_queue(self, uuids):
+        client = boto3.client('sqs', region_name='us-east-1')
+        queue_url = client.create_queue(QueueName='test-secondary-indexer-queue')['QueueUrl']
+        for idx in range(0, len(uuids), 10):
+            client.send_message_batch(QueueUrl=queue_url, Entries=[
+                {'Id': str(i), 'MessageBody': json.dumps({'uuid': uuid, 'sid': 5})}
+                for i, uuid in enumerate(uuids[idx: idx + 10])
+            ])
+        return client, queue_url
+
+    @mock_aws
+    @pytest.mark.parametrize('compact', [False, True])
+    def test_deduplicate_queue(self, compact):
+        unique = [str(uuid.uuid4()) for _ in range(24)] + ['not-a-uuid']
+        uuids = [unique[i % 25] for i in range(100)]
+        client, queue_url = self.make_queue(uuids)
+        dedup = QueueDeduplicator(client, queue_url, self.dedup_msg, 10, len(uuids), workers=4, compact=compact)
+        dedup.run(time_limit=60)
+        stats = dedup.stats()
+        assert stats['uuids_covered'] == 25
+        assert stats['replaced'] == 25
+        assert stats['deduplicated'] + stats['replaced'] + stats['repeat_replaced'] == stats['total_messages_covered']
+        assert stats['deleted'] == stats['total_messages_covered']
+        assert stats['exit_reason'] in ('starting uuids fully covered', 'no messages left')
+        # recycled messages are stamped and carry the max sid
+        remaining = client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=3)
+        for msg in remaining.get('Messages', []):
+            body = json.loads(msg['Body'])
+            assert body['fs_detail'] == self.dedup_msg
+            assert body['sid'] == 10
+
+
+class TestCompactUuidSet:
+
+    def test_matches_set(self):
+        values = [str(uuid.uuid4()) for _ in range(5000)] + ['not-a-uuid']
+        compact = CompactUuidSet(capacity=16)
+        expected = set()
+        for idx, value in enumerate(values):
+            compact.add(value)
+            expected.add(value)
+            if idx % 3 == 0:
+                compact.discard(value)
+                expected.discard(value)
+        compact.add(values[0])
+        expected.add(values[0])
+        assert len(compact) == len(expected)
+        assert all((value in compact) == (value in expected) for value in values)
+        assert str(uuid.uuid4()) not in compact
+        assert compact.nbytes < sum(len(value) for value in expected) * 2
+
+
+class TestReservoirSample:
+
+    def test_bounded(self):
+        sample = ReservoirSample(max_size=10)
+        sample.extend(range(1000))
+        assert sample.count == 1000
+        assert len(sample.items) == 10
+        assert len(set(sample.items)) == 10
@@ -0,0 +1,9 @@
+from chalicelib_cgap.checks.helpers.utils import add_field_projection
+
+
+class TestUtils:
+
+    def test_add_field_projection(self):
+        query = 'search/?type=File&field=uuid'
+        result = add_field_projection(query, ['uuid', '@id', 'lab.uuid', '@id'])
+        assert result == 'search/?type=File&field=uuid&field=@id&field=lab.uuid'
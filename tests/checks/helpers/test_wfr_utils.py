@@ -1 +1,347 @@
-from chalicelib_cgap.checks.helpers.wfr_utils import *
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from chalicelib_cgap.checks.helpers.wfr_utils import *
+from chalicelib_cgap.checks.helpers.wfrset_utils import base_step_settings, step_settings, wf_dict
+
+
+class TestWorkflowIndex:
+
+    def test_index_matches_details(self):
+        for app_name, details in workflow_details.items():
+            info = workflow_index[app_name]
+            assert info.versions == frozenset(details['accepted_versions'])
+            assert info.latest_version == details['accepted_versions'][-1]
+            assert info.run_time == details['run_time']
+        assert workflow_index['md5'].workflow_uuid == wf_templates['md5']['workflow_uuid']
+        assert workflow_index['fastqc'].workflow_uuid is None
+
+    def test_check_latest_workflow_version(self):
+        md5_uuid = workflow_index['md5'].workflow_uuid
+        workflows = [
+            {'app_name': 'md5', 'app_version': '0.2.6', 'uuid': md5_uuid},
+            {'app_name': 'md5', 'app_version': '0.0.4', 'uuid': 'old'},
+            {'app_name': 'fastqc', 'app_version': 'v2', 'uuid': 'x'},
+            {'app_name': 'unknown', 'app_version': 'v1', 'uuid': 'y'},
+        ]
+        assert check_latest_workflow_version(workflows) == []
+        workflows[0]['uuid'] = 'wrong'
+        assert check_latest_workflow_version(workflows) == [
+            'md5 item on wf_dict does not have the latest workflow uuid'
+        ]
+        assert check_latest_workflow_version(workflows[1:]) == [
+            'md5 version 0.2.6 is not on any wf app_version)'
+        ]
+
+    def test_get_wfr_out_versions(self):
+        wfrs = [
+            {'uuid': 'a', 'display_title': 'md5 0.2.6 run 2024-01-01 00:00:00.000000',
+             'run_status': 'complete', 'output_files': []},
+            {'uuid': 'b', 'display_title': 'md5 0.0.1 run 2024-01-02 00:00:00.000000',
+             'run_status': 'error', 'output_files': []},
+        ]
+        emb_file = {'workflow_run_inputs': [dict(wfr) for wfr in wfrs]}
+        assert get_wfr_out(emb_file, 'md5', all_wfrs=wfrs, md_qc=True) == {'status': 'complete'}
+        assert get_wfr_out(emb_file, 'md5', all_wfrs=wfrs, md_qc=True, versions=['0.0.1']) == {
+            'status': 'no complete run, too many errors'
+        }
+
+
+class TestWfrSummary:
+
+    def test_parse(self):
+        summary = wfr_summary({'uuid': 'a', 'display_title': 'md5 0.2.6 run on 2024-01-01 12:00:00',
+                               'run_status': 'running'})
+        assert (summary.uuid, summary.type, summary.version, summary.status) == ('a', 'md5', '0.2.6', 'running')
+        assert summary.run_epoch == datetime(2024, 1, 1, 12).replace(tzinfo=timezone.utc).timestamp()
+        assert not hasattr(summary, '__dict__')
+        assert summary is wfr_summary({'uuid': 'a', 'display_title': 'md5 0.2.6 run on 2024-01-01 12:00:00',
+                                       'run_status': 'running'})
+
+    def test_get_wfr_out_latest_run_without_mutation(self):
+        now = datetime.utcnow()
+        wfrs = [
+            {'uuid': uuid, 'display_title': 'md5 0.2.6 run ' + str(now - timedelta(hours=hours)),
+             'run_status': status, 'output_files': []}
+            for uuid, hours, status in [('old', 30, 'error'), ('new', 2, 'started'), ('mid', 10, 'complete')]
+        ]
+        emb_file = {'workflow_run_inputs': [dict(wfr) for wfr in wfrs]}
+        original = json.dumps(emb_file), json.dumps(wfrs)
+        assert get_wfr_out(emb_file, 'md5', all_wfrs=wfrs, md_qc=True) == {'status': 'running'}
+        assert get_wfr_out(emb_file, 'md5', all_wfrs=wfrs, md_qc=True, run=1) == {
+            'status': 'no complete run, too many time-outs'
+        }
+        assert (json.dumps(emb_file), json.dumps(wfrs)) == original
+
+
+class TestStepSettings:
+
+    def test_settings_not_shared(self):
+        original = json.dumps(wf_dict, sort_keys=True)
+        first = step_settings('md5', 'human', {'lab': 'a'}, overwrite={'config': {'ebs_size': 99}})
+        first['config']['instance_type'] = 'changed'
+        first['parameters']['x'] = 1
+        second = step_settings('md5', 'human', {'lab': 'b'})
+        assert second['config']['ebs_size'] == 10
+        assert second['config']['instance_type'] == 't3.small'
+        assert second['config']['behavior_on_capacity_limit'] == 'wait_and_retry'
+        assert second['parameters'] == {}
+        assert second['common_fields'] == {'lab': 'b'}
+        assert json.dumps(wf_dict, sort_keys=True) == original
+
+    def test_base_settings_memoized_and_frozen(self):
+        base = base_step_settings('md5', 'human')
+        assert base is base_step_settings('md5', 'human')
+        with pytest.raises(TypeError):
+            base['config']['ebs_size'] = 1
+
+    def test_unknown_step(self):
+        with pytest.raises(ValueError):
+            step_settings('not-a-step', 'human', {})
+
+
+class FakeTibannaAPI:
+    """Tibanna API recording runs, throttled for the first calls per run,
+    and the Step Functions client describing its executions."""
+
+    def __init__(self, throttle_first=0, fail=(), throttle_after_start=()):
+        self.throttle_first = throttle_first
+        self.fail = fail
+        self.throttle_after_start = throttle_after_start
+        self.calls = {}
+        self.inputs = {}
+        self.run_names = {}
+        self.executions = set()
+
+    def randomize_run_name(self, run_name, sfn):
+        return run_name + '-1' if run_name in self.executions else run_name
+
+    def run_workflow(self, input_json, sfn=None, sleep=3, verbose=True):
+        run_id = input_json['_tibanna']['run_id']
+        self.calls[run_id] = self.calls.get(run_id, 0) + 1
+        self.inputs[run_id] = input_json
+        self.run_names.setdefault(run_id, set()).add((input_json['jobid'], input_json['_tibanna']['run_name']))
+        if run_id in self.fail:
+            raise Exception('Workflow does not exist')
+        if self.calls[run_id] <= self.throttle_first:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'StartExecution')
+        run_name = self.randomize_run_name(input_json['_tibanna']['run_name'], sfn)
+        self.executions.add(run_name)
+        if run_id in self.throttle_after_start:
+            # the cost updater's execution is throttled
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'StartExecution')
+        return {'_tibanna': {'url': 'https://console.aws.amazon.com/states/' + run_id}}
+
+    def describe_execution(self, executionArn):
+        if executionArn.split(':')[-1] not in self.executions:
+            raise ClientError({'Error': {'Code': 'ExecutionDoesNotExist', 'Message': executionArn}},
+                              'DescribeExecution')
+        return {'executionArn': executionArn}
+
+
+class TestWorkflowSubmitter:
+
+    @staticmethod
+    def submissions(run_ids):
+        template = {'app_name': 'md5', 'config': {}, 'common_fields': {}}
+        return {run_id: (template, {'input_file': run_id + '-uuid'}, run_id) for run_id in run_ids}
+
+    def test_submit_all(self):
+        api = FakeTibannaAPI(fail=('GAPFI3',))
+        submitter = WorkflowSubmitter('env', 'sfn', api=api, backoff=0, sfn_client=api)
+        submissions = self.submissions(['GAPFI1', 'GAPFI2', 'GAPFI3'])
+        results = submitter.submit_all(submissions)
+        assert results['GAPFI1'] == {
+            'status': 'started', 'url': 'https://console.aws.amazon.com/states/GAPFI1', 'costupdater_started': True,
+            'attempts': 1
+        }
+        assert results['GAPFI3'] == {'status': 'failed', 'error': 'Workflow does not exist', 'attempts': 1}
+        assert api.inputs['GAPFI2']['input_files'] == [{'workflow_argument_name': 'input_file',
+                                                        'uuid': 'GAPFI2-uuid'}]
+        # templates are shared by runs and left as given
+        assert 'input_files' not in submissions['GAPFI1'][0]
+
+    def test_throttled_runs_retried(self):
+        api = FakeTibannaAPI(throttle_first=2)
+        submitter = WorkflowSubmitter('env', 'sfn', api=api, backoff=0, sfn_client=api)
+        results = submitter.submit_all(self.submissions(['GAPFI1', 'GAPFI2']))
+        assert all(result['status'] == 'started' and result['attempts'] == 3 for result in results.values())
+        api = FakeTibannaAPI(throttle_first=5)
+        submitter = WorkflowSubmitter('env', 'sfn', api=api, backoff=0, sfn_client=api)
+        result = submitter.submit(*self.submissions(['GAPFI1'])['GAPFI1'])
+        assert result['status'] == 'failed' and result['attempts'] == MAX_SUBMIT_ATTEMPTS
+        # every attempt starts the same run
+        assert len(api.run_names['GAPFI1']) == 1
+        assert api.inputs['GAPFI1']['_tibanna']['run_name'] == 'md5_GAPFI1'
+
+    def test_started_run_not_retried(self):
+        api = FakeTibannaAPI(throttle_after_start=('GAPFI1',))
+        submitter = WorkflowSubmitter('env', 'sfn', api=api, backoff=0, sfn_client=api)
+        result = submitter.submit(*self.submissions(['GAPFI1'])['GAPFI1'])
+        assert result['status'] == 'started' and result['attempts'] == 1
+        assert result['costupdater_started'] is False
+        assert result['url'].endswith(':execution:sfn:md5_GAPFI1')
+        assert api.calls['GAPFI1'] == 1
+        assert api.executions == {'md5_GAPFI1'}
+
+    def test_not_attempted_past_time_limit(self):
+        api = FakeTibannaAPI()
+        submitter = WorkflowSubmitter('env', 'sfn', api=api)
+        start = datetime.utcnow() - timedelta(seconds=LAMBDA_LIMIT + 5)
+        results = submitter.submit_all(self.submissions(['GAPFI1']), start=start)
+        assert results == {'GAPFI1': {'status': 'not_attempted'}}
+        assert not api.calls
+
+
+class TestFilterWfrsWithInputAndTag:
+
+    @staticmethod
+    def wfr(app_name, inputs, tags=()):
+        title = app_name + ' run ' + '_'.join(inputs)
+        return {'display_title': title, 'title': title, 'tags': list(tags),
+                'input_files': [{'value': {'@id': an_input}} for an_input in inputs] + [{}]}
+
+    def library_wfrs(self):
+        return [
+            self.wfr('workflow_gatk-CombineGVCFs', ['/files-processed/A/', '/files-processed/B/'], ['sp1']),
+            self.wfr('workflow_gatk-CombineGVCFs', ['/files-processed/B/', '/files-processed/A/'], ['sp2']),
+            self.wfr('workflow_gatk-CombineGVCFs', ['/files-processed/A/', '/files-processed/B/',
+                                                    '/files-processed/C/']),
+            self.wfr('workflow_gatk-GenotypeGVCFs', ['/files-processed/A/', '/files-processed/B/']),
+            self.wfr('workflow_gatk-CombineGVCFs', ['/files-processed/A/', '/files-processed/A/']),
+        ]
+
+    def test_exact_match(self):
+        wfrs = self.library_wfrs()
+        input_file_dict = {'input_gvcfs': ['/files-processed/B/', '/files-processed/A/']}
+        found = filter_wfrs_with_input_and_tag(wfrs, 'workflow_gatk-CombineGVCFs', input_file_dict, '')
+        assert found == wfrs[:2]
+        found = filter_wfrs_with_input_and_tag(wfrs, 'workflow_gatk-CombineGVCFs', input_file_dict, 'sp2')
+        assert found == [wfrs[1]]
+        # repeated inputs only match runs with the same repeats
+        found = filter_wfrs_with_input_and_tag(wfrs, 'workflow_gatk-CombineGVCFs',
+                                               {'input_gvcfs': ['/files-processed/A/']}, '')
+        assert found == []
+
+    def test_partial_match(self):
+        wfrs = self.library_wfrs()
+        index = WorkflowRunIndex(wfrs)
+        input_file_dict = {'input_gvcfs': ['/files-processed/A/'], 'reference': '/files-processed/B/'}
+        found = filter_wfrs_with_input_and_tag(wfrs, 'workflow_gatk-CombineGVCFs', input_file_dict, '',
+                                               match_all_input=False, wfr_index=index)
+        assert found == wfrs[:3]
+        found = index.filter('workflow_gatk-CombineGVCFs', ['/files-processed/C/'], '', match_all_input=False)
+        assert found == [wfrs[2]]
+        assert index.filter('workflow_gatk', ['/files-processed/D/'], '', match_all_input=False) == []
+        assert index.filter('workflow_gatk-GenotypeGVCFs', [], '', match_all_input=False) == [wfrs[3]]
+
+    def test_stale_index_rebuilt(self):
+        wfrs = self.library_wfrs()
+        index = WorkflowRunIndex(wfrs)
+        input_file_dict = {'input_gvcfs': ['/files-processed/C/']}
+        new_wfr = self.wfr('workflow_gatk-CombineGVCFs', ['/files-processed/C/'])
+        # runs added to the library, or the library replaced, after the index was built
+        wfrs.append(new_wfr)
+        assert not index.indexes(wfrs)
+        found = filter_wfrs_with_input_and_tag(wfrs, 'workflow_gatk-CombineGVCFs', input_file_dict, '',
+                                               wfr_index=index)
+        assert found == [new_wfr]
+        found = filter_wfrs_with_input_and_tag([new_wfr], 'workflow_gatk-CombineGVCFs', input_file_dict, '',
+                                               wfr_index=WorkflowRunIndex(wfrs[:1]))
+        assert found == [new_wfr]
+
+
+class TestQualityMetrics:
+
+    qcs = {
+        'qclist': {'display_title': 'QualityMetricQclist from 2024-01-01',
+                   'qc_list': [{'value': {'display_title': 'QualityMetricBamcheck from 2024-01-01'}}]},
+        'fastqc': {'display_title': 'QualityMetricFastqc from 2024-01-01'},
+    }
+
+    def test_files_with_qc_metric_fetches_each_qc_once(self):
+        fetched = []
+        lock = threading.Lock()
+
+        def get_metadata(obj_id, key=None):
+            with lock:
+                fetched.append(obj_id)
+            time.sleep(0.01)
+            return self.qcs[obj_id]
+
+        files = [{'quality_metric': {'uuid': 'qclist'}}] * 5 + [{'quality_metric': {'uuid': 'fastqc'}}, {}]
+        with patch.object(ff_utils, 'get_metadata', side_effect=get_metadata):
+            found = files_with_qc_metric(files, 'Bamcheck', {})
+        assert found == [True] * 5 + [False, False]
+        assert sorted(fetched) == ['fastqc', 'qclist']
+
+    def test_failed_fetch_not_cached(self):
+        qc_cache = QualityMetricCache({})
+        with patch.object(ff_utils, 'get_metadata', side_effect=Exception('Bad status code')):
+            with pytest.raises(Exception):
+                qc_cache.get('fastqc')
+        with patch.object(ff_utils, 'get_metadata', return_value=self.qcs['fastqc']):
+            assert is_there_my_qc_metric({'quality_metric': {'uuid': 'fastqc'}}, 'Fastqc', {}, qc_cache=qc_cache)
+
+
+class FakeCheck:
+
+    def __init__(self):
+        self.summary = ''
+        self.brief_output = []
+        self.full_output = {}
+        self.status = 'PASS'
+        self.allow_action = False
+
+
+class TestCheckRunsWithoutOutput:
+
+    def test_reports_in_file_order(self):
+        statuses = {'F1': 'running', 'F2': 'complete', 'F3': 'no completed run, time-out', 'F4': 'running'}
+
+        def get_wfr_out(a_file, run_name, key=None, md_qc=False):
+            return {'status': statuses[a_file['accession']]}
+
+        files = [{'accession': accession} for accession in statuses]
+        with patch('chalicelib_cgap.checks.helpers.wfr_utils.get_wfr_out', side_effect=get_wfr_out):
+            check = check_runs_without_output(files, FakeCheck(), 'fastqc', {}, datetime.utcnow())
+        assert check.full_output == {'running': ['F1', 'F4'], 'files_without_run': ['F3'],
+                                     'files_without_changes': ['F2']}
+        assert check.allow_action and check.status == 'WARN'
+
+    def test_time_limit(self):
+        start = datetime.utcnow() - timedelta(seconds=LAMBDA_LIMIT + 5)
+        check = check_runs_without_output([{'accession': 'F1'}], FakeCheck(), 'fastqc', {}, start)
+        assert check.brief_output == ['did not complete checking all']
+
+
+class TestRemoveDuplicateNeedRuns:
+
+    def test_duplicates_removed_in_order(self):
+        quad = ['/files-processed/GAPFI1/', '/files-processed/GAPFI2/', '/files-processed/GAPFI3/']
+        combine = ['step2', ['workflow_gatk-CombineGVCFs', 'human', {'parameters': {'a': 1, 'b': 2}}],
+                   {'input_gvcfs': quad}, 'GAPFI1_GAPFI2_GAPFI3']
+        # same run for the other proband, inputs and settings in another order
+        combine_again = ['step2', ['workflow_gatk-CombineGVCFs', 'human', {'parameters': {'b': 2, 'a': 1}}],
+                         {'input_gvcfs': quad[::-1]}, 'GAPFI3_GAPFI2_GAPFI1']
+        tagged = ['step3', ['workflow_granite', 'human', {'wfr_meta': {'tags': ['sp1']}}],
+                  {'input_vcf': quad[0]}, 'sp1']
+        tagged_other = ['step3', ['workflow_granite', 'human', {'wfr_meta': {'tags': ['sp2']}}],
+                        {'input_vcf': quad[0]}, 'sp2']
+        need_runs = [
+            {'/sample-processings/SP1/': [combine, tagged]},
+            {'/sample-processings/SP2/': [combine_again]},
+            {'/sample-processings/SP3/': [combine_again, tagged_other, tagged]},
+        ]
+        assert remove_duplicate_need_runs(need_runs) == [
+            {'/sample-processings/SP1/': [combine, tagged]},
+            {'/sample-processings/SP3/': [tagged_other]},
+        ]
@@ -0,0 +1,26 @@
+from unittest.mock import MagicMock, patch
+
+from chalicelib_cgap.checks.es_checks import elasticsearch_s3_count_diff
+
+
+class FakeCheckResult:
+
+    def __init__(self, connection, name):
+        self.name = name
+        self.full_output = None
+
+
+class TestElasticsearchS3CountDiff:
+
+    @patch('chalicelib_cgap.checks.es_checks.CheckResult', FakeCheckResult)
+    @patch('chalicelib_cgap.checks.es_checks.save_reconciliation_index')
+    @patch('chalicelib_cgap.checks.es_checks.load_reconciliation_index', return_value={})
+    def test_checks_not_reached(self, mock_load, mock_save):
+        # check_b is not in the stored index yet and was not reached in time
+        index = {'check_a': {'last_s3_key': 'check_a/2024-01-01T00:00:00.000000.json', 'missing': []}}
+        with patch('chalicelib_cgap.checks.es_checks.reconcile_s3_es',
+                   return_value=(index, ['check_a', 'check_b'], ['check_a'], 1)):
+            check = elasticsearch_s3_count_diff.__wrapped__(MagicMock(), timeout=240)
+        assert check.full_output['checks_not_reached'] == ['check_b']
+        assert check.status == 'WARN'
+        assert check.summary == 'There are <100 checks not on ES; 1 checks not reached, continued next run'
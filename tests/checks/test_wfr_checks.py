@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from chalicelib_cgap.checks.wfr_checks import md5runCGAP_start
+
+
+class FakeSubmitter:
+
+    def __init__(self, env, sfn):
+        pass
+
+    def submit_all(self, submissions, start=None, time_limit=None):
+        return {
+            'file1': {'status': 'started', 'url': 'url1', 'costupdater_started': True, 'attempts': 1},
+            'file2': {'status': 'started', 'url': 'url2', 'costupdater_started': False, 'attempts': 1},
+        }
+
+
+class TestMd5runCGAPStart:
+
+    @patch('chalicelib_cgap.checks.wfr_checks.wfr_utils.WorkflowSubmitter', FakeSubmitter)
+    @patch('chalicelib_cgap.checks.wfr_checks.get_step_function_name', return_value='sfn')
+    @patch('chalicelib_cgap.checks.wfr_checks.get_md5_workflow', return_value=('md5-uuid', '1.0.0'))
+    def test_runs_started_without_costupdater(self, mock_md5, mock_sfn):
+        action = SimpleNamespace(status=None, output={}, description=None)
+        check_result = {'files_without_md5run': ['file1', 'file2']}
+        attributions = {name: {'project': 'p', 'institution': 'i', 'uuid': name, 'accession': name}
+                        for name in ('file1', 'file2')}
+        with patch('chalicelib_cgap.checks.wfr_checks.initialize_action', return_value=(action, check_result)), \
+                patch('chalicelib_cgap.checks.wfr_checks.wfr_utils.get_file_attributions',
+                      return_value=attributions):
+            action = md5runCGAP_start.__wrapped__(MagicMock(), start_not_switched=False)
+        assert action.output['runs_started'] == {'file1': 'url1', 'file2': 'url2'}
+        assert action.output['runs_started_without_costupdater'] == ['file2']
@@ -0,0 +1,164 @@
+import datetime
+import json
+import re
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from chalicelib_cgap.checks.helpers.clone_utils import CloneError
+from chalicelib_cgap.checks.wrangler_checks import (
+    clone_cases, deletion_stages, expand_deleted_input_cascade, item_counts_by_type
+)
+
+
+def wfr(uuid, inputs=(), outputs=(), qcs=(), title='workflow_gatk run'):
+    return {
+        'uuid': uuid, 'display_title': title,
+        'input_files': [{'value': {'uuid': an_input, 'status': 'released'}} for an_input in inputs],
+        'output_files': [{'value': {'uuid': output}} for output in outputs]
+                        + [{'value_qc': {'uuid': qc}} for qc in qcs],
+    }
+
+
+class FakeSearch:
+    """search_with_fields over live wfrs, recording the input uuids searched."""
+
+    def __init__(self, wfrs):
+        self.wfrs = wfrs
+        self.searched = []
+
+    def __call__(self, query, fields, key):
+        uuids = re.findall(r'input_files\.value\.uuid=([^&]+)', query)
+        self.searched.extend(uuids)
+        return [a_wfr for a_wfr in self.wfrs
+                if any(f['value']['uuid'] in uuids for f in a_wfr['input_files'])]
+
+
+class TestDeletedInputCascade:
+
+    # roots R1 and R2 share output F1; W1 -> W2 is a chain below it, P1 tracks R2's F2
+    roots = [wfr('R1', outputs=['F1'], qcs=['Q1']), wfr('R2', outputs=['F1', 'F2'])]
+    downstream = [
+        wfr('W1', inputs=['F1'], outputs=['F3'], qcs=['Q3']),
+        wfr('W2', inputs=['F3'], outputs=['F4']),
+        wfr('P1', inputs=['F2'], title='File Provenance Tracking run'),
+        # takes a qc uuid as input, must not be found from qcs
+        wfr('X1', inputs=['Q1'], outputs=['F9']),
+    ]
+
+    def expand(self, start=None):
+        search = FakeSearch(self.downstream)
+        with patch('chalicelib_cgap.checks.wrangler_checks.search_with_fields', side_effect=search):
+            result = expand_deleted_input_cascade(self.roots, {}, start or datetime.datetime.utcnow())
+        return result, search
+
+    def test_multi_level_chain(self):
+        (wfrs, provenance, timed_out), search = self.expand()
+        assert not timed_out
+        assert wfrs['W1'] == {'depth': 1, 'root': 'R1', 'items': ['F3', 'Q3']}
+        assert wfrs['W2'] == {'depth': 2, 'root': 'R1', 'items': ['F4']}
+        assert wfrs['R2'] == {'depth': 0, 'root': 'R2', 'items': ['F1', 'F2']}
+        assert provenance == [['F2', 'P1']]
+
+    def test_shared_output_expanded_once_without_qcs(self):
+        (wfrs, _, _), search = self.expand()
+        assert search.searched.count('F1') == 1
+        assert 'Q1' not in search.searched and 'Q3' not in search.searched
+        assert 'X1' not in wfrs
+
+    def test_timed_out(self):
+        start = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+        (wfrs, provenance, timed_out), search = self.expand(start=start)
+        assert timed_out
+        assert set(wfrs) == {'R1', 'R2'}
+        assert not search.searched
+
+    def test_deletion_stages_order(self):
+        (wfrs, _, _), _ = self.expand()
+        assert deletion_stages(wfrs) == [
+            ['F4'], ['W2'],
+            ['F3', 'Q3'], ['W1'],
+            ['F1', 'Q1', 'F2'], ['R1', 'R2'],
+        ]
+
+
+class FakeCheckResult:
+
+    def __init__(self, connection, name):
+        self.name = name
+        self.brief_output = None
+        self.full_output = None
+
+
+class TestItemCountsByType:
+
+    @patch('chalicelib_cgap.checks.wrangler_checks.time.sleep')
+    @patch('chalicelib_cgap.checks.wrangler_checks.CheckResult', FakeCheckResult)
+    def test_counts_reported_when_series_update_fails(self, mock_sleep):
+        counts = {'db_es_compare': {'Case': 'DB: 2 ES: 1'}, 'db_es_total': 'DB: 2 ES: 1'}
+        response = MagicMock(status_code=200, text=json.dumps(counts))
+        with patch('chalicelib_cgap.checks.wrangler_checks.ff_utils.authorized_request', return_value=response), \
+                patch('chalicelib_cgap.checks.wrangler_checks.record_item_counts',
+                      side_effect=Exception('S3 unavailable')):
+            check = item_counts_by_type.__wrapped__(MagicMock(ff_server='https://cgap.example.org'))
+        assert check.status == 'WARN'
+        assert check.full_output == {'Case': {'DB': 2, 'ES': 1}, 'ALL': {'DB': 2, 'ES': 1}}
+
+
+class FakeActionResult:
+
+    def __init__(self, connection, name):
+        self.name = name
+        self.output = None
+        self.status = None
+
+    def get_associated_check_result(self, kwargs):
+        return {'kwargs': {'version': '2'}, 'full_output': {'run': {
+            'CASE1': {'sample_processing': 'sp1', 'metawf_uuid': 'mwf'},
+            'CASE2': {'sample_processing': 'sp1', 'metawf_uuid': 'mwf'},
+            'CASE3': {'sample_processing': 'sp2', 'metawf_uuid': 'mwf'},
+            'CASE4': {'sample_processing': 'sp3', 'metawf_uuid': 'mwf'},
+            'CASE5': {'sample_processing': 'sp3', 'metawf_uuid': 'mwf'},
+        }}}
+
+    def get_latest_result(self):
+        return None
+
+
+class FakeCaseToClone:
+    """Clones every case of the sample processing, as CaseToClone does,
+    recording clones of the same sample processing running at once."""
+
+    sample_processings = {'CASE1': 'sp1', 'CASE2': 'sp1', 'CASE3': 'sp2', 'CASE4': 'sp3', 'CASE5': 'sp3'}
+    fail = ('CASE4',)
+    lock = threading.Lock()
+
+    def __init__(self, accession, key, metawf_uuid, new_version, steps_to_rerun, journal=None, rollback=True):
+        sp = self.sample_processings[accession]
+        with self.lock:
+            self.running.append(sp)
+            self.clones.append(accession)
+            self.overlaps = self.overlaps or self.running.count(sp) > 1
+        time.sleep(0.01)
+        with self.lock:
+            self.running.remove(sp)
+        if accession in self.fail:
+            raise CloneError('Clone of %s failed' % accession, journal=[{'step': 'sample_processing'}])
+        self.new_case_dict = {case: {'new case accession': case + '-v2'}
+                              for case, a_sp in self.sample_processings.items() if a_sp == sp}
+
+
+class TestCloneCases:
+
+    @patch('chalicelib_cgap.checks.wrangler_checks.ActionResult', FakeActionResult)
+    @patch('chalicelib_cgap.checks.wrangler_checks.clone_utils.CaseToClone', FakeCaseToClone)
+    def test_sample_processing_cloned_once(self):
+        FakeCaseToClone.running, FakeCaseToClone.clones, FakeCaseToClone.overlaps = [], [], False
+        action = clone_cases.__wrapped__(MagicMock(), rollback=False, case_workers=3)
+        assert not FakeCaseToClone.overlaps
+        # CASE2 is cloned with CASE1, CASE5 is not tried once CASE4 failed
+        assert sorted(FakeCaseToClone.clones) == ['CASE1', 'CASE3', 'CASE4']
+        assert sorted(action.output['clone success']) == ['CASE1', 'CASE2', 'CASE3']
+        assert sorted(action.output['clone fail']) == ['CASE4', 'CASE5']
+        assert list(action.output['clone journal']) == ['CASE4']
+        assert action.status == 'FAIL'